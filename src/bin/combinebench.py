@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""Benchmark the nested combined medical parser against the shared combiner
+that parses the delegate and each source parser once.  The features of both
+parsers are compared for each text and an error is raised if they differ.
+
+Example (from the project root directory)::
+
+  ./src/bin/combinebench.py -c test-resources/config/combined.conf -r 5
+
+"""
+from typing import Tuple, List, Dict, Any
+from pathlib import Path
+import time
+import plac
+from zensols.cli import CliHarness
+from zensols.config import ConfigFactory
+from zensols.nlp import FeatureDocument, FeatureDocumentParser
+from zensols.mednlp import ApplicationFactory
+
+
+PARSERS: Tuple[str, ...] = (
+    'mednlp_combine_biomed_medcat_doc_parser',
+    'mednlp_combine_shared_biomed_medcat_doc_parser')
+"""The configuration sections of the nested and shared combiners."""
+
+TEXTS: Tuple[str, ...] = (
+    'He was diagnosed with kidney failure and heart disease.',
+    'He loved to smoke but Marlboro cigarettes gave John Smith lung cancer ' +
+    'while he was in Chicago.')
+"""Texts used when no input file is given."""
+
+
+def features(doc: FeatureDocument) -> Tuple[Dict[str, Any], ...]:
+    """Return the features of each token and the entity spans of ``doc``."""
+    return (tuple(map(lambda t: t.asdict(), doc.token_iter())),
+            tuple(map(lambda e: e.lexspan.astuple, doc.entities)))
+
+
+@plac.annotations(
+    config=('The application configuration file', 'option', 'c', Path),
+    input=('A file of texts to parse, one per line', 'option', 'i', Path),
+    rounds=('The number of times to parse the texts', 'option', 'r', int))
+def benchmark(config: Path = Path('test-resources/config/combined.conf'),
+              input: Path = None, rounds: int = 3):
+    """Benchmark the nested and shared combined medical parsers."""
+    texts: List[str] = TEXTS
+    if input is not None:
+        with open(input) as f:
+            texts = tuple(filter(lambda s: len(s) > 0,
+                                 map(str.strip, f.readlines())))
+    harness: CliHarness = ApplicationFactory.create_harness()
+    fac: ConfigFactory = harness.get_config_factory(
+        f'--config {config} --level=err')
+    parsers: Tuple[FeatureDocumentParser, ...] = tuple(map(fac, PARSERS))
+    # warm up: load models and check both give the same features
+    for text in texts:
+        shoulds = tuple(map(lambda p: features(p(text)), parsers))
+        if shoulds[0] != shoulds[1]:
+            raise ValueError(f'Features differ for text: <{text}>')
+    for name, parser in zip(PARSERS, parsers):
+        t0: float = time.perf_counter()
+        for _ in range(rounds):
+            for text in texts:
+                parser(text)
+        elapsed: float = time.perf_counter() - t0
+        n_docs: int = rounds * len(texts)
+        print(f'{name}: {n_docs} docs in {elapsed:.2f}s ' +
+              f'({n_docs / elapsed:.2f} docs/s)')
+
+
+if (__name__ == '__main__'):
+    plac.call(benchmark)
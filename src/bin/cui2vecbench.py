@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""Benchmark batch encoding of documents by the cui2vec vectorizer using the
+embedding row indexes added at parse time and the indexes of a
+:class:`~zensols.mednlp.cui2vec.Cui2VecSequenceStore` against looking up the
+``cui_`` of each token in the embedding.  The documents are parsed from a
+:class:`~zensols.mednlp.bench.SyntheticCorpus` and an error is raised if the
+encoded tensors differ.
+
+Example (from the project root directory)::
+
+  ./src/bin/cui2vecbench.py -c <app config with deepnlp resources> -s 0.5
+
+"""
+from typing import Tuple, List
+from pathlib import Path
+import time
+import tempfile
+import itertools as it
+import plac
+import torch
+from zensols.cli import CliHarness
+from zensols.config import ConfigFactory
+from zensols.nlp import FeatureDocument, FeatureDocumentParser
+from zensols.deepnlp.vectorize import WordVectorEmbeddingFeatureVectorizer
+from zensols.mednlp import ApplicationFactory
+from zensols.mednlp.bench import SyntheticCorpus
+from zensols.mednlp.cui2vec import (
+    Cui2VecSequenceFeatureVectorizer, Cui2VecSequenceStore
+)
+
+
+def encode_all(encode, docs: Tuple[FeatureDocument, ...]) -> \
+        Tuple[List[torch.Tensor], float]:
+    """Encode ``docs`` and return the tensors and the elapsed seconds."""
+    t0: float = time.perf_counter()
+    arrs: List[torch.Tensor] = list(map(lambda d: encode(d).tensor, docs))
+    return arrs, time.perf_counter() - t0
+
+
+@plac.annotations(
+    config=('The application configuration file', 'option', 'c', Path),
+    scale=('The size of the synthetic corpus', 'option', 's', float),
+    rounds=('The number of times to encode the corpus', 'option', 'r', int))
+def benchmark(config: Path = None, scale: float = 0.5, rounds: int = 3):
+    """Benchmark the cui2vec vectorizer with and without parse time and
+    stored indexes.
+
+    """
+    harness: CliHarness = ApplicationFactory.create_harness()
+    args: str = '--level=err'
+    if config is not None:
+        args = f'--config {config} {args}'
+    fac: ConfigFactory = harness.get_config_factory(args)
+    parser: FeatureDocumentParser = fac('mednlp_cui2vec_doc_parser')
+    vec: Cui2VecSequenceFeatureVectorizer = \
+        fac('cui2vec_feature_vectorizer_manager')['wvcui2vec500']
+    notes: Tuple[str, ...] = tuple(it.chain.from_iterable(
+        SyntheticCorpus(scale=scale)().values()))
+    docs: Tuple[FeatureDocument, ...] = tuple(map(parser, notes))
+    n_toks: int = sum(map(lambda d: d.token_len, docs))
+    store = Cui2VecSequenceStore(vec.embed_model, Path(tempfile.mkdtemp()))
+    t0: float = time.perf_counter()
+    store.add(docs)
+    print(f'stored indexes of {len(docs)} docs in ' +
+          f'{time.perf_counter() - t0:.3f}s')
+    # load the embedding before timing
+    vec.sequence_store = None
+    vec._encode(docs[0])
+    for name, encode, seq_store in (
+            ('lookup', lambda d: WordVectorEmbeddingFeatureVectorizer._encode(
+                vec, d), None),
+            ('index', vec._encode, None),
+            ('stored', vec._encode, store)):
+        vec.sequence_store = seq_store
+        secs: float = 0
+        for _ in range(rounds):
+            arrs, elapsed = encode_all(encode, docs)
+            secs += elapsed
+        if name == 'lookup':
+            shoulds = arrs
+        else:
+            for should, arr in zip(shoulds, arrs):
+                if not torch.equal(should, arr):
+                    raise ValueError('Encoded indexes differ')
+        print(f'{name}: {len(docs) * rounds} docs in {secs:.3f}s ' +
+              f'({n_toks * rounds / secs:.0f} tokens/s)')
+    store.clear()
+
+
+if (__name__ == '__main__'):
+    plac.call(benchmark)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""Benchmark linking the concepts of many notes with
+:meth:`~zensols.mednlp.lib.MedicalLibrary.get_entities_multi` against a loop
+over :meth:`~zensols.mednlp.lib.MedicalLibrary.get_entities`.  The notes are
+generated by a :class:`~zensols.mednlp.bench.SyntheticCorpus` and an error is
+raised if the linked concepts differ.
+
+Example (from the project root directory)::
+
+  ./src/bin/entbench.py -s 0.5 -w 4
+
+"""
+from typing import Tuple, List, Dict, Any
+from pathlib import Path
+import os
+import time
+import itertools as it
+import plac
+from zensols.cli import CliHarness
+from zensols.config import ConfigFactory
+from zensols.mednlp import (
+    ApplicationFactory, MedicalLibrary, ConceptEntity, get_peak_rss
+)
+from zensols.mednlp.bench import SyntheticCorpus
+
+
+def loop(lib: MedicalLibrary, notes: Tuple[str, ...]) -> List[Tuple]:
+    """Link with a call to ``get_entities`` for each note."""
+    docs: List[Tuple] = []
+    note: str
+    for note in notes:
+        ents: Dict[str, Any] = lib.get_entities(note)['entities']
+        docs.append(tuple(sorted(map(
+            lambda e: (e['start'], e['end'], e['cui']), ents.values()))))
+    return docs
+
+
+def multi(lib: MedicalLibrary, notes: Tuple[str, ...], batch_size: int,
+          workers: int) -> List[Tuple]:
+    """Link with ``get_entities_multi``."""
+    docs: List[Tuple] = []
+    ents: Tuple[ConceptEntity, ...]
+    for ents in lib.get_entities_multi(notes, batch_size, workers):
+        docs.append(tuple(map(lambda e: (e.begin, e.end, e.cui), ents)))
+    return docs
+
+
+@plac.annotations(
+    config=('The application configuration file', 'option', 'c', Path),
+    scale=('The size of the synthetic corpus', 'option', 's', float),
+    batch_size=('The number of notes in each batch', 'option', 'b', int),
+    workers=('The number of worker processes (defaults to the CPU count)',
+             'option', 'w', int))
+def benchmark(config: Path = None, scale: float = 0.5, batch_size: int = 100,
+              workers: int = os.cpu_count()):
+    """Benchmark linking many notes with and without batching."""
+    harness: CliHarness = ApplicationFactory.create_harness()
+    args: str = '--level=err'
+    if config is not None:
+        args = f'--config {config} {args}'
+    fac: ConfigFactory = harness.get_config_factory(args)
+    lib: MedicalLibrary = fac('mednlp_library')
+    notes: Tuple[str, ...] = tuple(it.chain.from_iterable(
+        SyntheticCorpus(scale=scale)().values()))
+    # load the models before timing
+    lib.get_entities(notes[0])
+    results: Dict[str, List[Tuple]] = {}
+    for name, link in (
+            ('loop', lambda: loop(lib, notes)),
+            ('multi', lambda: multi(lib, notes, batch_size, workers))):
+        t0: float = time.perf_counter()
+        results[name] = link()
+        secs: float = time.perf_counter() - t0
+        print(f'{name}: {len(notes)} notes in {secs:.3f}s ' +
+              f'({len(notes) / secs:.2f} docs/s)')
+    if results['loop'] != results['multi']:
+        raise ValueError('Linked concepts differ')
+    rss: int = get_peak_rss()
+    if rss is not None:
+        print(f'peak RSS: {rss / 1024 ** 2:.1f}MB')
+
+
+if (__name__ == '__main__'):
+    plac.call(benchmark)
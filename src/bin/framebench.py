@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""Benchmark creating a features dataframe of a long note with the
+:class:`~zensols.mednlp.dataframe.MedicalDataFrameFactory`, which joins the
+concept features from a table of the note's concepts, against parsing all
+features and creating the dataframe with
+:class:`~zensols.nlp.dataframe.FeatureDataFrameFactory`.  The note is
+generated by a :class:`~zensols.mednlp.bench.SyntheticCorpus` and an error is
+raised if the dataframes differ.
+
+Example (from the project root directory)::
+
+  ./src/bin/framebench.py -t 10000
+
+"""
+from typing import Tuple, Set, Dict
+from pathlib import Path
+import time
+import plac
+import pandas as pd
+from zensols.cli import CliHarness
+from zensols.config import ConfigFactory
+from zensols.nlp import FeatureDocument, FeatureDocumentParser
+from zensols.nlp.dataframe import FeatureDataFrameFactory
+from zensols.mednlp import ApplicationFactory
+from zensols.mednlp.bench import SyntheticCorpus
+from zensols.mednlp.dataframe import MedicalDataFrameFactory
+
+NEEDS: Tuple[str, ...] = ('norm', 'cui_', 'is_concept')
+"""The feature IDs that are first in the dataframes."""
+
+
+def create(parser: FeatureDocumentParser, df_fac: FeatureDataFrameFactory,
+           fids: Set[str], text: str) -> Tuple[pd.DataFrame, Dict[str, float]]:
+    """Parse ``text`` with features ``fids`` and create its dataframe.
+
+    :return: the dataframe and the parse and dataframe seconds
+
+    """
+    parser.token_feature_ids = fids
+    t0: float = time.perf_counter()
+    doc: FeatureDocument = parser(text)
+    t1: float = time.perf_counter()
+    df: pd.DataFrame = df_fac(doc)
+    t2: float = time.perf_counter()
+    return df, {'parse': t1 - t0, 'frame': t2 - t1}
+
+
+@plac.annotations(
+    config=('The application configuration file', 'option', 'c', Path),
+    tokens=('The minimum number of tokens of the note', 'option', 't', int),
+    parser_name=('The medical parser section', 'option', 'p', str))
+def benchmark(config: Path = None, tokens: int = 10000,
+              parser_name: str = 'mednlp_medcat_doc_parser'):
+    """Benchmark the per token and vectorized dataframe exports."""
+    harness: CliHarness = ApplicationFactory.create_harness()
+    args: str = '--level=err'
+    if config is not None:
+        args = f'--config {config} {args}'
+    fac: ConfigFactory = harness.get_config_factory(args)
+    parser: FeatureDocumentParser = fac(parser_name)
+    fids: Set[str] = set(parser.token_feature_ids) | set(NEEDS)
+    # about 12 tokens per sentence
+    text: str = SyntheticCorpus(sizes={'note': (1, tokens // 12 + 1)})()[
+        'note'][0]
+    n_toks: int = parser(text).token_len
+    print(f'note: {n_toks} tokens')
+    facs: Dict[str, FeatureDataFrameFactory] = {
+        'tokens': FeatureDataFrameFactory(fids, NEEDS),
+        'vectorized': MedicalDataFrameFactory(
+            fids, NEEDS, resource=parser.medcat_resource)}
+    dfs: Dict[str, pd.DataFrame] = {}
+    name: str
+    df_fac: FeatureDataFrameFactory
+    for name, df_fac in facs.items():
+        pfids: Set[str] = fids
+        if isinstance(df_fac, MedicalDataFrameFactory):
+            pfids = df_fac.parse_feature_ids
+        df, secs = create(parser, df_fac, pfids, text)
+        total: float = sum(secs.values())
+        print(f'{name}: parse {secs["parse"]:.3f}s, ' +
+              f'dataframe {secs["frame"]:.3f}s, total {total:.3f}s ' +
+              f'({n_toks / total:.0f} tokens/s)')
+        dfs[name] = df
+    if not dfs['tokens'].astype(str).equals(dfs['vectorized'].astype(str)):
+        raise ValueError('Dataframes differ')
+
+
+if (__name__ == '__main__'):
+    plac.call(benchmark)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""Benchmark compiling the double-array automaton of the
+:class:`~zensols.mednlp.match.ConceptMatcher`.  The names are either
+synthetic, with words of a Zipf distribution over a vocabulary as in concept
+names, or the names of the MedCAT concept database of the configuration.  The
+matches of a sample of the names are checked against the names.
+
+Example (from the project root directory)::
+
+  ./src/bin/matchbench.py -n 1000000
+
+"""
+from typing import Tuple, List, Dict, Set
+from pathlib import Path
+import time
+import random
+import itertools as it
+import numpy as np
+import plac
+from zensols.cli import CliHarness
+from zensols.config import ConfigFactory
+from zensols.mednlp import ApplicationFactory, MedCatResource, get_peak_rss
+from zensols.mednlp.match import ConceptMatcher
+
+
+def synthetic_names(n_names: int, n_words: int) -> \
+        Dict[Tuple[str, ...], Set[str]]:
+    """Return ``n_names`` names of one to five words to their CUIs."""
+    rand = random.Random(0)
+    vocab: List[str] = list(map(lambda i: f'w{i}', range(n_words)))
+    weights: List[float] = list(map(lambda i: 1 / (i + 1), range(n_words)))
+    words: List[str] = rand.choices(vocab, weights, k=n_names * 5)
+    names: Dict[Tuple[str, ...], Set[str]] = {}
+    start: int = 0
+    i: int
+    for i in range(n_names):
+        end: int = start + rand.randint(1, 5)
+        names.setdefault(tuple(words[start:end]), set()).add(f'C{i:07d}')
+        start = end
+    return names
+
+
+@plac.annotations(
+    config=('The application configuration file, which uses the CDB names',
+            'option', 'c', Path),
+    n_names=('The number of synthetic names', 'option', 'n', int),
+    n_words=('The vocabulary size of synthetic names', 'option', 'w', int))
+def benchmark(config: Path = None, n_names: int = 1000000,
+              n_words: int = 100000):
+    """Benchmark compiling the concept names in to an automaton."""
+    names: Dict[Tuple[str, ...], Set[str]]
+    if config is None:
+        names = synthetic_names(n_names, n_words)
+        matcher = ConceptMatcher(None, None)
+    else:
+        harness: CliHarness = ApplicationFactory.create_harness()
+        fac: ConfigFactory = harness.get_config_factory(
+            f'--config {config} --level=err')
+        res: MedCatResource = fac('medcat_resource')
+        matcher = ConceptMatcher(res, None)
+        names = matcher._get_names(res.cat.cdb)
+    t0: float = time.perf_counter()
+    auto = matcher._compile(names)
+    secs: float = time.perf_counter() - t0
+    n_states: int = int((auto.check >= 0).sum())
+    print(f'compiled {len(names)} names in {secs:.2f}s ' +
+          f'({len(names) / secs:.0f} names/s)')
+    print(f'states: {n_states}, slots: {len(auto.check)} ' +
+          f'({n_states / len(auto.check):.2f} used)')
+    # each name matches at least its own CUIs
+    words: Tuple[str, ...]
+    cuis: Set[str]
+    for words, cuis in it.islice(
+            names.items(), 0, None, max(1, len(names) // 100)):
+        codes: List[int] = list(map(lambda w: int(
+            auto.hashes.searchsorted(np.uint64(matcher._hash(w)))), words))
+        found: Set[str] = set()
+        first: int
+        last: int
+        state: int
+        for first, last, state in auto.scan(codes):
+            if first == 0 and last == len(words) - 1:
+                found.update(auto.get_cuis(state))
+        if not cuis <= found:
+            raise ValueError(f'Name not matched: {words}')
+    rss: int = get_peak_rss()
+    if rss is not None:
+        print(f'peak RSS: {rss / 1024 ** 2:.1f}MB')
+
+
+if (__name__ == '__main__'):
+    plac.call(benchmark)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""Benchmark the read and write throughput and size of the columnar
+:class:`~zensols.mednlp.docstore.MedicalDocumentStore` against pickling the
+documents.  The documents are parsed from the test sentences and a
+:class:`~zensols.mednlp.bench.SyntheticCorpus`, and the features of each
+document read from the store are checked against the parsed document.
+
+Example (from the project root directory)::
+
+  ./src/bin/storebench.py -c test-resources/config/docstore.conf -s 0.2
+
+"""
+from typing import Tuple, List, Dict, Any
+from pathlib import Path
+import time
+import pickle
+import tempfile
+import itertools as it
+import plac
+from zensols.cli import CliHarness
+from zensols.config import ConfigFactory
+from zensols.nlp import FeatureDocument, FeatureDocumentParser
+from zensols.mednlp import ApplicationFactory
+from zensols.mednlp.bench import SyntheticCorpus
+from zensols.mednlp.docstore import MedicalDocumentStore
+
+
+TEXTS: Tuple[str, ...] = (
+    'He was diagnosed with kidney failure and heart disease.',
+    'He loved to smoke but Marlboro cigarettes gave John Smith lung cancer ' +
+    'while he was in Chicago.')
+"""The test sentences added to the synthetic corpus."""
+
+
+def features(doc: FeatureDocument) -> Tuple[Tuple[Any, ...], ...]:
+    """Return the stored features of each token of ``doc``."""
+    return tuple(map(lambda t: (t.i, t.norm, t.text, t.cui_, t.tuis_,
+                                t.lexspan.astuple),
+                     doc.token_iter()))
+
+
+def report(name: str, n_docs: int, secs: float, size: int = None):
+    """Print the throughput and optionally the size on disk."""
+    mb: str = '' if size is None else f', {size / 1024 ** 2:.2f}MB'
+    print(f'{name}: {n_docs} docs in {secs:.3f}s ' +
+          f'({n_docs / secs:.1f} docs/s){mb}')
+
+
+@plac.annotations(
+    config=('The application configuration file', 'option', 'c', Path),
+    parser=('The parser configuration section', 'option', 'p', str),
+    scale=('The size of the synthetic corpus', 'option', 's', float))
+def benchmark(config: Path = Path('test-resources/config/docstore.conf'),
+              parser: str = 'mednlp_medcat_doc_parser', scale: float = 0.2):
+    """Benchmark the document store against pickle."""
+    harness: CliHarness = ApplicationFactory.create_harness()
+    fac: ConfigFactory = harness.get_config_factory(
+        f'--config {config} --level=err')
+    doc_parser: FeatureDocumentParser = fac(parser)
+    notes: List[str] = list(TEXTS) + list(it.chain.from_iterable(
+        SyntheticCorpus(scale=scale)().values()))
+    docs: Dict[str, FeatureDocument] = {
+        f'doc-{i}': doc_parser(n) for i, n in enumerate(notes)}
+    n_docs: int = len(docs)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        store = MedicalDocumentStore(tmp / 'store')
+        t0: float = time.perf_counter()
+        store.write(docs.items())
+        size: int = sum(map(lambda p: p.stat().st_size,
+                            store.path.iterdir()))
+        report('store write', n_docs, time.perf_counter() - t0, size)
+        pkl_path: Path = tmp / 'docs.dat'
+        t0 = time.perf_counter()
+        with open(pkl_path, 'wb') as f:
+            pickle.dump(docs, f)
+        report('pickle write', n_docs, time.perf_counter() - t0,
+               pkl_path.stat().st_size)
+        store = MedicalDocumentStore(store.path)
+        t0 = time.perf_counter()
+        loaded: Dict[str, FeatureDocument] = dict(store)
+        report('store read', n_docs, time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        with open(pkl_path, 'rb') as f:
+            pickle.load(f)
+        report('pickle read', n_docs, time.perf_counter() - t0)
+        # random access of single documents reads only their rows
+        store = MedicalDocumentStore(store.path)
+        t0 = time.perf_counter()
+        store.load(f'doc-{n_docs - 1}')
+        report('store random access', 1, time.perf_counter() - t0)
+        store.close()
+    for name, doc in docs.items():
+        if features(doc) != features(loaded[name]):
+            raise ValueError(f'Features differ for document: {name}')
+
+
+if (__name__ == '__main__'):
+    plac.call(benchmark)
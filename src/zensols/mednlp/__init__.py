@@ -18,9 +18,13 @@ def surpress_warnings():
 surpress_warnings()
 
 from .domain import *
+from .metrics import *
 from .uts import UTSError, NoResultsError, AuthenticationError, UTSClient
+from .codes import *
+from .shared import *
 from .resource import *
 from .tok import *
+from .segment import *
 from .lib import *
 from .parser import *
 from .app import *
@@ -3,7 +3,7 @@
 """
 __author__ = 'Paul Landes'
 
-from typing import Optional
+from typing import Tuple, List, Optional
 from dataclasses import dataclass, field
 from enum import Enum, auto
 import sys
@@ -16,8 +16,10 @@ import pandas as pd
 from zensols.config import Dictable, ConfigFactory
 from zensols.cli import ApplicationError
 from zensols.nlp import FeatureDocumentParser, FeatureDocument
-from zensols.nlp.dataframe import FeatureDataFrameFactory
-from . import MedCatResource, MedicalLibrary
+from . import (
+    MedCatResource, SemanticGroups, MedicalLibrary, Metrics, MetricsExporter
+)
+from .dataframe import MedicalDataFrameFactory
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +46,9 @@ class Application(Dictable):
     library: MedicalLibrary = field()
     """Medical resource library that contains UMLS access, cui2vec etc.."""
 
+    metrics: Metrics = field(default=None)
+    """The metrics registry used by :meth:`profile`."""
+
     def _get_text(self, text_or_file: str) -> str:
         """Return the text from a file or the text passed based on if
         ``text_or_file`` is a file on the file system.
@@ -126,8 +131,10 @@ class Application(Dictable):
         ids |= missing
         params['token_feature_ids'] = ids
         params['priority_feature_ids'] = needs
-        df_fac = FeatureDataFrameFactory(**params)
-        self.doc_parser.token_feature_ids = ids
+        # parse without the concept features, which are joined by CUI
+        df_fac = MedicalDataFrameFactory(
+            resource=self.library.medcat_resource, **params)
+        self.doc_parser.token_feature_ids = df_fac.parse_feature_ids
         text: str = self._get_text(text_or_file)
         doc: FeatureDocument = self.doc_parser.parse(text)
         df: pd.DataFrame = df_fac(doc)
@@ -177,9 +184,10 @@ class Application(Dictable):
         elif info == GroupInfo.byname:
             if query is None:
                 raise ApplicationError('Missing query string for grouping')
-            reg = '.*(' + '|'.join(query.split(',')) + ')'
-            df = df[df['name'].str.match(reg)]
-            print(','.join(df['tui'].tolist()))
+            sgroups: SemanticGroups = res.semantic_groups
+            tuis: Tuple[str, ...] = sgroups.get_tuis(
+                sgroups.match(query.split(',')))
+            print(','.join(tuis))
         else:
             raise ApplicationError(f'Unknown query info type: {info}')
 
@@ -204,3 +212,112 @@ class Application(Dictable):
         for sim in self.library.similarity_by_term(term):
             print(sim.cui)
             sim.write(1)
+
+    def _get_corpus(self, corpus: Path) -> List[str]:
+        """Return the notes in a directory of text files or the non-empty
+        lines of a file.
+
+        """
+        if corpus.is_dir():
+            return [p.read_text() for p in sorted(corpus.glob('*.txt'))]
+        with open(corpus) as f:
+            return list(filter(lambda s: len(s) > 0,
+                               map(str.strip, f.readlines())))
+
+    def profile(self, corpus: Path, out: Path = None):
+        """Parse a corpus and print the time spent in each parse stage.  The
+        first note is parsed before profiling to load the models.
+
+        :param corpus: a directory of ``.txt`` notes or a file with a note on
+                       each line
+
+        :param out: the file to which the metrics are appended as JSON
+
+        """
+        if self.metrics is None:
+            raise ApplicationError('No metrics configured')
+        texts: List[str] = self._get_corpus(corpus)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'profiling {len(texts)} notes from {corpus}...')
+        metrics: Metrics = self.metrics
+        if len(texts) > 0:
+            self.doc_parser.parse(texts[0])
+        metrics.enabled = True
+        metrics.reset()
+        try:
+            with metrics.time('corpus'):
+                text: str
+                for text in texts:
+                    with metrics.time('parse'):
+                        self.doc_parser.parse(text)
+        finally:
+            metrics.enabled = False
+        metrics.write()
+        if out is not None:
+            exporter = MetricsExporter(metrics, out)
+            exporter.export(corpus=str(corpus), notes=len(texts))
+
+    def benchmark(self, out: Path = None, parsers: str = None,
+                  scale: float = None):
+        """Benchmark the throughput and latency of parsers over a synthetic
+        clinical corpus.
+
+        :param out: the JSON file to which the results are written
+
+        :param parsers: comma separated parser configuration sections, which
+                        defaults to all medical parsers
+
+        :param scale: multiplied by the number of notes of each size
+
+        """
+        from .bench import ParserBenchmark
+        bench: ParserBenchmark = self.config_factory('mednlp_benchmark')
+        if scale is not None:
+            bench.corpus.scale = scale
+        if parsers is not None:
+            parsers = re.split(r'\s*,\s*', parsers)
+        bench(out, parsers)
+
+    def corpus(self, input_path: str, out_dir: Path = None,
+               text_column: str = None, id_column: str = None,
+               outputs: str = None, batch_size: int = None,
+               workers: int = None):
+        """Parse a corpus of notes and write their features, entities and
+        definitions with checkpoints so a killed job resumes where it left
+        off.
+
+        :param input_path: a directory of ``.txt`` notes, a glob pattern of
+                           notes, a JSON lines file, a CSV file or a file with
+                           a note on each line
+
+        :param out_dir: the directory of the outputs and checkpoint
+
+        :param text_column: the field or column of the note text of JSON lines
+                            and CSV files
+
+        :param id_column: the field or column of the note ID of JSON lines and
+                          CSV files
+
+        :param outputs: comma separated outputs of ``features``, ``entities``
+                        and ``definitions``
+
+        :param batch_size: the number of notes parsed between checkpoints
+
+        :param workers: the number of parsing processes
+
+        """
+        from .corpus import CorpusReader, CorpusProcessor
+        proc: CorpusProcessor = self.config_factory('mednlp_corpus_processor')
+        params = {'text_column': text_column, 'id_column': id_column}
+        reader = CorpusReader(input_path, **dict(
+            filter(lambda t: t[1] is not None, params.items())))
+        if out_dir is not None:
+            proc.output_dir = out_dir
+        if outputs is not None:
+            proc.outputs = set(re.split(r'\s*,\s*', outputs))
+        if batch_size is not None:
+            proc.batch_size = batch_size
+        if workers is not None:
+            proc.workers = workers
+        n_docs: int = proc(reader)
+        logger.info(f'processed {n_docs} notes to {proc.output_dir}')
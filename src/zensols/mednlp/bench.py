@@ -0,0 +1,243 @@
+"""Throughput benchmarks of the medical parsers over a synthetic corpus.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Tuple, List, Dict, Any, Iterable, Optional
+from dataclasses import dataclass, field
+import sys
+import logging
+import time
+import json
+import re
+import random
+import platform
+from io import TextIOBase
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+from zensols.config import Dictable, ConfigFactory
+from zensols.nlp import FeatureDocument, FeatureDocumentParser
+from . import MedNLPError, get_peak_rss
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SyntheticCorpus(object):
+    """Generates a deterministic clinical corpus from sentence templates so
+    benchmarks run offline and give comparable results across runs.  Notes are
+    grouped by size, and each note is a sequence of sentences with slots
+    filled from the vocabulary of this class.
+
+    """
+    _TEMPLATES = (
+        'The patient is a {age} year old {sex} with a history of {dx}.',
+        'He was diagnosed with {dx} and started on {drug} {dose} mg daily.',
+        'She presented with {sx} and {sx} for {n} days.',
+        'Exam revealed tenderness of the {anat} without {sx}.',
+        'CT of the {anat} showed {finding} consistent with {dx}.',
+        'Labs were notable for {lab} of {val} and {lab} of {val}.',
+        'Continue {drug} and discontinue {drug} given {sx}.',
+        'Family history is significant for {dx} in his father.',
+        'Plan: follow up in {n} weeks for {dx} and repeat {lab}.',
+        'Denies {sx}, {sx} or {sx}.',
+    )
+    """The sentence templates of the notes."""
+
+    _SLOTS = {
+        'sex': ('man', 'woman'),
+        'dx': ('kidney failure', 'heart disease', 'lung cancer',
+               'hypertension', 'type 2 diabetes mellitus', 'COPD',
+               'atrial fibrillation', 'pneumonia', 'chronic kidney disease',
+               'congestive heart failure', "Parkinson's disease", 'asthma'),
+        'sx': ('chest pain', 'shortness of breath', 'nausea', 'fever',
+               'palpitations', 'headache', 'dizziness', 'cough', 'fatigue',
+               'abdominal pain'),
+        'drug': ('metformin', 'lisinopril', 'aspirin', 'warfarin',
+                 'atorvastatin', 'furosemide', 'albuterol', 'insulin',
+                 'metoprolol', 'prednisone'),
+        'anat': ('abdomen', 'chest', 'left lung', 'right kidney', 'liver',
+                 'lower back', 'heart'),
+        'finding': ('a mass', 'an effusion', 'consolidation', 'a nodule',
+                    'edema'),
+        'lab': ('creatinine', 'hemoglobin', 'potassium', 'sodium',
+                'glucose', 'troponin'),
+    }
+    """The values used to fill the slots of :obj:`_TEMPLATES`."""
+
+    seed: int = field(default=0)
+    """The random seed used to generate the notes."""
+
+    sizes: Dict[str, Tuple[int, int]] = field(
+        default_factory=lambda: {'short': (40, 3),
+                                 'medium': (20, 30),
+                                 'long': (3, 600)})
+    """The note sizes keyed by name with values ``(<number of notes>, <number
+    of sentences per note>)``.
+
+    """
+    scale: float = field(default=1.)
+    """Multiplied by the number of notes of each size, which is helpful for
+    shorter continuous integration runs.
+
+    """
+    def _fill(self, rand: random.Random, template: str) -> str:
+        """Fill the slots of ``template`` with random values."""
+        def val(m: re.Match) -> str:
+            name: str = m.group(1)
+            if name == 'age':
+                return str(rand.randint(18, 95))
+            elif name == 'n':
+                return str(rand.randint(1, 14))
+            elif name == 'dose':
+                return str(rand.choice((5, 10, 20, 40, 500, 1000)))
+            elif name == 'val':
+                return f'{rand.uniform(0.5, 150):.1f}'
+            return rand.choice(self._SLOTS[name])
+
+        return re.sub(r'\{(\w+)\}', val, template)
+
+    def _note(self, rand: random.Random, n_sents: int) -> str:
+        sents: List[str] = []
+        for i in range(n_sents):
+            sents.append(self._fill(rand, rand.choice(self._TEMPLATES)))
+            # paragraph breaks as found in clinical notes
+            if i % 8 == 7:
+                sents.append('\n\n')
+        return ' '.join(sents).replace(' \n\n ', '\n\n').strip()
+
+    def __call__(self) -> Dict[str, Tuple[str, ...]]:
+        """Return the notes of the corpus keyed by size name."""
+        rand = random.Random(self.seed)
+        corpus: Dict[str, Tuple[str, ...]] = {}
+        name: str
+        n_notes: int
+        n_sents: int
+        for name, (n_notes, n_sents) in self.sizes.items():
+            n_notes = max(1, round(n_notes * self.scale))
+            corpus[name] = tuple(map(lambda _: self._note(rand, n_sents),
+                                     range(n_notes)))
+        return corpus
+
+
+@dataclass
+class ParserBenchmark(Dictable):
+    """Benchmarks the throughput, latency and memory of document parsers over
+    a :class:`.SyntheticCorpus`.  Each parser first parses a note to load its
+    models, which is not included in the results.  Peak memory is for the
+    process, so run one parser per process for an accurate comparison.
+
+    """
+    config_factory: ConfigFactory = field(repr=False)
+    """Used to create the parsers."""
+
+    corpus: SyntheticCorpus = field()
+    """The generator of notes to parse."""
+
+    parser_names: Tuple[str, ...] = field()
+    """The configuration section names of the parsers to benchmark."""
+
+    def _benchmark_parser(self, parser: FeatureDocumentParser,
+                          notes: Iterable[str]) -> Dict[str, Any]:
+        latencies: List[float] = []
+        n_toks: int = 0
+        text: str
+        for text in notes:
+            t0: float = time.perf_counter()
+            doc: FeatureDocument = parser.parse(text)
+            latencies.append(time.perf_counter() - t0)
+            n_toks += doc.token_len
+        lats = np.array(latencies)
+        secs: float = lats.sum()
+        return {'docs': len(lats),
+                'tokens': n_toks,
+                'chars': sum(map(len, notes)),
+                'seconds': float(secs),
+                'docs_per_sec': float(len(lats) / secs),
+                'tokens_per_sec': float(n_toks / secs),
+                'p50_ms': float(np.percentile(lats, 50) * 1000),
+                'p99_ms': float(np.percentile(lats, 99) * 1000)}
+
+    def benchmark(self, parser_names: Iterable[str] = None) -> \
+            Dict[str, Any]:
+        """Benchmark parsers.
+
+        :param parser_names: the configuration sections of the parsers, which
+                             defaults to :obj:`parser_names`
+
+        :return: the results keyed by parser section and note size
+
+        """
+        parser_names = self.parser_names \
+            if parser_names is None else tuple(parser_names)
+        corpus: Dict[str, Tuple[str, ...]] = self.corpus()
+        results: Dict[str, Any] = {}
+        name: str
+        for name in parser_names:
+            if name not in self.config_factory.config.sections:
+                raise MedNLPError(f'No such parser: {name}')
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f'benchmarking {name}...')
+            parser: FeatureDocumentParser = self.config_factory(name)
+            # load models
+            parser.parse(next(iter(corpus.values()))[0])
+            res: Dict[str, Any] = {}
+            size: str
+            notes: Tuple[str, ...]
+            for size, notes in corpus.items():
+                res[size] = self._benchmark_parser(parser, notes)
+            res['peak_rss'] = get_peak_rss()
+            results[name] = res
+        return {'time': datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'seed': self.corpus.seed,
+                'scale': self.corpus.scale,
+                'sizes': {k: len(v) for k, v in corpus.items()},
+                'parsers': results}
+
+    def write_results(self, results: Dict[str, Any], depth: int = 0,
+                      writer: TextIOBase = sys.stdout):
+        """Write the results of :meth:`benchmark` in a human readable
+        format.
+
+        """
+        name: str
+        res: Dict[str, Any]
+        for name, res in results['parsers'].items():
+            self._write_line(f'{name}:', depth, writer)
+            size: str
+            stats: Dict[str, Any]
+            for size, stats in res.items():
+                if not isinstance(stats, dict):
+                    continue
+                self._write_line(
+                    (f"{size}: {stats['docs_per_sec']:.2f} docs/s, " +
+                     f"{stats['tokens_per_sec']:.0f} tokens/s, " +
+                     f"p50={stats['p50_ms']:.1f}ms, " +
+                     f"p99={stats['p99_ms']:.1f}ms"),
+                    depth + 1, writer)
+            rss: Optional[int] = res['peak_rss']
+            if rss is not None:
+                self._write_line(f'peak RSS: {rss / 1024 ** 2:.1f}MB',
+                                 depth + 1, writer)
+
+    def __call__(self, out: Path = None,
+                 parser_names: Iterable[str] = None) -> Dict[str, Any]:
+        """Benchmark parsers, write the results and optionally save them.
+
+        :param out: the JSON file to which the results are written
+
+        :param parser_names: the configuration sections of the parsers, which
+                             defaults to :obj:`parser_names`
+
+        """
+        results: Dict[str, Any] = self.benchmark(parser_names)
+        self.write_results(results)
+        if out is not None:
+            out.parent.mkdir(parents=True, exist_ok=True)
+            with open(out, 'w') as f:
+                json.dump(results, f, indent=4)
+            logger.info(f'wrote benchmark results to {out}')
+        return results
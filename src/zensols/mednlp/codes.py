@@ -0,0 +1,300 @@
+"""Dense integer codes of the concepts, types and semantic groups of a MedCAT
+concept database.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Tuple, List, Dict, Set, Iterable
+from dataclasses import dataclass, field
+import logging
+import re
+import itertools as it
+import numpy as np
+import pandas as pd
+from medcat.cdb import CDB
+from . import MedNLPError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ConceptCodes(object):
+    """Dense integer codes of the CUIs and TUIs of a concept database (CDB),
+    with the TUIs of each concept stored as a fixed width bitset.  A CUI's code
+    is its position in the sorted :obj:`cuis`, and a TUI's code is its bit in
+    the bitset, which is its position in the sorted :obj:`tuis`.
+
+    Bitsets are given as Python integers by :meth:`get_tui_bits` so filters and
+    group membership are bitwise operations on tokens, and as the rows of
+    :obj:`tui_bits` for vectorized operations on many concepts, such as
+    :meth:`has_tuis`.
+
+    """
+    cuis: Tuple[str, ...] = field()
+    """The CUIs indexed by their code."""
+
+    tuis: Tuple[str, ...] = field()
+    """The TUIs indexed by their code (bit)."""
+
+    tui_bits: np.ndarray = field(repr=False)
+    """The TUI bitsets of the concepts as an array of shape ``(<CUIs>,
+    <words>)`` of 64 bit words, where bit ``b`` of word ``w`` is the TUI with
+    code ``w * 64 + b``.
+
+    """
+    def __post_init__(self):
+        self._cui2code: Dict[str, int] = dict(
+            map(reversed, enumerate(self.cuis)))
+        self._tui2code: Dict[str, int] = dict(
+            map(reversed, enumerate(self.tuis)))
+        self._bits2tuis: Dict[int, Tuple[str, ...]] = {0: ()}
+
+    @classmethod
+    def from_cdb(cls, cdb: CDB) -> 'ConceptCodes':
+        """Create the codes from the CUI types of a concept database."""
+        cui2type_ids: Dict[str, Set[str]] = cdb.cui2type_ids
+        cuis: Tuple[str, ...] = tuple(sorted(cui2type_ids.keys()))
+        tuis: Tuple[str, ...] = tuple(sorted(
+            set().union(*cui2type_ids.values())))
+        tui2code: Dict[str, int] = {t: i for i, t in enumerate(tuis)}
+        n_words: int = max(1, (len(tuis) + 63) // 64)
+        rows: List[int] = []
+        codes: List[int] = []
+        i: int
+        cui: str
+        for i, cui in enumerate(cuis):
+            tui: str
+            for tui in cui2type_ids[cui]:
+                rows.append(i)
+                codes.append(tui2code[tui])
+        tui_bits = np.zeros((len(cuis), n_words), dtype=np.uint64)
+        codes = np.array(codes, dtype=np.uint64)
+        np.bitwise_or.at(
+            tui_bits, (np.array(rows, dtype=np.int64),
+                       (codes // 64).astype(np.int64)),
+            np.left_shift(np.uint64(1), codes % np.uint64(64)))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'created codes for {len(cuis)} CUIs ' +
+                        f'and {len(tuis)} TUIs')
+        return cls(cuis, tuis, tui_bits)
+
+    @property
+    def tui_words(self) -> int:
+        """The number of 64 bit words in each bitset."""
+        return self.tui_bits.shape[1]
+
+    def get_cui_code(self, cui: str) -> int:
+        """Return the code of ``cui`` or -1 if not in the CDB."""
+        return self._cui2code.get(cui, -1)
+
+    def get_tui_code(self, tui: str) -> int:
+        """Return the code of ``tui`` or -1 if not in the CDB."""
+        return self._tui2code.get(tui, -1)
+
+    def get_tui_bits(self, cui_code: int) -> int:
+        """Return the TUI bitset of a concept or 0 for a code of -1."""
+        if cui_code < 0:
+            return 0
+        bits: int = 0
+        w: int
+        word: int
+        for w, word in enumerate(self.tui_bits[cui_code].tolist()):
+            bits |= word << (w * 64)
+        return bits
+
+    def get_tuis(self, bits: int) -> Tuple[str, ...]:
+        """Return the sorted TUIs of a bitset."""
+        tuis: Tuple[str, ...] = self._bits2tuis.get(bits)
+        if tuis is None:
+            found: List[str] = []
+            rest: int = bits
+            while rest:
+                low: int = rest & -rest
+                found.append(self.tuis[low.bit_length() - 1])
+                rest ^= low
+            tuis = tuple(found)
+            self._bits2tuis[bits] = tuis
+        return tuis
+
+    def get_tui_mask(self, tuis: Iterable[str]) -> int:
+        """Return a bitset of ``tuis``, which are ignored if not in the CDB.
+
+        """
+        bits: int = 0
+        tui: str
+        for tui in tuis:
+            code: int = self._tui2code.get(tui, -1)
+            if code >= 0:
+                bits |= 1 << code
+        return bits
+
+    def has_tuis(self, cui_codes: np.ndarray, tuis: Iterable[str]) -> \
+            np.ndarray:
+        """Return whether each concept has any of ``tuis``.
+
+        :param cui_codes: the concept codes, where -1 is a non-concept
+
+        :param tuis: the TUIs to match
+
+        :return: a boolean array with the shape of ``cui_codes``
+
+        """
+        cui_codes = np.asarray(cui_codes)
+        if cui_codes.size > 0 and cui_codes.max() >= len(self.cuis):
+            raise MedNLPError(f'Concept code out of range: {cui_codes.max()}')
+        mask: int = self.get_tui_mask(tuis)
+        words = np.array(tuple(map(lambda w: (mask >> (w * 64)) & (2**64 - 1),
+                                   range(self.tui_words))), dtype=np.uint64)
+        is_concept: np.ndarray = cui_codes >= 0
+        bits: np.ndarray = self.tui_bits[np.where(is_concept, cui_codes, 0)]
+        return is_concept & np.any((bits & words) != 0, axis=-1)
+
+    def __len__(self) -> int:
+        return len(self.cuis)
+
+
+@dataclass
+class SemanticGroups(object):
+    """Dense codes of the UMLS semantic groups (i.e. ``DISO``) with the groups
+    of a TUI or concept given as a bitset, where a group's bit is its position
+    in the sorted :obj:`abbrevs`.  The lookups of groups to TUIs and TUIs to
+    groups are created once so group queries need not match the rows of the
+    groups file.  The groups of all concepts are given by
+    :meth:`get_cui_group_bits` as an array for vectorized masks with
+    :meth:`has_groups`.
+
+    """
+    abbrevs: Tuple[str, ...] = field()
+    """The group abbreviations indexed by their code (bit)."""
+
+    names: Tuple[str, ...] = field()
+    """The group names (i.e. ``Disorders``) indexed by their code."""
+
+    group_tuis: Dict[str, Tuple[str, ...]] = field(repr=False)
+    """The TUIs of each group keyed by group abbreviation in the order of the
+    rows of the groups file.
+
+    """
+
+    def __post_init__(self):
+        self._abbrev2code: Dict[str, int] = dict(
+            map(reversed, enumerate(self.abbrevs)))
+        self._tui2bits: Dict[str, int] = {}
+        abbrev: str
+        tuis: Tuple[str, ...]
+        for abbrev, tuis in self.group_tuis.items():
+            bit: int = 1 << self._abbrev2code[abbrev]
+            tui: str
+            for tui in tuis:
+                self._tui2bits[tui] = self._tui2bits.get(tui, 0) | bit
+        self._bits2groups: Dict[int, Tuple[str, ...]] = {0: ()}
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> 'SemanticGroups':
+        """Create the groups from the ``abbrev``, ``name`` and ``tui`` columns
+        of a groups dataframe (see :obj:`.MedCatResource.groups`).
+
+        """
+        names: Dict[str, str] = dict(
+            df[['abbrev', 'name']].itertuples(name=None, index=False))
+        # dictionaries keep the TUIs unique in the order of the rows
+        group_tuis: Dict[str, Dict[str, None]] = {}
+        abbrev: str
+        tui: str
+        for abbrev, tui in df[['abbrev', 'tui']].itertuples(
+                name=None, index=False):
+            group_tuis.setdefault(abbrev, {})[tui] = None
+        abbrevs: Tuple[str, ...] = tuple(sorted(names.keys()))
+        if len(abbrevs) > 64:
+            raise MedNLPError(f'Expecting at most 64 groups: {len(abbrevs)}')
+        return cls(abbrevs, tuple(map(lambda a: names[a], abbrevs)),
+                   {a: tuple(group_tuis[a]) for a in abbrevs})
+
+    @property
+    def tui_groups(self) -> Dict[str, Tuple[str, ...]]:
+        """The semantic group abbreviations of each TUI."""
+        return {t: self.get_groups(b) for t, b in self._tui2bits.items()}
+
+    def match(self, names: Iterable[str]) -> Tuple[str, ...]:
+        """Return the abbreviations of the groups with a name that has any of
+        ``names``, each a regular expression (i.e. ``Disorders`` or
+        ``Chemicals``).
+
+        """
+        pat: re.Pattern = re.compile('.*(' + '|'.join(names) + ')')
+        return tuple(map(lambda t: t[0], filter(
+            lambda t: pat.match(t[1]) is not None,
+            zip(self.abbrevs, self.names))))
+
+    def get_tuis(self, abbrevs: Iterable[str]) -> Tuple[str, ...]:
+        """Return the unique TUIs of groups, which are ignored if not a group.
+        The TUIs are in the order of :obj:`abbrevs`, and then in the order of
+        the rows of the groups file, which is sorted by group.
+
+        """
+        codes: List[int] = sorted(filter(lambda c: c >= 0, map(
+            lambda a: self._abbrev2code.get(a, -1), set(abbrevs))))
+        return tuple(dict.fromkeys(it.chain.from_iterable(map(
+            lambda c: self.group_tuis[self.abbrevs[c]], codes))))
+
+    def get_group_mask(self, abbrevs: Iterable[str]) -> int:
+        """Return a bitset of groups, which are ignored if not a group."""
+        bits: int = 0
+        abbrev: str
+        for abbrev in abbrevs:
+            code: int = self._abbrev2code.get(abbrev, -1)
+            if code >= 0:
+                bits |= 1 << code
+        return bits
+
+    def get_tui_group_bits(self, tui: str) -> int:
+        """Return the groups bitset of ``tui``, which is 0 if in no group."""
+        return self._tui2bits.get(tui, 0)
+
+    def get_groups(self, bits: int) -> Tuple[str, ...]:
+        """Return the sorted group abbreviations of a bitset."""
+        groups: Tuple[str, ...] = self._bits2groups.get(bits)
+        if groups is None:
+            groups = tuple(map(
+                lambda i: self.abbrevs[i],
+                filter(lambda i: bits & (1 << i), range(len(self.abbrevs)))))
+            self._bits2groups[bits] = groups
+        return groups
+
+    def get_cui_group_bits(self, codes: ConceptCodes) -> np.ndarray:
+        """Return the groups bitset of each concept of ``codes``, with an
+        additional last element of 0 so the bitset of a non-concept's code of
+        -1 is empty.
+
+        :return: an array of length ``len(codes) + 1``
+
+        """
+        bits = np.zeros(len(codes) + 1, dtype=np.uint64)
+        code: int
+        tui: str
+        for code, tui in enumerate(codes.tuis):
+            group_bits: int = self._tui2bits.get(tui, 0)
+            if group_bits != 0:
+                has_tui: np.ndarray = (codes.tui_bits[:, code // 64] >>
+                                       np.uint64(code % 64)) & np.uint64(1)
+                bits[:-1] |= has_tui * np.uint64(group_bits)
+        return bits
+
+    def has_groups(self, group_bits: np.ndarray, abbrevs: Iterable[str]) -> \
+            np.ndarray:
+        """Return whether each bitset has any of the groups ``abbrevs``.
+
+        :param group_bits: the group bitsets, such as those of concepts
+                           indexed by their codes from
+                           :meth:`get_cui_group_bits`
+
+        :param abbrevs: the group abbreviations to match
+
+        :return: a boolean array with the shape of ``group_bits``
+
+        """
+        mask = np.uint64(self.get_group_mask(abbrevs))
+        return (np.asarray(group_bits, dtype=np.uint64) & mask) != 0
+
+    def __len__(self) -> int:
+        return len(self.abbrevs)
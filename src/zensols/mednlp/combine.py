@@ -0,0 +1,95 @@
+"""Combine the features of the medical parsers in one pass.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Dict
+from dataclasses import dataclass, field
+import logging
+from zensols.nlp import FeatureDocument, FeatureDocumentParser
+from zensols.nlp.combine import (
+    CombinerFeatureDocumentParser, MappingCombinerFeatureDocumentParser
+)
+from . import Metrics, stage_timer
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SharedCombinerFeatureDocumentParser(
+        MappingCombinerFeatureDocumentParser):
+    """A combiner that flattens nested combiners that share its
+    :obj:`delegate`.  The delegate's document is parsed once, and each leaf
+    source parser is parsed once per text, even when it is used by more than
+    one nested combiner.  The features of each leaf source are merged straight
+    in to the delegate's document using the settings (i.e. yielded and
+    overwritten features) of the nested combiner that lists it.
+
+    This gives the same features as
+    :class:`~zensols.nlp.combine.MappingCombinerFeatureDocumentParser` but
+    skips the redundant merges of the shared document in to itself that
+    happens with the nested combiners configured in
+    ``mednlp_combine_biomed_medcat_doc_parser``.
+
+    """
+    metrics: Metrics = field(default=None)
+    """If set and enabled, records the wall time of merging source documents.
+
+    """
+    def _parse_source(self, parsed: Dict[int, FeatureDocument],
+                      source_parser: FeatureDocumentParser, text: str,
+                      *args, **kwargs) -> FeatureDocument:
+        """Parse ``text`` with ``source_parser`` unless already parsed."""
+        key: int = id(source_parser)
+        doc: FeatureDocument = parsed.get(key)
+        if doc is None:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'parsing with {source_parser}')
+            doc = source_parser.parse(text, *args, **kwargs)
+            parsed[key] = doc
+        else:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'reusing parsed doc from {source_parser}')
+        return doc
+
+    def _combine(self, combiner: CombinerFeatureDocumentParser,
+                 parsed: Dict[int, FeatureDocument],
+                 target_doc: FeatureDocument, text: str, *args, **kwargs):
+        """Merge the source documents of ``combiner`` in to ``target_doc``,
+        which was parsed by the shared delegate.
+
+        """
+        source_parser: FeatureDocumentParser
+        for source_parser in combiner.source_parsers:
+            if isinstance(source_parser, CombinerFeatureDocumentParser) and \
+               source_parser.delegate is self.delegate:
+                # the nested combiner's target is the shared document
+                self._combine(source_parser, parsed, target_doc, text,
+                              *args, **kwargs)
+            else:
+                source_doc: FeatureDocument
+                if isinstance(source_parser, CombinerFeatureDocumentParser):
+                    source_doc = source_parser._parse(
+                        parsed, text, *args, **kwargs)
+                else:
+                    source_doc = self._parse_source(
+                        parsed, source_parser, text, *args, **kwargs)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f'merging {source_parser} -> {self.delegate}')
+                with stage_timer(self.metrics, 'combine.merge'):
+                    combiner._merge_docs(target_doc, source_doc)
+        if combiner is not self:
+            combiner.decorate(target_doc)
+
+    def _parse(self, parsed: Dict[int, FeatureDocument], text: str,
+               *args, **kwargs) -> FeatureDocument:
+        self._log_parse(text, logger)
+        target_doc: FeatureDocument = self._parse_source(
+            parsed, self.delegate, text, *args, **kwargs)
+        if self.source_parsers is None or len(self.source_parsers) == 0:
+            logger.warning(f'No source parsers set on {self}, ' +
+                           'which disables feature combining')
+        else:
+            self._combine(self, parsed, target_doc, text, *args, **kwargs)
+        self.decorate(target_doc)
+        return target_doc
@@ -0,0 +1,446 @@
+"""Stream a corpus of notes through a parser with resumable checkpoints.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Tuple, List, Dict, Set, Any, Iterable, Optional, Deque
+from dataclasses import dataclass, field
+import logging
+import os
+import io
+import json
+import time
+import glob
+from collections import deque
+import itertools as it
+import multiprocessing as mp
+from multiprocessing.pool import AsyncResult
+from pathlib import Path
+import pandas as pd
+from zensols.nlp import (
+    FeatureToken, FeatureSpan, FeatureDocument, FeatureDocumentParser
+)
+from zensols.nlp.dataframe import FeatureDataFrameFactory
+from . import MedNLPError, MedicalLibrary
+
+logger = logging.getLogger(__name__)
+
+# the processor of the worker process set by ``_init_worker``
+_worker_processor: 'CorpusProcessor' = None
+
+
+def _init_worker(processor: 'CorpusProcessor'):
+    global _worker_processor
+    _worker_processor = processor
+
+
+def _process_batch(batch: Tuple[Tuple[str, str], ...]) -> Dict[str, Any]:
+    return _worker_processor._process_batch(batch)
+
+
+@dataclass
+class CorpusReader(object):
+    """Reads the notes of a corpus as tuples of ``(<ID>, <text>)`` in the same
+    order each time so processing can resume by position.  The source
+    :obj:`path` is one of:
+
+      * a directory of files matching :obj:`glob_pattern`, each a note with
+        its path relative to the directory as the ID,
+      * a glob pattern of note files, each with its path as the ID,
+      * a JSON lines (``.jsonl``) file with a note in each line,
+      * a CSV (``.csv``) file with a note in each row,
+      * any other file with a note in each non-empty line.
+
+    The text and ID of JSON lines and CSV notes are given by
+    :obj:`text_column` and :obj:`id_column`.  The (zero based) position of
+    the note is its ID when the ID column is missing.
+
+    """
+    path: str = field()
+    """The directory, glob pattern or file of the notes."""
+
+    glob_pattern: str = field(default='**/*.txt')
+    """The pattern of the note files in a directory :obj:`path`."""
+
+    text_column: str = field(default='text')
+    """The field or column of the text of JSON lines and CSV notes."""
+
+    id_column: str = field(default='id')
+    """The field or column of the ID of JSON lines and CSV notes."""
+
+    csv_chunk_size: int = field(default=1000)
+    """The number of CSV rows read at a time."""
+
+    def _read_files(self, paths: Iterable[Path], root: Path = None) -> \
+            Iterable[Tuple[str, str]]:
+        path: Path
+        for path in paths:
+            if path.is_file():
+                nid: str = str(path if root is None else
+                               path.relative_to(root))
+                yield (nid, path.read_text())
+
+    def _read_jsonl(self, path: Path) -> Iterable[Tuple[str, str]]:
+        with open(path) as f:
+            i: int
+            line: str
+            for i, line in enumerate(f):
+                if len(line.strip()) > 0:
+                    note: Dict[str, Any] = json.loads(line)
+                    if self.text_column not in note:
+                        raise MedNLPError(
+                            f"No field '{self.text_column}' in {path}:{i + 1}")
+                    yield (str(note.get(self.id_column, i)),
+                           note[self.text_column])
+
+    def _read_csv(self, path: Path) -> Iterable[Tuple[str, str]]:
+        i: int = 0
+        df: pd.DataFrame
+        for df in pd.read_csv(path, chunksize=self.csv_chunk_size,
+                              dtype=str, keep_default_na=False):
+            if self.text_column not in df.columns:
+                raise MedNLPError(
+                    f"No column '{self.text_column}' in {path}")
+            ids: Iterable[str] = df[self.id_column] \
+                if self.id_column in df.columns \
+                else map(str, range(i, i + len(df)))
+            yield from zip(ids, df[self.text_column])
+            i += len(df)
+
+    def _read_lines(self, path: Path) -> Iterable[Tuple[str, str]]:
+        with open(path) as f:
+            notes: Iterable[str] = filter(
+                lambda s: len(s) > 0, map(str.strip, f))
+            yield from map(lambda t: (str(t[0]), t[1]), enumerate(notes))
+
+    def _get_paths(self) -> Optional[Tuple[Iterable[Path], Path]]:
+        """Return the note files and the directory of their IDs, or ``None``
+        if :obj:`path` is a file of notes.
+
+        """
+        path = Path(self.path)
+        if path.is_dir():
+            return sorted(path.glob(self.glob_pattern)), path
+        elif path.is_file():
+            return None
+        elif glob.has_magic(self.path):
+            return map(Path, sorted(glob.glob(self.path, recursive=True))), \
+                None
+        raise MedNLPError(f'No such corpus: {self.path}')
+
+    def __iter__(self) -> Iterable[Tuple[str, str]]:
+        paths: Optional[Tuple[Iterable[Path], Path]] = self._get_paths()
+        if paths is not None:
+            return self._read_files(*paths)
+        path = Path(self.path)
+        if path.suffix == '.jsonl':
+            return self._read_jsonl(path)
+        elif path.suffix == '.csv':
+            return self._read_csv(path)
+        return self._read_lines(path)
+
+    def __len__(self) -> int:
+        """The number of notes, which are counted without reading the note
+        files, or the lines of JSON lines and line files without parsing
+        them.  Only CSV files are read in full.
+
+        """
+        paths: Optional[Tuple[Iterable[Path], Path]] = self._get_paths()
+        if paths is not None:
+            return sum(map(lambda p: p.is_file(), paths[0]))
+        path = Path(self.path)
+        if path.suffix == '.csv':
+            return sum(1 for _ in self)
+        with open(path, 'rb') as f:
+            return sum(map(lambda ln: len(ln.strip()) > 0, f))
+
+
+@dataclass
+class CorpusProcessor(object):
+    """Parses a corpus of notes in batches and incrementally writes the
+    features, entities and linked definitions of the parsed documents to
+    :obj:`output_dir`.  Each output is appended after each batch, and a
+    checkpoint of the number of notes processed and the size of each output is
+    then written.  A killed job restarts from the checkpoint by skipping the
+    notes already processed and truncating any output written after the last
+    checkpoint.
+
+    Outputs are:
+
+      * ``features.csv``: the token features (:obj:`feature_ids`) of each
+        note with the note ID,
+      * ``entities.jsonl``: the linked concepts of each note,
+      * ``definitions.jsonl``: the linked entity (see
+        :meth:`.MedicalLibrary.get_linked_entity`) of each CUI found in the
+        corpus, written the first time the CUI is found.
+
+    """
+    _CHECKPOINT = 'checkpoint.json'
+    """The name of the checkpoint file in :obj:`output_dir`."""
+
+    _FILES = {'features': 'features.csv',
+              'entities': 'entities.jsonl',
+              'definitions': 'definitions.jsonl'}
+    """The output file names by output."""
+
+    doc_parser: FeatureDocumentParser = field()
+    """The parser of the notes."""
+
+    output_dir: Path = field()
+    """The directory of the outputs and checkpoint."""
+
+    library: MedicalLibrary = field(default=None)
+    """The library used to link definitions, which is needed when
+    ``definitions`` is in :obj:`outputs`.
+
+    """
+    outputs: Set[str] = field(
+        default_factory=lambda: {'features', 'entities'})
+    """The outputs to write, which are the keys of :obj:`_FILES`."""
+
+    feature_ids: Set[str] = field(default=None)
+    """The token features written to ``features.csv``, which defaults to the
+    parser's token features.
+
+    """
+    batch_size: int = field(default=100)
+    """The number of notes parsed before the outputs and checkpoint are
+    written.
+
+    """
+    workers: int = field(default=1)
+    """The number of processes that parse notes, each a fork of this process
+    that has a copy of the loaded parser.  At most two batches per worker are
+    read ahead of the batch written.
+
+    """
+    count_total: bool = field(default=False)
+    """Whether to count the notes of the reader for the estimated time
+    remaining in the progress when the total is not given, which reads CSV
+    corpora in full before processing.
+
+    """
+    @property
+    def checkpoint_path(self) -> Path:
+        """The file with the progress of the last processed batch."""
+        return self.output_dir / self._CHECKPOINT
+
+    def _get_df_factory(self) -> FeatureDataFrameFactory:
+        needs: Tuple[str, ...] = ('norm', 'is_concept', 'cui_')
+        fids: Set[str] = self.feature_ids
+        if fids is None:
+            fids = set(self.doc_parser.token_feature_ids)
+        return FeatureDataFrameFactory(
+            token_feature_ids=set(fids) | set(needs),
+            priority_feature_ids=needs)
+
+    def _write_features(self, nid: str, doc: FeatureDocument,
+                        df_fac: FeatureDataFrameFactory, writer: io.StringIO):
+        df: pd.DataFrame = df_fac(doc)
+        df.insert(0, 'id', nid)
+        df.to_csv(writer, index=False, header=False)
+
+    def _write_entities(self, nid: str, doc: FeatureDocument,
+                        writer: io.StringIO):
+        ents: List[Dict[str, Any]] = []
+        ent: FeatureSpan
+        for ent in doc.entities:
+            tok: FeatureToken = ent.tokens[0]
+            if tok.is_concept:
+                ents.append({'cui': tok.cui_,
+                             'text': ent.text,
+                             'begin': ent.lexspan.begin,
+                             'end': ent.lexspan.end,
+                             'pref_name': tok.pref_name_,
+                             'tuis': list(tok.tuis)})
+        writer.write(json.dumps({'id': nid, 'entities': ents}) + '\n')
+
+    def _process_batch(self, batch: Tuple[Tuple[str, str], ...]) -> \
+            Dict[str, Any]:
+        """Parse a batch of notes and return their serialized outputs."""
+        outs: Set[str] = self.outputs
+        df_fac: FeatureDataFrameFactory = self._get_df_factory()
+        features = io.StringIO()
+        entities = io.StringIO()
+        cuis: Set[str] = set()
+        n_toks: int = 0
+        nid: str
+        text: str
+        for nid, text in batch:
+            doc: FeatureDocument = self.doc_parser.parse(text)
+            n_toks += doc.token_len
+            if 'features' in outs:
+                self._write_features(nid, doc, df_fac, features)
+            if 'entities' in outs:
+                self._write_entities(nid, doc, entities)
+            if 'definitions' in outs:
+                cuis.update(map(lambda t: t.cui_, filter(
+                    lambda t: t.is_concept, doc.token_iter())))
+        return {'n_docs': len(batch),
+                'n_toks': n_toks,
+                'features': features.getvalue(),
+                'entities': entities.getvalue(),
+                'cuis': sorted(cuis)}
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        """Return the last checkpoint and truncate outputs written after it.
+
+        :raises MedNLPError: if the outputs differ from those of the
+                             checkpoint, which would be missing the notes
+                             already processed
+
+        """
+        ckpt: Dict[str, Any] = {'docs': 0, 'seconds': 0., 'offsets': {}}
+        if self.checkpoint_path.is_file():
+            with open(self.checkpoint_path) as f:
+                ckpt = json.load(f)
+            prev: Set[str] = set(ckpt['offsets'].keys())
+            if prev != set(self.outputs):
+                raise MedNLPError(
+                    f'Outputs {sorted(self.outputs)} differ from those ' +
+                    f'of the checkpoint {sorted(prev)}; use a new output ' +
+                    f'directory or remove {self.checkpoint_path}')
+        out: str
+        for out in self.outputs:
+            path: Path = self.output_dir / self._FILES[out]
+            offset: int = ckpt['offsets'].get(out, 0)
+            if path.is_file() and path.stat().st_size > offset:
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(f'truncating {path} to {offset} bytes')
+                os.truncate(path, offset)
+            elif offset > 0 and not path.is_file():
+                raise MedNLPError(f'Missing output of checkpoint: {path}')
+        return ckpt
+
+    def _save_checkpoint(self, ckpt: Dict[str, Any]):
+        """Write the checkpoint to a temporary file that replaces the previous
+        so that a kill while writing does not corrupt it.
+
+        """
+        tmp: Path = self.checkpoint_path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(ckpt, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    def _get_definitions(self, cuis: Iterable[str], seen: Set[str]) -> str:
+        lines: List[str] = []
+        cui: str
+        for cui in cuis:
+            if cui not in seen:
+                seen.add(cui)
+                ent = self.library.get_linked_entity(cui)
+                if ent is not None:
+                    lines.append(json.dumps(ent.asdict()) + '\n')
+        return ''.join(lines)
+
+    def _read_seen(self) -> Set[str]:
+        """Return the CUIs already written to the definitions output."""
+        path: Path = self.output_dir / self._FILES['definitions']
+        if not path.is_file():
+            return set()
+        with open(path) as f:
+            return set(map(lambda s: json.loads(s)['cui'], f))
+
+    def _process_parallel(self, pool: mp.Pool,
+                          batches: Iterable[Tuple[Tuple[str, str], ...]]) -> \
+            Iterable[Dict[str, Any]]:
+        """Process ``batches`` with ``pool`` and return their results in
+        order.  Batches are read only as workers are available for them so
+        the notes of the corpus are not all read in to memory.
+
+        """
+        pending: Deque[AsyncResult] = deque()
+        batch: Tuple[Tuple[str, str], ...]
+        for batch in batches:
+            pending.append(pool.apply_async(_process_batch, (batch,)))
+            if len(pending) >= 2 * self.workers:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+
+    def _write_progress(self, n_docs: int, total: Optional[int],
+                        n_new: int, secs: float):
+        rate: float = n_new / secs if secs > 0 else 0.
+        msg: str = f'processed {n_docs}'
+        if total is not None:
+            msg += f'/{total}'
+        msg += f' notes ({rate:.2f} docs/s'
+        if total is not None and rate > 0:
+            eta: float = (total - n_docs) / rate
+            msg += f', ETA {time.strftime("%H:%M:%S", time.gmtime(eta))}'
+        logger.info(msg + ')')
+
+    def __call__(self, reader: CorpusReader, total: int = None) -> int:
+        """Process the notes of ``reader`` not processed by a previous run.
+
+        :param reader: the source of notes
+
+        :param total: the number of notes in the corpus used for the ETA, which
+                      is counted with ``reader`` when not given and
+                      :obj:`count_total` is ``True``
+
+        :return: the number of notes processed by this call
+
+        """
+        unknown: Set[str] = set(self.outputs) - set(self._FILES.keys())
+        if len(unknown) > 0:
+            raise MedNLPError(f'Unknown outputs: {", ".join(unknown)}')
+        if 'definitions' in self.outputs and self.library is None:
+            raise MedNLPError('A library is needed for definitions')
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        ckpt: Dict[str, Any] = self._load_checkpoint()
+        start: int = ckpt['docs']
+        if total is None and self.count_total and \
+                logger.isEnabledFor(logging.INFO):
+            total = len(reader)
+        if start > 0 and logger.isEnabledFor(logging.INFO):
+            logger.info(f'resuming after {start} notes')
+        seen: Set[str] = self._read_seen() \
+            if 'definitions' in self.outputs else set()
+        notes: Iterable[Tuple[str, str]] = it.islice(iter(reader), start, None)
+        batches: Iterable[Tuple[Tuple[str, str], ...]] = iter(
+            lambda: tuple(it.islice(notes, self.batch_size)), ())
+        writers: Dict[str, io.TextIOBase] = {}
+        pool: mp.Pool = None
+        n_new: int = 0
+        prev_secs: float = ckpt['seconds']
+        t0: float = time.time()
+        try:
+            out: str
+            for out in self.outputs:
+                writers[out] = open(self.output_dir / self._FILES[out], 'a')
+            if 'features' in writers and writers['features'].tell() == 0:
+                cols: List[str] = list(self._get_df_factory()(
+                    FeatureDocument(sents=())).columns)
+                writers['features'].write(','.join(['id'] + cols) + '\n')
+            results: Iterable[Dict[str, Any]]
+            if self.workers > 1:
+                pool = mp.get_context('fork').Pool(
+                    self.workers, initializer=_init_worker,
+                    initargs=(self,))
+                results = self._process_parallel(pool, batches)
+            else:
+                results = map(self._process_batch, batches)
+            res: Dict[str, Any]
+            for res in results:
+                if 'definitions' in writers:
+                    res['definitions'] = self._get_definitions(
+                        res['cuis'], seen)
+                writer: io.TextIOBase
+                for out, writer in writers.items():
+                    writer.write(res[out])
+                    writer.flush()
+                n_new += res['n_docs']
+                secs: float = time.time() - t0
+                ckpt['docs'] = start + n_new
+                ckpt['seconds'] = prev_secs + secs
+                ckpt['offsets'] = {o: w.tell() for o, w in writers.items()}
+                self._save_checkpoint(ckpt)
+                if logger.isEnabledFor(logging.INFO):
+                    self._write_progress(ckpt['docs'], total, n_new, secs)
+        finally:
+            if pool is not None:
+                pool.terminate()
+            for writer in writers.values():
+                writer.close()
+        return n_new
@@ -3,17 +3,67 @@
 """
 __author__ = 'Paul Landes'
 
-from typing import Dict, List
+from typing import (
+    Dict, List, Tuple, Set, Any, Iterable, Sequence, Union, Optional
+)
 from dataclasses import dataclass, field
 import logging
 import csv
+import json
+import os
+import hashlib
+import multiprocessing as mp
+from pathlib import Path
+import itertools as it
+import numpy as np
+import torch
 from h5py import Dataset
+from zensols.persist import persisted, PersistedWork, Stash
+from zensols.nlp import FeatureToken, FeatureDocument, FeatureTokenDecorator
+from zensols.deeplearn.vectorize import FeatureContext, TensorFeatureContext
 from zensols.deepnlp.embed import (
     WordEmbedError, TextWordEmbedModel, TextWordModelMetadata
 )
+from zensols.deepnlp.vectorize import WordVectorEmbeddingFeatureVectorizer
+from . import MedNLPError, MedCatResource, ConceptCodes
 
 logger = logging.getLogger(__name__)
 
+# the store of the worker process set by ``_init_worker``
+_worker_store: 'Cui2VecSequenceStore' = None
+
+
+def _init_worker(store: 'Cui2VecSequenceStore', stash: Optional[Stash]):
+    global _worker_store
+    _worker_store = store
+    store._worker_stash = stash
+
+
+def _sequence_batch(batch: Tuple[Union[str, FeatureDocument], ...]) -> \
+        Tuple[Tuple[str, ...], Tuple[Tuple[str, np.ndarray, np.ndarray], ...]]:
+    return _worker_store._sequence_batch(batch)
+
+
+def _get_token_indexes(emodel: 'Cui2VecEmbedModel', doc: FeatureDocument,
+                       index_feature_id: str, token_feature_id: str) -> \
+        np.ndarray:
+    """Return the embedding row index of each token of ``doc``, which is its
+    ``index_feature_id`` feature, or the row of its ``token_feature_id``
+    feature for tokens without it.
+
+    """
+    toks: Tuple[FeatureToken, ...] = tuple(doc.token_iter())
+    idxs: np.ndarray = np.fromiter(
+        map(getattr, toks, it.repeat(index_feature_id), it.repeat(-1)),
+        dtype=np.int64, count=len(toks))
+    missing: np.ndarray = np.flatnonzero(idxs < 0)
+    if len(missing) > 0:
+        idxs[missing] = np.fromiter(
+            map(lambda i: emodel.word2idx_or_unk(
+                getattr(toks[i], token_feature_id)), missing.tolist()),
+            dtype=np.int64, count=len(missing))
+    return idxs
+
 
 @dataclass
 class Cui2VecEmbedModel(TextWordEmbedModel):
@@ -54,3 +104,790 @@ class Cui2VecEmbedModel(TextWordEmbedModel):
         return TextWordModelMetadata(
             name, 'default', dim, self.vocab_size, path,
             sub_directory='cui2vec-bin')
+
+    def get_code_rows(self, codes: ConceptCodes) -> np.ndarray:
+        """Return the embedding row of each concept code.  Concepts not in the
+        embedding have the unknown index, which is also the last element so
+        the row of a non-concept's code of -1 is the unknown index.
+
+        :param codes: the concept codes of the MedCAT CDB
+
+        :return: an array of length ``len(codes) + 1``
+
+        """
+        unk: int = self.unk_idx
+        rows: np.ndarray = np.fromiter(
+            map(lambda c: self.word2idx(c, unk), codes.cuis),
+            dtype=np.int64, count=len(codes))
+        return np.append(rows, unk)
+
+    @property
+    @persisted('_norms')
+    def norms(self) -> np.ndarray:
+        """The L2 norm of each embedding vector."""
+        return np.linalg.norm(self.matrix, axis=1)
+
+    def most_similar(self, cuis: Sequence[str], topn: int = 5,
+                     batch_size: int = 128) -> \
+            Tuple[Tuple[Tuple[str, float], ...], ...]:
+        """Return the ``topn`` most cosine similar concepts of each of
+        ``cuis``.  The similarities of :obj:`batch_size` concepts to all
+        others are computed with one matrix product.
+
+        :param cuis: the concepts to find similar concepts
+
+        :param topn: the number of similar concepts of each concept
+
+        :param batch_size: the number of concepts compared at a time, which
+                           bounds memory to a matrix of ``batch_size`` by
+                           vocabulary size
+
+        :return: tuples of similar CUI and similarity in descending order of
+                 similarity for each of ``cuis``, which are empty for concepts
+                 not in the embedding
+
+        """
+        matrix: np.ndarray = self.matrix
+        norms: np.ndarray = self.norms
+        words: List[str] = self._data().words
+        rows: np.ndarray = np.fromiter(
+            map(lambda c: self.word2idx(c, -1), cuis), dtype=np.int64,
+            count=len(cuis))
+        # zero vectors (i.e. padding and unknown) are never similar
+        zero_cols: np.ndarray = np.flatnonzero(norms == 0)
+        col_norms: np.ndarray = np.where(norms > 0, norms, 1)
+        has: np.ndarray = np.flatnonzero(
+            (rows >= 0) & (norms[np.maximum(rows, 0)] > 0))
+        k: int = max(0, min(topn, matrix.shape[0] - len(zero_cols) - 1))
+        sims_by_cui: List[Tuple[Tuple[str, float], ...]] = [()] * len(cuis)
+        if k == 0:
+            return tuple(sims_by_cui)
+        start: int
+        for start in range(0, len(has), batch_size):
+            bix: np.ndarray = has[start:start + batch_size]
+            brows: np.ndarray = rows[bix]
+            sims: np.ndarray = (matrix[brows] @ matrix.T) / \
+                (norms[brows, None] * col_norms[None, :])
+            sims[:, zero_cols] = -np.inf
+            sims[np.arange(len(brows)), brows] = -np.inf
+            top: np.ndarray = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top_sims: np.ndarray = np.take_along_axis(sims, top, axis=1)
+            order: np.ndarray = np.argsort(-top_sims, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            top_sims = np.take_along_axis(top_sims, order, axis=1)
+            i: int
+            ix: int
+            for i, ix in enumerate(bix.tolist()):
+                sims_by_cui[ix] = tuple(map(
+                    lambda t: (words[t[0]], t[1]),
+                    zip(top[i].tolist(), top_sims[i].tolist())))
+        return tuple(sims_by_cui)
+
+
+@dataclass
+class Cui2VecIndexTokenDecorator(FeatureTokenDecorator):
+    """Adds the cui2vec embedding row of each token's concept at parse time so
+    :class:`.Cui2VecEmbeddingFeatureVectorizer` need not look up each CUI.
+    Non-concepts and concepts not in the embedding are given the unknown
+    index.  The rows are computed once for all concepts of the CDB using their
+    :class:`.ConceptCodes`.
+
+    """
+    embed_model: Cui2VecEmbedModel = field()
+    """The cui2vec embeddings."""
+
+    medcat_resource: MedCatResource = field()
+    """The MedCAT resource used to get the concept codes of tokens."""
+
+    feature_id: str = field(default='cui2vec_idx')
+    """The feature ID of the embedding row index added to tokens."""
+
+    def __post_init__(self):
+        self._code_rows = PersistedWork('_code_rows', self)
+
+    @property
+    @persisted('_code_rows')
+    def code_rows(self) -> np.ndarray:
+        """The embedding row of each concept code (see
+        :meth:`.Cui2VecEmbedModel.get_code_rows`).
+
+        """
+        return self.embed_model.get_code_rows(
+            self.medcat_resource.concept_codes)
+
+    def decorate(self, token: FeatureToken):
+        code: int = getattr(token, 'cui_code', -1)
+        token.set_feature(self.feature_id, int(self.code_rows[code]))
+
+
+@dataclass
+class Cui2VecEmbeddingFeatureVectorizer(WordVectorEmbeddingFeatureVectorizer):
+    """Like the super class, but uses the embedding row indexes added at parse
+    time by :class:`.Cui2VecIndexTokenDecorator` and creates the index tensor
+    from one array.  Tokens without the index feature are looked up in the
+    embedding with :obj:`token_feature_id`.
+
+    """
+    index_feature_id: str = field(default='cui2vec_idx')
+    """The feature ID of the embedding row index of each token."""
+
+    def _encode(self, doc: FeatureDocument) -> FeatureContext:
+        tw: int = self.manager.get_token_length(doc)
+        idxs: np.ndarray = _get_token_indexes(
+            self.embed_model, doc, self.index_feature_id,
+            self.token_feature_id)
+        lens: np.ndarray = np.fromiter(
+            map(lambda s: s.token_len, doc.sents), dtype=np.int64,
+            count=len(doc.sents))
+        # padding (ZERO) is the unknown index
+        arr: np.ndarray = Cui2VecSequenceStore.pad(
+            idxs, lens, tw, self.embed_model.unk_idx)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'encoded indexes with shape: {arr.shape}')
+        return TensorFeatureContext(
+            self.feature_id, self.torch_config.to(torch.from_numpy(arr)))
+
+
+@dataclass
+class Cui2VecSequenceStore(object):
+    """The cui2vec embedding row index of each token of a dataset of documents
+    computed in one (optionally parallel) pass and stored compactly in
+    :obj:`path` as a flat 32 bit integer array of the indexes of all tokens,
+    with the token count of each sentence and the sentence count of each
+    document.  Documents are keyed by a digest of their text, so
+    :class:`.Cui2VecSequenceFeatureVectorizer` finds the indexes of the
+    documents it encodes without any per token work.  The row offsets are
+    computed when the arrays are memory mapped.
+
+    The arrays and keys are appended to their files by each batch, and the
+    metadata, which has only the committed length of each file, is replaced
+    atomically after them.  Data past these lengths are left by interrupted
+    batches and are overwritten by the next batch.
+
+    """
+    _KEYS = ('keys', 'stash_keys')
+    """The names of the document and stash keys of the store."""
+
+    embed_model: Cui2VecEmbedModel = field()
+    """The cui2vec embeddings."""
+
+    path: Path = field()
+    """The directory of the index arrays."""
+
+    token_feature_id: str = field(default='cui_')
+    """The :class:`~zensols.nlp.tok.FeatureToken` attribute used to index the
+    embedding vectors for tokens without :obj:`index_feature_id`.
+
+    """
+    index_feature_id: str = field(default='cui2vec_idx')
+    """The feature ID of the embedding row index of each token (see
+    :class:`.Cui2VecIndexTokenDecorator`).
+
+    """
+    workers: int = field(default=1)
+    """The number of processes used to compute the indexes of documents, each
+    given batches of :obj:`batch_size` documents or keys of a stash.
+
+    """
+    batch_size: int = field(default=256)
+    """The number of documents indexed and written at a time."""
+
+    def __post_init__(self):
+        self._meta = PersistedWork('_meta', self)
+        self._arrays = PersistedWork('_arrays', self)
+        self._worker_stash: Stash = None
+
+    @staticmethod
+    def get_key(doc: FeatureDocument) -> str:
+        """Return the key of ``doc`` in the store, which is a digest of its
+        text.
+
+        """
+        return hashlib.blake2b(doc.text.encode(), digest_size=16).hexdigest()
+
+    def _get_keys_path(self, name: str) -> Path:
+        """Return the path of the keys ``name``, which are the ``keys`` of the
+        documents or the ``stash_keys`` added from stashes, as one JSON string
+        per line.
+
+        """
+        return self.path / f'{name}.jsonl'
+
+    @property
+    @persisted('_meta')
+    def meta(self) -> Dict[str, Any]:
+        """The document keys and array lengths of the store."""
+        meta_file: Path = self.path / 'meta.json'
+        meta: Dict[str, Any]
+        if meta_file.is_file():
+            with open(meta_file) as f:
+                meta = json.load(f)
+        else:
+            meta = {'n_sents': 0, 'n_toks': 0,
+                    'keys_bytes': 0, 'stash_keys_bytes': 0}
+        name: str
+        for name in self._KEYS:
+            n_bytes: int = meta[f'{name}_bytes']
+            keys: List[str] = []
+            if n_bytes > 0:
+                with open(self._get_keys_path(name), 'rb') as f:
+                    keys.extend(map(json.loads, f.read(n_bytes).splitlines()))
+            meta[name] = keys
+        meta['key2row'] = {k: i for i, k in enumerate(meta['keys'])}
+        return meta
+
+    @property
+    @persisted('_arrays')
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The memory mapped ``indexes`` of the tokens, the token count
+        (``sent_lens``) and first token (``sent_starts``) of each sentence and
+        the first sentence of each document (``doc_starts``).
+
+        """
+        meta: Dict[str, Any] = self.meta
+        lens: Dict[str, int] = {'indexes': meta['n_toks'],
+                                'sent_lens': meta['n_sents'],
+                                'doc_sents': len(meta['keys'])}
+        arrs: Dict[str, np.ndarray] = {}
+        name: str
+        n: int
+        for name, n in lens.items():
+            if n == 0:
+                arrs[name] = np.zeros(0, dtype=np.int32)
+            else:
+                arrs[name] = np.memmap(self.path / f'{name}.dat',
+                                       dtype=np.int32, mode='r', shape=(n,))
+        for name, lname in (('sent_starts', 'sent_lens'),
+                            ('doc_starts', 'doc_sents')):
+            starts = np.zeros(len(arrs[lname]) + 1, dtype=np.int64)
+            np.cumsum(arrs[lname], out=starts[1:])
+            arrs[name] = starts
+        return arrs
+
+    def _get_token_indexes(self, doc: FeatureDocument) -> \
+            Tuple[np.ndarray, np.ndarray]:
+        """Return the embedding row indexes of the tokens of ``doc`` and the
+        token count of each sentence.
+
+        """
+        idxs: np.ndarray = _get_token_indexes(
+            self.embed_model, doc, self.index_feature_id,
+            self.token_feature_id).astype(np.int32)
+        sent_lens = np.fromiter(map(lambda s: s.token_len, doc.sents),
+                                dtype=np.int32, count=len(doc.sents))
+        return idxs, sent_lens
+
+    def _sequence_batch(self, batch: Tuple[Union[str, FeatureDocument], ...]) \
+            -> Tuple[Tuple[str, ...],
+                     Tuple[Tuple[str, np.ndarray, np.ndarray], ...]]:
+        """Return the stash keys of ``batch`` and the key, token indexes and
+        sentence lengths of each document in ``batch``, which are documents or
+        keys of :obj:`_worker_stash`.
+
+        """
+        stash_keys: List[str] = []
+        seqs: List[Tuple[str, np.ndarray, np.ndarray]] = []
+        doc: Union[str, FeatureDocument]
+        for doc in batch:
+            if isinstance(doc, str):
+                stash_keys.append(doc)
+                doc = self._worker_stash[doc]
+            seqs.append((self.get_key(doc), *self._get_token_indexes(doc)))
+        return tuple(stash_keys), tuple(seqs)
+
+    def _truncate_append(self, path: Path, n_bytes: int, data: bytes):
+        """Append ``data`` to ``path`` after its first ``n_bytes``, which
+        removes the data of a previously interrupted add.
+
+        """
+        if path.is_file():
+            os.truncate(path, n_bytes)
+        with open(path, 'ab') as f:
+            f.write(data)
+
+    def _add_batch(self, seqs: Tuple[Tuple[str, np.ndarray, np.ndarray], ...],
+                   stash_keys: Tuple[str, ...]):
+        meta: Dict[str, Any] = self.meta
+        key2row: Dict[str, int] = meta['key2row']
+        n_docs: int = len(meta['keys'])
+        # documents already stored or repeated in the batch are skipped
+        uniq: Dict[str, Tuple[str, np.ndarray, np.ndarray]] = {}
+        seq: Tuple[str, np.ndarray, np.ndarray]
+        for seq in seqs:
+            if seq[0] not in key2row:
+                uniq.setdefault(seq[0], seq)
+        seqs = tuple(uniq.values())
+        item_size: int = np.dtype(np.int32).itemsize
+        keys: Dict[str, Tuple[str, ...]] = {
+            'keys': tuple(uniq.keys()),
+            'stash_keys': stash_keys}
+        self.path.mkdir(parents=True, exist_ok=True)
+        try:
+            name: str
+            n: int
+            arrs: Iterable[np.ndarray]
+            for name, n, arrs in (
+                    ('indexes', meta['n_toks'], map(lambda s: s[1], seqs)),
+                    ('sent_lens', meta['n_sents'], map(lambda s: s[2], seqs)),
+                    ('doc_sents', n_docs, (np.fromiter(
+                        map(lambda s: len(s[2]), seqs), dtype=np.int32),))):
+                self._truncate_append(
+                    self.path / f'{name}.dat', n * item_size,
+                    b''.join(map(lambda a: a.tobytes(), arrs)))
+            for name in self._KEYS:
+                data: bytes = ''.join(map(
+                    lambda k: json.dumps(k) + '\n', keys[name])).encode()
+                self._truncate_append(self._get_keys_path(name),
+                                      meta[f'{name}_bytes'], data)
+                meta[f'{name}_bytes'] += len(data)
+            meta['n_toks'] += sum(map(lambda s: len(s[1]), seqs))
+            meta['n_sents'] += sum(map(lambda s: len(s[2]), seqs))
+            # the metadata is the commit point of the batch
+            tmp_file: Path = self.path / 'meta.json.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump({k: meta[k] for k in
+                           'n_sents n_toks keys_bytes stash_keys_bytes'
+                           .split()}, f)
+            os.replace(tmp_file, self.path / 'meta.json')
+        except Exception:
+            # reread the last committed batch
+            self.close()
+            raise
+        for name in self._KEYS:
+            meta[name].extend(keys[name])
+        key2row.update(map(lambda t: (t[1], n_docs + t[0]),
+                           enumerate(keys['keys'])))
+        # the keys are kept in memory and only the arrays are remapped
+        self._arrays.clear()
+
+    def add(self, docs: Union[Stash, Iterable[FeatureDocument]]) -> int:
+        """Compute and store the embedding indexes of documents not already in
+        the store.
+
+        :param docs: a stash of documents, in which case each worker process
+                     loads the documents of its keys, or the documents
+
+        :return: the number of documents added
+
+        """
+        stash: Stash = None
+        items: Iterable[Union[str, FeatureDocument]]
+        if isinstance(docs, Stash):
+            stash = docs
+            done: Set[str] = set(self.meta['stash_keys'])
+            items = filter(lambda k: k not in done, stash.keys())
+        else:
+            key2row: Dict[str, int] = self.meta['key2row']
+            items = filter(lambda d: self.get_key(d) not in key2row, docs)
+        batches: Iterable[Tuple[Union[str, FeatureDocument], ...]] = iter(
+            lambda: tuple(it.islice(items, self.batch_size)), ())
+        # load the vocabulary before forking so it is shared by the workers
+        self.embed_model.word2idx_or_unk('')
+        pool: mp.Pool = None
+        n_added: int = 0
+        try:
+            if self.workers > 1:
+                pool = mp.get_context('fork').Pool(
+                    self.workers, initializer=_init_worker,
+                    initargs=(self, stash))
+                results = pool.imap(_sequence_batch, batches)
+            else:
+                self._worker_stash = stash
+                results = map(self._sequence_batch, batches)
+            stash_keys: Tuple[str, ...]
+            seqs: Tuple[Tuple[str, np.ndarray, np.ndarray], ...]
+            for stash_keys, seqs in results:
+                self._add_batch(seqs, stash_keys)
+                n_added += len(seqs)
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(f'indexed concepts of {n_added} docs')
+        finally:
+            self._worker_stash = None
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return n_added
+
+    def get(self, doc: FeatureDocument) -> \
+            Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Return the embedding row index of each token of ``doc`` and the
+        token count of each of its sentences, or ``None`` if ``doc`` is not in
+        the store.
+
+        """
+        row: int = self.meta['key2row'].get(self.get_key(doc))
+        if row is not None:
+            arrs: Dict[str, np.ndarray] = self.arrays
+            sent_starts: np.ndarray = arrs['sent_starts']
+            s_beg, s_end = arrs['doc_starts'][row:row + 2]
+            return (arrs['indexes'][sent_starts[s_beg]:sent_starts[s_end]],
+                    arrs['sent_lens'][s_beg:s_end])
+
+    @staticmethod
+    def pad(indexes: np.ndarray, lens: np.ndarray, token_length: int,
+            pad_idx: int) -> np.ndarray:
+        """Create a matrix of the rows of the flat ``indexes`` given by their
+        lengths.
+
+        :param indexes: the concatenated token indexes of the rows
+
+        :param lens: the number of tokens of each row
+
+        :param token_length: the number of columns, which truncates longer rows
+
+        :param pad_idx: the index of the elements after the end of a row
+
+        :return: an array of shape ``(len(lens), token_length)``
+
+        """
+        starts = np.zeros(len(lens), dtype=np.int64)
+        np.cumsum(lens[:-1], out=starts[1:])
+        cols: np.ndarray = np.arange(token_length)
+        mask: np.ndarray = cols < lens[:, None]
+        arr = np.full(mask.shape, pad_idx, dtype=np.int64)
+        arr[mask] = indexes[(starts[:, None] + cols)[mask]]
+        return arr
+
+    def __len__(self) -> int:
+        return len(self.meta['keys'])
+
+    def close(self):
+        """Unmap the arrays so they are reread on the next access."""
+        self._meta.clear()
+        self._arrays.clear()
+
+    def clear(self):
+        """Remove all indexes."""
+        self.close()
+        if self.path.is_dir():
+            for path in self.path.iterdir():
+                path.unlink()
+
+
+@dataclass(eq=False, repr=False)
+class Cui2VecIndexedDocument(FeatureDocument):
+    """The documents of a batch as the embedding indexes of the rows that
+    :class:`.Cui2VecSequenceFeatureVectorizer` encodes, which are pickled in
+    place of the tokens of the combined document.
+
+    """
+    indexes: np.ndarray = field(default=None)
+    """The concatenated embedding row indexes of the rows."""
+
+    row_lens: np.ndarray = field(default=None)
+    """The number of tokens of each row."""
+
+
+@dataclass
+class Cui2VecSequenceFeatureVectorizer(Cui2VecEmbeddingFeatureVectorizer):
+    """Like the super class, but creates the index tensor of documents in the
+    :obj:`sequence_store` from their stored indexes by padding them with
+    vectorized operations.  Batches of documents with ``concat_tokens`` or
+    ``sentence`` folding are combined in to a :class:`.Cui2VecIndexedDocument`
+    when all the documents are in the store.  Other documents are encoded by
+    the super class.
+
+    """
+    sequence_store: Cui2VecSequenceStore = field(default=None)
+    """The precomputed embedding indexes of the documents of a dataset."""
+
+    def _combine_documents(self, docs: Tuple[FeatureDocument, ...]) -> \
+            FeatureDocument:
+        store: Cui2VecSequenceStore = self.sequence_store
+        if store is not None and self.fold_method != 'raise':
+            seqs: Tuple[Optional[Tuple[np.ndarray, np.ndarray]], ...] = \
+                tuple(map(store.get, docs))
+            if all(map(lambda s: s is not None, seqs)):
+                lens: np.ndarray
+                if self.fold_method == 'concat_tokens':
+                    lens = np.fromiter(map(lambda s: len(s[0]), seqs),
+                                       dtype=np.int32, count=len(seqs))
+                else:
+                    lens = np.concatenate(
+                        tuple(map(lambda s: s[1], seqs)) +
+                        (np.zeros(0, dtype=np.int32),))
+                return Cui2VecIndexedDocument(
+                    sents=(), text=' '.join(map(lambda d: d.text, docs)),
+                    indexes=np.concatenate(
+                        tuple(map(lambda s: s[0], seqs)) +
+                        (np.zeros(0, dtype=np.int32),)),
+                    row_lens=lens)
+        return super()._combine_documents(docs)
+
+    def _encode(self, doc: FeatureDocument) -> FeatureContext:
+        seq: Tuple[np.ndarray, np.ndarray] = None
+        if isinstance(doc, Cui2VecIndexedDocument):
+            seq = (doc.indexes, doc.row_lens)
+        elif self.sequence_store is not None:
+            seq = self.sequence_store.get(doc)
+        if seq is None:
+            return super()._encode(doc)
+        lens: np.ndarray = seq[1].astype(np.int64)
+        tw: int = self.manager.token_length
+        if self.manager.is_batch_token_length:
+            tw = int(lens.max()) if len(lens) > 0 else 0
+        # padding (ZERO) is the unknown index
+        arr: np.ndarray = Cui2VecSequenceStore.pad(
+            seq[0], lens, tw, self.embed_model.unk_idx)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'encoded stored indexes with shape: {arr.shape}')
+        return TensorFeatureContext(
+            self.feature_id, self.torch_config.to(torch.from_numpy(arr)))
+
+
+@dataclass
+class ConceptEmbeddingStore(object):
+    """Pools the cui2vec vectors of the concepts of each document in to one
+    vector per document, which are stored in memory mapped matrices in
+    :obj:`path` with rows aligned to document names.  Documents are pooled in
+    vectorized batches of :obj:`batch_size` over the embedding matrix, and
+    only those with names not already in the store are pooled by :meth:`add`.
+
+    The poolings are ``mean`` and ``max`` of the concept vectors and ``tfidf``,
+    which is the mean weighted by the number of occurrences of each concept in
+    the document times its smoothed inverse document frequency.  The document
+    frequencies are updated with each batch, so the weights of documents added
+    earlier are not recomputed until the store is cleared and rebuilt.
+
+    """
+    _POOLINGS = frozenset('mean max tfidf'.split())
+    """The supported poolings."""
+
+    embed_model: Cui2VecEmbedModel = field()
+    """The cui2vec embeddings."""
+
+    path: Path = field()
+    """The directory of the pooled embedding matrices."""
+
+    poolings: Tuple[str, ...] = field(default=('mean', 'max', 'tfidf'))
+    """The poolings to compute, which are any of ``mean``, ``max`` and
+    ``tfidf``.
+
+    """
+    batch_size: int = field(default=256)
+    """The number of documents pooled at a time."""
+
+    def __post_init__(self):
+        unknown: Set[str] = set(self.poolings) - self._POOLINGS
+        if len(unknown) > 0:
+            raise MedNLPError(f'Unknown poolings: {unknown}')
+        self._meta = PersistedWork('_meta', self)
+        self._matrices = PersistedWork('_matrices', self)
+
+    @property
+    @persisted('_meta')
+    def meta(self) -> Dict[str, Any]:
+        """The document names and pooling parameters of the store."""
+        meta_file: Path = self.path / 'meta.json'
+        meta: Dict[str, Any]
+        if meta_file.is_file():
+            with open(meta_file) as f:
+                meta = json.load(f)
+            if meta['poolings'] != list(self.poolings):
+                raise MedNLPError(
+                    f"Store has poolings {meta['poolings']}, " +
+                    f'but configured with {self.poolings}')
+        else:
+            meta = {'names': [],
+                    'poolings': list(self.poolings),
+                    'dimension': self.embed_model.vector_dimension}
+        meta['name2row'] = {n: i for i, n in enumerate(meta['names'])}
+        return meta
+
+    def _get_doc_freqs_path(self, n_docs: int) -> Path:
+        """Return the path of the document frequencies of the first
+        ``n_docs`` documents.
+
+        """
+        return self.path / f'doc-freqs-{n_docs}.npy'
+
+    def _get_doc_freqs(self) -> np.ndarray:
+        n_docs: int = len(self.meta['names'])
+        if n_docs > 0:
+            return np.load(self._get_doc_freqs_path(n_docs))
+        return np.zeros(self.embed_model.matrix.shape[0], dtype=np.int64)
+
+    def _get_rows(self, doc: FeatureDocument) -> np.ndarray:
+        """Return the embedding rows of the concepts of ``doc``, which uses
+        the ``cui2vec_idx`` feature (see :class:`.Cui2VecIndexTokenDecorator`)
+        when available.
+
+        """
+        emodel: Cui2VecEmbedModel = self.embed_model
+        unk: int = emodel.unk_idx
+
+        def get_row(tok: FeatureToken) -> int:
+            row: int = getattr(tok, 'cui2vec_idx', None)
+            if row is None:
+                row = emodel.word2idx(tok.cui_, unk)
+            return row
+
+        rows = np.fromiter(
+            map(get_row, filter(lambda t: t.is_concept, doc.token_iter())),
+            dtype=np.int64)
+        return rows[rows != unk]
+
+    def _pool(self, doc_rows: List[np.ndarray], idf: np.ndarray) -> \
+            Dict[str, np.ndarray]:
+        """Pool the embeddings of the concepts of a batch of documents.
+
+        :param doc_rows: the embedding rows of each document's concepts
+
+        :param idf: the inverse document frequency of each embedding row
+
+        :return: the pooled vectors of each document keyed by pooling, which
+                 are zero for documents without embedded concepts
+
+        """
+        matrix: np.ndarray = self.embed_model.matrix
+        pools: Dict[str, np.ndarray] = {
+            p: np.zeros((len(doc_rows), matrix.shape[1]), dtype=np.float32)
+            for p in self.poolings}
+        lens = np.array(tuple(map(len, doc_rows)), dtype=np.int64)
+        has_rows: np.ndarray = np.flatnonzero(lens)
+        if len(has_rows) > 0:
+            rows: np.ndarray = np.concatenate(
+                tuple(map(lambda i: doc_rows[i], has_rows)))
+            vecs: np.ndarray = matrix[rows]
+            starts: np.ndarray = np.concatenate(
+                ((0,), np.cumsum(lens[has_rows])[:-1]))
+            if 'mean' in pools:
+                pools['mean'][has_rows] = np.add.reduceat(
+                    vecs, starts, axis=0) / lens[has_rows, None]
+            if 'max' in pools:
+                pools['max'][has_rows] = np.maximum.reduceat(
+                    vecs, starts, axis=0)
+            if 'tfidf' in pools:
+                # term frequency is given by repeated rows of a document
+                weights: np.ndarray = idf[rows]
+                pools['tfidf'][has_rows] = np.add.reduceat(
+                    vecs * weights[:, None], starts, axis=0) / \
+                    np.add.reduceat(weights, starts)[:, None]
+        return pools
+
+    def _add_batch(self, batch: Tuple[Tuple[str, FeatureDocument], ...]):
+        meta: Dict[str, Any] = self.meta
+        n_docs: int = len(meta['names'])
+        doc_rows: List[np.ndarray] = list(map(
+            lambda t: self._get_rows(t[1]), batch))
+        doc_freqs: np.ndarray = self._get_doc_freqs()
+        doc_freqs += np.bincount(
+            np.concatenate(tuple(map(np.unique, doc_rows)) + ((),))
+            .astype(np.int64), minlength=len(doc_freqs))
+        n_total: int = n_docs + len(batch)
+        idf: np.ndarray = np.log((1 + n_total) / (1 + doc_freqs)) + 1
+        pools: Dict[str, np.ndarray] = self._pool(doc_rows, idf)
+        row_bytes: int = meta['dimension'] * np.dtype(np.float32).itemsize
+        self.path.mkdir(parents=True, exist_ok=True)
+        pooling: str
+        arr: np.ndarray
+        for pooling, arr in pools.items():
+            path: Path = self.path / f'{pooling}.dat'
+            if path.is_file():
+                # remove rows of a previously interrupted add
+                os.truncate(path, n_docs * row_bytes)
+            with open(path, 'ab') as f:
+                f.write(arr.tobytes())
+        # the document frequencies of each number of documents are kept until
+        # the metadata, which is the commit point of the batch, is replaced
+        np.save(self._get_doc_freqs_path(n_total), doc_freqs)
+        meta['names'].extend(map(lambda t: t[0], batch))
+        tmp_file: Path = self.path / 'meta.json.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({k: meta[k] for k in 'names poolings dimension'.split()},
+                      f)
+        os.replace(tmp_file, self.path / 'meta.json')
+        prev_file: Path = self._get_doc_freqs_path(n_docs)
+        if prev_file.is_file():
+            prev_file.unlink()
+        self.close()
+
+    def add(self, docs: Union[Stash, Iterable[Tuple[str, FeatureDocument]]]) \
+            -> int:
+        """Pool and store the embeddings of documents not already in the
+        store.
+
+        :param docs: a stash of documents such as
+                     :class:`~zensols.mednlp.docstore.MedicalDocumentStore`, or
+                     tuples of unique document names and documents
+
+        :return: the number of documents added
+
+        """
+        # names added by previous batches and duplicates are skipped
+        seen: Set[str] = set(self.meta['names'])
+
+        def is_new(name: str) -> bool:
+            if name in seen:
+                return False
+            seen.add(name)
+            return True
+
+        if isinstance(docs, Stash):
+            stash: Stash = docs
+            docs = map(lambda k: (k, stash[k]),
+                       filter(is_new, stash.keys()))
+        else:
+            docs = filter(lambda t: is_new(t[0]), docs)
+        n_added: int = 0
+        while True:
+            batch: Tuple[Tuple[str, FeatureDocument], ...] = tuple(
+                it.islice(docs, self.batch_size))
+            if len(batch) == 0:
+                break
+            self._add_batch(batch)
+            n_added += len(batch)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f'pooled concept embeddings of {n_added} docs')
+        return n_added
+
+    @property
+    @persisted('_matrices')
+    def matrices(self) -> Dict[str, np.ndarray]:
+        """The memory mapped pooled embeddings keyed by pooling with rows in
+        the order of :obj:`names`.
+
+        """
+        meta: Dict[str, Any] = self.meta
+        shape: Tuple[int, int] = (len(meta['names']), meta['dimension'])
+        mats: Dict[str, np.ndarray] = {}
+        pooling: str
+        for pooling in self.poolings:
+            if shape[0] == 0:
+                mats[pooling] = np.zeros(shape, dtype=np.float32)
+            else:
+                mats[pooling] = np.memmap(
+                    self.path / f'{pooling}.dat', dtype=np.float32,
+                    mode='r', shape=shape)
+        return mats
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        """The document names in the order of the rows of the matrices."""
+        return tuple(self.meta['names'])
+
+    def get(self, name: str, pooling: str = 'mean') -> np.ndarray:
+        """Return the pooled embedding of a document or ``None`` if the
+        document has not been added.
+
+        """
+        if pooling not in self.poolings:
+            raise MedNLPError(f'No such pooling: {pooling}')
+        row: int = self.meta['name2row'].get(name)
+        if row is not None:
+            return self.matrices[pooling][row]
+
+    def __len__(self) -> int:
+        return len(self.meta['names'])
+
+    def close(self):
+        """Unmap the matrices so they are reread on the next access."""
+        self._meta.clear()
+        self._matrices.clear()
+
+    def clear(self):
+        """Remove all pooled embeddings."""
+        self.close()
+        if self.path.is_dir():
+            for path in self.path.iterdir():
+                path.unlink()
@@ -0,0 +1,179 @@
+"""Create Pandas dataframes of medical features with the concept features
+joined from a table of the document's concepts.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Tuple, List, Dict, Set, Any, Iterable, ClassVar
+from dataclasses import dataclass, field
+import logging
+import numpy as np
+import pandas as pd
+from medcat.cdb import CDB
+from zensols.nlp import FeatureToken, FeatureSpan, FeatureDocument
+from zensols.nlp.dataframe import FeatureDataFrameFactory
+from . import MedNLPError, MedCatResource, ConceptCodes
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MedicalDataFrameFactory(FeatureDataFrameFactory):
+    """Creates a dataframe of medical token features like its super class, but
+    the features of each concept (:obj:`CONCEPT_FEATURE_IDS`) are not read
+    from the tokens.  Instead, the other token features are read by column,
+    and the concept features are computed once for each unique concept of the
+    document and joined to the tokens by their ``cui_``.
+
+    Documents need only the :obj:`parse_feature_ids` features, so the parser
+    can skip the concept database lookups of each token when it is configured
+    with them.  Concepts are cached across calls, so the features of a concept
+    are computed once for all documents.
+
+    """
+    CONCEPT_FEATURE_IDS: ClassVar[Tuple[str, ...]] = tuple(
+        ('cui cui_code pref_name_ tuis tuis_ tui_descs_ tui_bits ' +
+         'group_bits groups sub_names').split())
+    """The features of the concept table joined to the tokens."""
+
+    _NON_CONCEPT: ClassVar[Tuple[Any, ...]] = (
+        -1, -1, FeatureToken.NONE, frozenset(), '', '', 0, 0, frozenset(), [])
+    """The features of tokens that are not concepts in the order of
+    :obj:`CONCEPT_FEATURE_IDS`.
+
+    """
+    _SCALARS: ClassVar[Set[type]] = frozenset(
+        {str, int, float, bool, type(None)})
+    """The types of feature values added to the dataframe as they are."""
+
+    resource: MedCatResource = field(default=None)
+    """The resource used to create the concept features."""
+
+    def __post_init__(self):
+        if self.resource is None:
+            raise MedNLPError('Missing medcat resource')
+        self._concepts: Dict[str, Tuple[Any, ...]] = {}
+
+    @property
+    def parse_feature_ids(self) -> Set[str]:
+        """The token features the parser must add to documents, which are
+        :obj:`token_feature_ids` without the concept features.
+
+        """
+        return (set(self.token_feature_ids) -
+                set(self.CONCEPT_FEATURE_IDS)) | {'norm', 'cui_'}
+
+    def _create_concept(self, cui: str) -> Tuple[Any, ...]:
+        """Return the features of a concept in the order of
+        :obj:`CONCEPT_FEATURE_IDS`.
+
+        """
+        res: MedCatResource = self.resource
+        codes: ConceptCodes = res.concept_codes
+        cdb: CDB = res.cat.cdb
+        tui_descs: Dict[str, str] = res.tuis
+        code: int = codes.get_cui_code(cui)
+        tui_bits: int = codes.get_tui_bits(code)
+        group_bits: int = int(res.cui_group_bits[code])
+        tuis: Tuple[str, ...] = codes.get_tuis(tui_bits)
+        return (int(cui[1:]),
+                code,
+                cdb.cui2preferred_name.get(cui),
+                tuis,
+                ','.join(tuis),
+                ', '.join(map(lambda t: tui_descs.get(t, f'? ({t})'), tuis)),
+                tui_bits,
+                group_bits,
+                res.semantic_groups.get_groups(group_bits),
+                tuple(sorted(cdb.cui2names.get(cui, ()))))
+
+    def concept_table(self, cuis: Iterable[str]) -> pd.DataFrame:
+        """Return a dataframe of the features of the concepts ``cuis`` indexed
+        by CUI.
+
+        """
+        concepts: Dict[str, Tuple[Any, ...]] = self._concepts
+        cuis = tuple(cuis)
+        rows: List[Tuple[Any, ...]] = []
+        cui: str
+        for cui in cuis:
+            row: Tuple[Any, ...] = concepts.get(cui)
+            if row is None:
+                if cui == FeatureToken.NONE:
+                    row = self._NON_CONCEPT
+                else:
+                    row = self._create_concept(cui)
+                concepts[cui] = row
+            rows.append(row)
+        return pd.DataFrame(rows, columns=self.CONCEPT_FEATURE_IDS,
+                            index=pd.Index(cuis, name='cui_'))
+
+    def _join_concepts(self, cuis: np.ndarray, cols: Iterable[str]) -> \
+            Dict[str, np.ndarray]:
+        """Join the concept features of ``cols`` to ``cuis``."""
+        uniq: np.ndarray
+        inv: np.ndarray
+        uniq, inv = np.unique(cuis, return_inverse=True)
+        table: pd.DataFrame = self.concept_table(uniq.tolist())
+        return {c: table[c].to_numpy()[inv] for c in cols}
+
+    def _readable(self, tok: FeatureToken, vals: Iterable[Any]) -> \
+            Iterable[Any]:
+        """Convert values that are not scalars (i.e. lexical spans, tuples and
+        sets) as :meth:`~zensols.config.dictable.Dictable.asdict` does.
+
+        """
+        scalars: Set[type] = self._SCALARS
+        return map(lambda v: v if type(v) in scalars
+                   else tok._from_object(v, True, True), vals)
+
+    def __call__(self, doc: FeatureDocument) -> pd.DataFrame:
+        fids: Set[str] = self.token_feature_ids
+        cols: List[str] = list(filter(lambda n: n in fids,
+                                      self.priority_feature_ids))
+        cols.extend(sorted(fids - set(cols)))
+        toks: Tuple[FeatureToken, ...] = tuple(doc.token_iter())
+        ccols: Set[str] = set(self.CONCEPT_FEATURE_IDS) & set(cols)
+        feats: Tuple[Dict[str, Any], ...] = tuple(map(vars, toks))
+        data: Dict[str, Any] = {}
+        col: str
+        for col in filter(lambda c: c not in ccols, cols):
+            if col == 'text':
+                data[col] = [f.get('text', f.get('norm')) for f in feats]
+            else:
+                data[col] = [f.get(col) for f in feats]
+        if len(ccols) > 0:
+            none: str = FeatureToken.NONE
+            cuis = np.array([f.get('cui_', none) for f in feats], dtype=str)
+            data.update(self._join_concepts(cuis, ccols))
+        # columns of objects are formatted like the super class's rows
+        vals: Any
+        for col, vals in data.items():
+            if len(toks) > 0 and \
+               (isinstance(vals, list) or vals.dtype == object):
+                data[col] = list(self._readable(toks[0], vals))
+        return pd.DataFrame(data, columns=cols)
+
+    def entities(self, doc: FeatureDocument) -> pd.DataFrame:
+        """Return a dataframe with a row for each concept entity of ``doc``
+        with its text, character offsets, and the features of the concept
+        table.
+
+        """
+        spans: Tuple[FeatureSpan, ...] = tuple(filter(
+            lambda s: s.tokens[0].is_concept, doc.entities))
+        cuis = np.array(tuple(map(lambda s: s.tokens[0].cui_, spans)),
+                        dtype=str)
+        data: Dict[str, Any] = {
+            'cui_': cuis,
+            'text': tuple(map(lambda s: s.text, spans)),
+            'begin': np.fromiter(map(lambda s: s.lexspan.begin, spans),
+                                 dtype=np.int64, count=len(spans)),
+            'end': np.fromiter(map(lambda s: s.lexspan.end, spans),
+                               dtype=np.int64, count=len(spans))}
+        data.update(self._join_concepts(cuis, self.CONCEPT_FEATURE_IDS))
+        return pd.DataFrame(data, columns=tuple(data.keys()))
+
+    def clear(self):
+        """Clear the cached concept features."""
+        self._concepts.clear()
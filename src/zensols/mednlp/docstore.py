@@ -0,0 +1,323 @@
+"""A compact columnar binary format for parsed medical documents.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Tuple, List, Dict, Any, Iterable, Sequence, Optional
+from dataclasses import dataclass, field
+import logging
+import json
+from array import array
+from pathlib import Path
+import numpy as np
+from zensols.persist import persisted, PersistedWork, ReadOnlyStash
+from zensols.nlp import (
+    LexicalSpan, FeatureToken, FeatureSentence, FeatureDocument
+)
+from . import MedNLPError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MedicalDocumentStore(ReadOnlyStash):
+    """A read only stash of medical feature documents stored as columns of
+    token features in ``numpy`` files in :obj:`path`.  Each token column is
+    the concatenation of the tokens of all documents, and documents are
+    located by their token and sentence offsets.  Strings (i.e. ``norm``) are
+    stored as integer indexes in to a string table shared by all documents,
+    CUIs as integers (``-1`` for non-concepts), and the TUIs of each token as a
+    bitset of :obj:`tui_words` 64 bit words.
+
+    The files are memory mapped on first access, so reading a document only
+    touches the rows of its tokens.  Use :meth:`columns` for zero-copy array
+    access, or :meth:`load` to create a :class:`~zensols.nlp.FeatureDocument`.
+    Documents are written once with :meth:`write`.
+
+    """
+    _VERSION = 1
+    """The version of the format written in the meta data file."""
+
+    _TOKEN_COLUMNS = {
+        'i': np.int32,
+        'begin': np.int32,
+        'end': np.int32,
+        'norm': np.int32,
+        'cui': np.int32,
+        'context_similarity': np.float32}
+    """The token feature columns and their types."""
+
+    _COLUMNS = tuple(_TOKEN_COLUMNS.keys()) + ('tuis',)
+    """The names of the columns of each token, including the TUI bitsets."""
+
+    path: Path = field()
+    """The directory of the column files."""
+
+    tui_words: int = field(default=2)
+    """The number of 64 bit words in each TUI bitset, which fits the 127 UMLS
+    semantic types with the default.
+
+    """
+    def __post_init__(self):
+        super().__post_init__()
+        self._meta = PersistedWork('_meta', self)
+        self._arrays = PersistedWork('_arrays', self)
+        self._strings: List[str] = []
+        self._tuis: Dict[Tuple[int, ...], Tuple[str, ...]] = {}
+
+    def _get_string_table(self, strs: Sequence[str]) -> \
+            Tuple[bytes, np.ndarray]:
+        """Return the UTF-8 encoding of ``strs`` and their offsets."""
+        encs: List[bytes] = list(map(lambda s: s.encode('utf-8'), strs))
+        offsets = np.zeros(len(encs) + 1, dtype=np.int64)
+        np.cumsum(list(map(len, encs)), out=offsets[1:])
+        return b''.join(encs), offsets
+
+    @staticmethod
+    def _get_token_tuis(tok: FeatureToken) -> Tuple[str, ...]:
+        tuis: Tuple[str, ...] = getattr(tok, 'tuis', None)
+        if tuis is None:
+            tuis_: str = getattr(tok, 'tuis_', '')
+            tuis = () if len(tuis_) == 0 else tuple(tuis_.split(','))
+        return tuis
+
+    def write(self, docs: Iterable[Tuple[str, FeatureDocument]]) -> int:
+        """Write documents to :obj:`path`, which replaces any previously
+        written documents.
+
+        :param docs: tuples of unique document names and documents parsed
+                     with the medical parser
+
+        :return: the number of documents written
+
+        """
+        cols: Dict[str, array] = {
+            'i': array('i'), 'begin': array('i'), 'end': array('i'),
+            'norm': array('i'), 'cui': array('i'),
+            'context_similarity': array('f')}
+        tui_bits: List[int] = []
+        sent_lens = array('i')
+        doc_toks = array('q', [0])
+        doc_sents = array('q', [0])
+        strs: Dict[str, int] = {}
+        tuis: Dict[str, int] = {}
+        names: List[str] = []
+        texts: List[str] = []
+        max_tuis: int = self.tui_words * 64
+        name: str
+        doc: FeatureDocument
+        for name, doc in docs:
+            names.append(name)
+            texts.append(doc.text)
+            sent: FeatureSentence
+            for sent in doc.sents:
+                sent_lens.append(sent.token_len)
+                tok: FeatureToken
+                for tok in sent.token_iter():
+                    cui_: str = getattr(tok, 'cui_', FeatureToken.NONE)
+                    is_concept: bool = cui_ != FeatureToken.NONE
+                    cols['i'].append(tok.i)
+                    cols['begin'].append(tok.lexspan.begin)
+                    cols['end'].append(tok.lexspan.end)
+                    cols['norm'].append(strs.setdefault(tok.norm, len(strs)))
+                    cols['cui'].append(int(cui_[1:]) if is_concept else -1)
+                    cols['context_similarity'].append(
+                        getattr(tok, 'context_similarity', -1)
+                        if is_concept else -1)
+                    bits: int = 0
+                    if is_concept:
+                        tui: str
+                        for tui in self._get_token_tuis(tok):
+                            bits |= 1 << tuis.setdefault(tui, len(tuis))
+                    tui_bits.append(bits)
+            if len(tuis) > max_tuis:
+                raise MedNLPError(f'More than {max_tuis} TUIs in {name}')
+            doc_toks.append(len(cols['i']))
+            doc_sents.append(len(sent_lens))
+        if len(set(names)) != len(names):
+            raise MedNLPError('Document names are not unique')
+        mask: int = (1 << 64) - 1
+        tui_arr = np.array(
+            list(map(lambda b: tuple(map(lambda w: (b >> (w * 64)) & mask,
+                                         range(self.tui_words))),
+                     tui_bits)),
+            dtype=np.uint64).reshape(-1, self.tui_words)
+        self.path.mkdir(parents=True, exist_ok=True)
+        col: str
+        dtype: type
+        for col, dtype in self._TOKEN_COLUMNS.items():
+            np.save(self.path / f'{col}.npy', np.array(cols[col], dtype=dtype))
+        np.save(self.path / 'tuis.npy', tui_arr)
+        np.save(self.path / 'sent_lens.npy', np.array(sent_lens, np.int32))
+        np.save(self.path / 'doc_tokens.npy', np.array(doc_toks, np.int64))
+        np.save(self.path / 'doc_sents.npy', np.array(doc_sents, np.int64))
+        for fname, data in (('strings', strs.keys()), ('texts', texts)):
+            blob, offsets = self._get_string_table(tuple(data))
+            with open(self.path / f'{fname}.bin', 'wb') as f:
+                f.write(blob)
+            np.save(self.path / f'{fname}_offsets.npy', offsets)
+        with open(self.path / 'meta.json', 'w') as f:
+            json.dump({'version': self._VERSION,
+                       'tui_words': self.tui_words,
+                       'tuis': sorted(tuis.keys(), key=lambda t: tuis[t]),
+                       'names': names}, f)
+        self.close()
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'wrote {len(names)} documents to {self.path}')
+        return len(names)
+
+    @property
+    @persisted('_meta')
+    def meta(self) -> Dict[str, Any]:
+        """The document names, TUIs of the bitsets and format version."""
+        meta_file: Path = self.path / 'meta.json'
+        if not meta_file.is_file():
+            raise MedNLPError(f'No documents written to {self.path}')
+        with open(meta_file) as f:
+            meta: Dict[str, Any] = json.load(f)
+        if meta['version'] != self._VERSION:
+            raise MedNLPError(f"Unknown version: {meta['version']}")
+        meta['name2row'] = {n: i for i, n in enumerate(meta['names'])}
+        return meta
+
+    @property
+    @persisted('_arrays')
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The memory mapped arrays keyed by column name."""
+        arrs: Dict[str, np.ndarray] = {}
+        path: Path
+        for path in self.path.iterdir():
+            if path.suffix == '.npy':
+                arrs[path.stem] = np.load(path, mmap_mode='r')
+            elif path.suffix == '.bin':
+                arrs[path.stem] = np.memmap(path, dtype=np.uint8, mode='r') \
+                    if path.stat().st_size > 0 else np.zeros(0, np.uint8)
+        return arrs
+
+    def _get_string(self, name: str, i: int) -> str:
+        arrs: Dict[str, np.ndarray] = self.arrays
+        offsets: np.ndarray = arrs[f'{name}_offsets']
+        return arrs[name][offsets[i]:offsets[i + 1]].tobytes().decode('utf-8')
+
+    def _get_row(self, name: str) -> int:
+        row: int = self.meta['name2row'].get(name)
+        if row is None:
+            raise MedNLPError(f'No such document: {name}')
+        return row
+
+    def columns(self, name: str) -> Dict[str, np.ndarray]:
+        """Return the memory mapped token columns of a document without
+        copying them.
+
+        :param name: the name of the document
+
+        :return: the token features keyed by column name, which includes
+                 ``tuis`` as a ``(<tokens>, tui_words)`` shaped array
+
+        """
+        row: int = self._get_row(name)
+        arrs: Dict[str, np.ndarray] = self.arrays
+        start, end = arrs['doc_tokens'][row:row + 2]
+        return {col: arrs[col][start:end] for col in self._COLUMNS}
+
+    def get_tuis(self, bitset: Sequence[int]) -> Tuple[str, ...]:
+        """Return the TUIs of a token's TUI bitset."""
+        tuis: List[str] = self.meta['tuis']
+        found: List[str] = []
+        w: int
+        word: int
+        if isinstance(bitset, np.ndarray):
+            bitset = bitset.tolist()
+        for w, word in enumerate(bitset):
+            while word:
+                low: int = word & -word
+                found.append(tuis[w * 64 + low.bit_length() - 1])
+                word ^= low
+        return tuple(sorted(found))
+
+    def _create_tokens(self, cols: Dict[str, np.ndarray],
+                       sent_lens: Iterable[int], text: str) -> \
+            Iterable[List[FeatureToken]]:
+        """Create the tokens of each sentence of a document from its
+        columns.
+
+        """
+        norms: List[str] = self._strings
+        tui_cache: Dict[Tuple[int, ...], Tuple[str, ...]] = self._tuis
+        rows: Tuple[List[Any], ...] = tuple(map(
+            lambda c: cols[c].tolist(),
+            'i begin end norm cui context_similarity'.split()))
+        tui_bits: List[List[int]] = cols['tuis'].tolist()
+        none: str = FeatureToken.NONE
+        j: int = 0
+        sent_i: int
+        n_toks: int
+        for sent_i, n_toks in enumerate(sent_lens):
+            toks: List[FeatureToken] = []
+            for i_sent in range(n_toks):
+                i, begin, end, norm, cui, sim = map(lambda r: r[j], rows)
+                if norm >= len(norms):
+                    norms.extend(map(
+                        lambda k: self._get_string('strings', k),
+                        range(len(norms), norm + 1)))
+                feats: Dict[str, Any] = {
+                    'i': i, 'idx': begin, 'i_sent': i_sent,
+                    'sent_i': sent_i, 'norm': norms[norm],
+                    'text': text[begin:end],
+                    'lexspan': LexicalSpan(begin, end),
+                    'is_concept': cui >= 0, 'cui': cui}
+                if cui >= 0:
+                    bits: Tuple[int, ...] = tuple(tui_bits[j])
+                    tuis: Tuple[str, ...] = tui_cache.get(bits)
+                    if tuis is None:
+                        tuis = self.get_tuis(bits)
+                        tui_cache[bits] = tuis
+                    feats.update({'cui_': f'C{cui:07d}', 'tuis': tuis,
+                                  'tuis_': ','.join(tuis),
+                                  'context_similarity': sim})
+                else:
+                    feats.update({'cui_': none, 'tuis': (), 'tuis_': '',
+                                  'context_similarity': -1})
+                # skip the initializer as FeatureToken.detach does
+                tok = FeatureToken.__new__(FeatureToken)
+                tok.__dict__.update(feats)
+                tok._detached_feature_ids = set(feats.keys())
+                toks.append(tok)
+                j += 1
+            yield toks
+
+    def load(self, name: str) -> FeatureDocument:
+        row: Optional[int] = self.meta['name2row'].get(name)
+        if row is None:
+            return None
+        arrs: Dict[str, np.ndarray] = self.arrays
+        text: str = self._get_string('texts', row)
+        t_start, t_end = arrs['doc_tokens'][row:row + 2].tolist()
+        s_start, s_end = arrs['doc_sents'][row:row + 2].tolist()
+        cols: Dict[str, np.ndarray] = {
+            col: arrs[col][t_start:t_end] for col in self._COLUMNS}
+        sents: List[FeatureSentence] = []
+        toks: List[FeatureToken]
+        for toks in self._create_tokens(
+                cols, arrs['sent_lens'][s_start:s_end].tolist(), text):
+            sent_text: str = None
+            if len(toks) > 0:
+                sent_text = text[toks[0].lexspan.begin:toks[-1].lexspan.end]
+            sents.append(FeatureSentence(tuple(toks), sent_text))
+        return FeatureDocument(tuple(sents), text)
+
+    def keys(self) -> Iterable[str]:
+        return iter(self.meta['names'])
+
+    def exists(self, name: str) -> bool:
+        return name in self.meta['name2row']
+
+    def __len__(self) -> int:
+        return len(self.meta['names'])
+
+    def close(self):
+        """Unmap the files so they are reread on the next access."""
+        self._meta.clear()
+        self._arrays.clear()
+        self._strings.clear()
+        self._tuis.clear()
@@ -2,7 +2,7 @@
 
 """
 __author__ = 'Paul Landes'
-from typing import Optional
+from typing import Tuple, Optional
 from dataclasses import dataclass, field
 import logging
 from spacy.tokens.span import Span
@@ -16,6 +16,38 @@ class MedNLPError(APIError):
     pass
 
 
+@dataclass
+class ConceptEntity(object):
+    """A compact linked concept found in text without the tokens of a parsed
+    document.
+
+    :see: :meth:`.MedicalLibrary.extract_entities`
+
+    """
+    begin: int = field()
+    """The character offset of the start of the concept in the text."""
+
+    end: int = field()
+    """The character offset of the end of the concept in the text."""
+
+    cui: str = field()
+    """The unique UMLS concept ID."""
+
+    pref_name: str = field()
+    """The preferred name of the concept."""
+
+    tuis: Tuple[str, ...] = field()
+    """The sorted TUIs (types) of the concept."""
+
+    similarity: float = field()
+    """The context similarity of the concept, which is -1 when not
+    disambiguated.
+
+    """
+    status: Optional[str] = field(default=None)
+    """The MetaCAT status (i.e. ``Affirmed``) when requested."""
+
+
 @dataclass
 class _MedicalEntity(object):
     """Container class for general and medical specific named entities.
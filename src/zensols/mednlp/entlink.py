@@ -3,15 +3,20 @@
 """
 __author__ = 'Paul Landes'
 
-from typing import Tuple, Dict, Any
+from typing import Tuple, List, Dict, Any, Iterable, Optional
 from dataclasses import dataclass, field, InitVar
 import logging
+from importlib.metadata import version
+import pickle
+import sqlite3
+from pathlib import Path
+from collections import OrderedDict
 from scispacy.linking import EntityLinker
 from scispacy.linking_utils import Entity as SciSpacyEntity
 from zensols.persist import persisted, PersistedWork
 from zensols.config import Dictable
 from zensols.nlp import FeatureToken, FeatureTokenDecorator
-from . import MedicalLibrary
+from . import MedicalLibrary, Metrics, stage_timer
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +58,219 @@ class EntitySimilarity(Entity):
     similiarty: float = field()
 
 
+@dataclass
+class LinkedEntityCache(object):
+    """A two level cache of linked entities by CUI.  The first level is an in
+    memory least recently used (LRU) cache, and the optional second is an
+    SQLite database that is shared by processes and kept across runs.  Each
+    level is bounded by its number of entries and the total size of the
+    pickled entities, and the least recently used (in memory) or oldest (on
+    disk) entries are evicted first.  CUIs with no entity are also cached.
+    The on-disk level is emptied when it was written for a different
+    :obj:`kb_key` (i.e. after upgrading scispaCy and its knowledge base).
+
+    """
+    MISSING = object()
+    """Returned by :meth:`get` for CUIs not in the cache."""
+
+    max_entries: int = field(default=10000)
+    """The maximum number of entities in memory."""
+
+    max_bytes: int = field(default=64 * 1024 ** 2)
+    """The maximum total pickled size of the entities in memory."""
+
+    path: Path = field(default=None)
+    """The SQLite database file of the on-disk level, or ``None`` for no
+    on-disk level.
+
+    """
+    disk_max_entries: int = field(default=1000000)
+    """The maximum number of entities on disk."""
+
+    disk_max_bytes: int = field(default=1024 ** 3)
+    """The maximum total pickled size of the entities on disk."""
+
+    kb_key: str = field(default=None)
+    """Identifies the knowledge base of the entities, which is set by
+    :class:`.EntityLinkerResource` if not given.
+
+    """
+
+    metrics: Metrics = field(default=None)
+    """If set and enabled, records the hits and misses of each level as the
+    ``link.memory`` and ``link.disk`` caches.
+
+    """
+    def __post_init__(self):
+        # CUI -> (entity, pickled size)
+        self._entries: Dict[str, Tuple[Optional[Entity], int]] = \
+            OrderedDict()
+        self._bytes: int = 0
+        self._counts: Dict[str, int] = {}
+        self._conn = PersistedWork('_conn', self)
+
+    @property
+    @persisted('_conn')
+    def conn(self) -> sqlite3.Connection:
+        """The connection to the on-disk level."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=60)
+        # replaced rows fire the delete trigger
+        conn.execute('pragma recursive_triggers = on')
+        with conn:
+            conn.execute("""create table if not exists entity (
+                              id integer primary key, cui text not null unique,
+                              data blob not null, size integer not null)""")
+            # the number and total size of the entities kept by triggers so
+            # puts need not scan the table
+            conn.execute("""create table if not exists entity_total (
+                              id integer primary key check (id = 0),
+                              n integer not null, size integer not null)""")
+            conn.execute("""create trigger if not exists entity_insert
+                              after insert on entity begin
+                              update entity_total set n = n + 1,
+                                size = size + new.size; end""")
+            conn.execute("""create trigger if not exists entity_delete
+                              after delete on entity begin
+                              update entity_total set n = n - 1,
+                                size = size - old.size; end""")
+            if conn.execute('select 1 from entity_total').fetchone() is None:
+                conn.execute("""insert into entity_total select 0, count(*),
+                                  coalesce(sum(size), 0) from entity""")
+            # entities of another knowledge base are stale
+            conn.execute("""create table if not exists entity_kb (
+                              id integer primary key check (id = 0),
+                              kb_key text)""")
+            row: Optional[Tuple[str]] = conn.execute(
+                'select kb_key from entity_kb').fetchone()
+            prev_key: Optional[str] = None if row is None else row[0]
+            if row is None or prev_key != self.kb_key:
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(f'clearing entity cache {self.path} of ' +
+                                f'knowledge base: {prev_key}')
+                conn.execute('delete from entity')
+                conn.execute('insert or replace into entity_kb values (0, ?)',
+                             (self.kb_key,))
+        return conn
+
+    def _count(self, level: str, hit: bool):
+        name: str = f'{level}.{"hits" if hit else "misses"}'
+        self._counts[name] = self._counts.get(name, 0) + 1
+        if self.metrics is not None:
+            self.metrics.cache(f'link.{level}', hit)
+
+    @property
+    def hit_rates(self) -> Dict[str, Optional[float]]:
+        """The hit rates of the ``memory`` and ``disk`` levels, which are
+        ``None`` for unused levels.
+
+        """
+        rates: Dict[str, Optional[float]] = {}
+        level: str
+        for level in ('memory', 'disk'):
+            hits: int = self._counts.get(f'{level}.hits', 0)
+            total: int = hits + self._counts.get(f'{level}.misses', 0)
+            rates[level] = None if total == 0 else hits / total
+        return rates
+
+    def _put_memory(self, cui: str, entity: Optional[Entity], size: int):
+        entries: Dict[str, Tuple[Optional[Entity], int]] = self._entries
+        prev: Tuple[Optional[Entity], int] = entries.pop(cui, None)
+        if prev is not None:
+            self._bytes -= prev[1]
+        entries[cui] = (entity, size)
+        self._bytes += size
+        while len(entries) > self.max_entries or \
+                (self._bytes > self.max_bytes and len(entries) > 1):
+            self._bytes -= entries.popitem(last=False)[1][1]
+
+    def _put_disk(self, rows: Iterable[Tuple[str, bytes]]):
+        conn: sqlite3.Connection = self.conn
+        with conn:
+            conn.executemany(
+                'insert or replace into entity (cui, data, size) ' +
+                'values (?, ?, ?)', map(lambda r: (*r, len(r[1])), rows))
+            n: int
+            size: int
+            n, size = conn.execute(
+                'select n, size from entity_total').fetchone()
+            # evict the oldest entries
+            evict: int = max(0, n - self.disk_max_entries)
+            excess: int = size - self.disk_max_bytes
+            if excess > 0:
+                # read only the sizes of the entries to evict
+                n_excess: int = 0
+                row_size: int
+                for row_size, in conn.execute(
+                        'select size from entity order by id'):
+                    if excess <= 0:
+                        break
+                    excess -= row_size
+                    n_excess += 1
+                evict = max(evict, n_excess)
+            if evict > 0:
+                conn.execute('delete from entity where id in ' +
+                             '(select id from entity order by id limit ?)',
+                             (evict,))
+
+    def get(self, cui: str) -> Optional[Entity]:
+        """Return the entity of ``cui`` (which is ``None`` for CUIs with no
+        entity) or :obj:`MISSING` if not in the cache.
+
+        """
+        entry: Tuple[Optional[Entity], int] = self._entries.get(cui)
+        self._count('memory', entry is not None)
+        if entry is not None:
+            self._entries.move_to_end(cui)
+            return entry[0]
+        if self.path is not None:
+            row: Tuple[bytes] = self.conn.execute(
+                'select data from entity where cui = ?', (cui,)).fetchone()
+            self._count('disk', row is not None)
+            if row is not None:
+                entity: Optional[Entity] = pickle.loads(row[0])
+                self._put_memory(cui, entity, len(row[0]))
+                return entity
+        return self.MISSING
+
+    def put(self, cui: str, entity: Optional[Entity]):
+        """Add the entity (or ``None`` for no entity) of ``cui``."""
+        self.put_all({cui: entity})
+
+    def put_all(self, entities: Dict[str, Optional[Entity]]):
+        """Add the entities (or ``None`` for no entity) keyed by CUI, which
+        are written to the on-disk level in one transaction.
+
+        """
+        rows: List[Tuple[str, bytes]] = []
+        cui: str
+        entity: Optional[Entity]
+        for cui, entity in entities.items():
+            data: bytes = pickle.dumps(entity)
+            self._put_memory(cui, entity, len(data))
+            rows.append((cui, data))
+        if self.path is not None and len(rows) > 0:
+            self._put_disk(rows)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self):
+        """Close the on-disk level database connection."""
+        if self._conn.is_set():
+            self.conn.close()
+            self._conn.clear()
+
+    def clear(self):
+        """Remove all entities from both levels."""
+        self._entries.clear()
+        self._bytes = 0
+        self._counts.clear()
+        self.close()
+        if self.path is not None and self.path.exists():
+            self.path.unlink()
+
+
 @dataclass
 class EntityLinkerResource(object):
     """Provides a way resolve :class:`scispacy.linking_utils.Entity` instances
@@ -66,6 +284,11 @@ class EntityLinkerResource(object):
                                  'linker_name': 'umls'})
     """Parameters given to the scispaCy entity linker."""
 
+    cache: LinkedEntityCache = field(default=None)
+    """The cache of entities returned by :meth:`get_linked_entity`, or
+    ``None`` to create each from the knowledge base.
+
+    """
     cache_global: InitVar[bool] = field(default=True)
     """Whether or not to globally cache resources, which saves load time.
 
@@ -73,6 +296,17 @@ class EntityLinkerResource(object):
     def __post_init__(self, cache_global: bool):
         self._linker = PersistedWork(
             '_linker', self, cache_global=cache_global)
+        if self.cache is not None and self.cache.kb_key is None:
+            self.cache.kb_key = self.kb_key
+
+    @property
+    def kb_key(self) -> str:
+        """Identifies the knowledge base of the linker by the scispaCy version,
+        which determines the knowledge base files, and the linker name.
+
+        """
+        return f"scispacy-{version('scispacy')}-" + \
+            str(self.params.get('linker_name'))
 
     @property
     @persisted('_linker')
@@ -90,15 +324,48 @@ class EntityLinkerResource(object):
         :param cui: the unique concept ID
 
         """
-        linker: EntityLinker = self.linker
-        se: SciSpacyEntity = linker.kb.cui_to_entity.get(cui)
-        if se is not None:
-            return Entity(
-                name=se.canonical_name,
-                cui=se.concept_id,
-                definition=se.definition,
-                aliases=se.aliases,
-                tuis=se.types)
+        return self.get_linked_entities((cui,))[cui]
+
+    def get_linked_entities(self, cuis: Iterable[str]) -> \
+            Dict[str, Optional[Entity]]:
+        """Like :meth:`get_linked_entity` but get the entities of many
+        concepts, each only once, and add those not in the :obj:`cache` to it
+        at once.
+
+        :param cuis: the unique concept IDs
+
+        :return: the entities keyed by CUI, which are ``None`` for concepts
+                 not in the knowledge base
+
+        """
+        cache: LinkedEntityCache = self.cache
+        ents: Dict[str, Optional[Entity]] = dict.fromkeys(cuis)
+        missing: List[str] = list(ents.keys())
+        if cache is not None:
+            missing.clear()
+            cui: str
+            for cui in ents.keys():
+                ent: Optional[Entity] = cache.get(cui)
+                if ent is LinkedEntityCache.MISSING:
+                    missing.append(cui)
+                else:
+                    ents[cui] = ent
+        if len(missing) > 0:
+            cui_to_entity: Dict[str, SciSpacyEntity] = \
+                self.linker.kb.cui_to_entity
+            created: Dict[str, Optional[Entity]] = {}
+            for cui in missing:
+                se: SciSpacyEntity = cui_to_entity.get(cui)
+                created[cui] = None if se is None else Entity(
+                    name=se.canonical_name,
+                    cui=se.concept_id,
+                    definition=se.definition,
+                    aliases=se.aliases,
+                    tuis=se.types)
+            if cache is not None:
+                cache.put_all(created)
+            ents.update(created)
+        return ents
 
 
 @dataclass
@@ -117,9 +384,21 @@ class LinkFeatureTokenDecorator(FeatureTokenDecorator):
     """The formatting of the feature, which uses :meth:`.Entity.asdict` as the
     parameters available to the format.
 
+    """
+    metrics: Metrics = field(default=None)
+    """If set and enabled, records the wall time of decorating tokens and the
+    counts of linked and unlinked tokens.
+
     """
     def decorate(self, token: FeatureToken):
+        with stage_timer(self.metrics, 'link.decorate'):
+            self._decorate(token)
+
+    def _decorate(self, token: FeatureToken):
         e: SciSpacyEntity = self.lib.get_linked_entity(token.cui_)
+        if self.metrics is not None:
+            self.metrics.increment(
+                'link.linked' if e is not None else 'link.unlinked')
         val: str = FeatureToken.NONE
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f'entity: {token.cui_} -> {e} ({id(token)})')
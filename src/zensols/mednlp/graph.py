@@ -0,0 +1,357 @@
+"""A local graph of the relations between UMLS concepts.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Tuple, List, Dict, Set, Iterable, Any, Optional
+from dataclasses import dataclass, field
+import logging
+import os
+import csv
+import json
+import shutil
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from zensols.persist import persisted, PersistedWork
+from . import MedNLPError, UTSClient
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ConceptGraph(object):
+    """A directed graph of the relations between UMLS concepts stored in a
+    compressed sparse row (CSR) format as memory mapped arrays in
+    :obj:`path`, so expansion queries need no network access.  An edge from
+    concept ``a`` to ``b`` labeled with relation ``REL`` means ``b`` is a
+    ``REL`` of ``a`` (i.e. ``CHD`` edges go to children), which is the meaning
+    of the ``CUI1``, ``REL`` and ``CUI2`` columns of the UMLS ``MRREL.RRF``
+    file.  Edges also have the more specific relation attribute (``RELA``),
+    which is empty when not given.
+
+    The graph is built from an ``MRREL.RRF`` file with :meth:`build_mrrel` or
+    filled incrementally with the (cached) responses of a :class:`.UTSClient`
+    with :meth:`add_uts`.  Concepts are stored as a sorted array so they are
+    coded with a binary search.
+
+    """
+    _MRREL_COLUMNS = {0: 'cui1', 3: 'rel', 4: 'cui2', 7: 'rela', 10: 'sab',
+                      14: 'suppress'}
+    """The ``MRREL.RRF`` columns used to create the graph by column index."""
+
+    path: Path = field()
+    """The directory of the graph arrays."""
+
+    chunk_size: int = field(default=1000000)
+    """The number of ``MRREL.RRF`` lines read at a time."""
+
+    def __post_init__(self):
+        self._meta = PersistedWork('_meta', self)
+        self._arrays = PersistedWork('_arrays', self)
+
+    @property
+    @persisted('_meta')
+    def meta(self) -> Dict[str, Any]:
+        """The relation labels and sizes of the graph, which is empty if the
+        graph has not been created.
+
+        """
+        path: Path = self.path / 'meta.json'
+        if not path.is_file():
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    @property
+    @persisted('_arrays')
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The memory mapped sorted ``cuis``, the first edge of each concept
+        (``indptr``) and the target concept (``indices``), relation (``rel``)
+        and relation attribute (``rela``) codes of each edge.
+
+        """
+        if 'n_cuis' not in self.meta:
+            raise MedNLPError(f'No concept graph in {self.path}')
+        return {name: np.load(self.path / f'{name}.npy', mmap_mode='r')
+                for name in 'cuis indptr indices rel rela'.split()}
+
+    @property
+    def edges(self) -> pd.DataFrame:
+        """The edges of the graph as columns ``cui1``, ``cui2``, ``rel`` and
+        ``rela``.
+
+        """
+        cols: Tuple[str, ...] = ('cui1', 'cui2', 'rel', 'rela')
+        if 'n_cuis' not in self.meta:
+            return pd.DataFrame([], columns=cols)
+        meta: Dict[str, Any] = self.meta
+        arrs: Dict[str, np.ndarray] = self.arrays
+        cuis: np.ndarray = arrs['cuis'].astype(str)
+        src: np.ndarray = np.repeat(
+            np.arange(len(cuis)), np.diff(arrs['indptr']))
+        return pd.DataFrame({
+            'cui1': cuis[src],
+            'cui2': cuis[arrs['indices']],
+            'rel': np.array(meta['rels'], dtype=object)[arrs['rel']],
+            'rela': np.array(meta['relas'], dtype=object)[arrs['rela']]},
+            columns=cols)
+
+    def _write_arrays(self, path: Path, edges: pd.DataFrame):
+        edges = edges.drop_duplicates()
+        cuis: np.ndarray = np.unique(np.concatenate(
+            (edges['cui1'].to_numpy(str), edges['cui2'].to_numpy(str))))
+        src: np.ndarray = np.searchsorted(cuis, edges['cui1'].to_numpy(str))
+        dst: np.ndarray = np.searchsorted(cuis, edges['cui2'].to_numpy(str))
+        labels: Dict[str, List[str]] = {}
+        codes: Dict[str, np.ndarray] = {}
+        col: str
+        for col in ('rel', 'rela'):
+            uniq: np.ndarray
+            uniq, codes[col] = np.unique(
+                edges[col].to_numpy(str), return_inverse=True)
+            labels[f'{col}s'] = uniq.tolist()
+        order: np.ndarray = np.lexsort((dst, src))
+        indptr = np.zeros(len(cuis) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(cuis)), out=indptr[1:])
+        np.save(path / 'cuis.npy', cuis.astype(bytes))
+        np.save(path / 'indptr.npy', indptr)
+        np.save(path / 'indices.npy', dst[order].astype(np.int32))
+        for col in ('rel', 'rela'):
+            np.save(path / f'{col}.npy', codes[col][order].astype(np.uint16))
+        with open(path / 'meta.json', 'w') as f:
+            json.dump({'n_cuis': len(cuis), 'n_edges': len(order), **labels},
+                      f)
+
+    def _write(self, edges: pd.DataFrame):
+        """Replace the graph with ``edges``, which are written to a temporary
+        directory that is then moved to :obj:`path` so readers never see
+        partial arrays.
+
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(prefix='.graph-', dir=self.path.parent))
+        try:
+            self._write_arrays(tmp, edges)
+            self.close()
+            if self.path.exists():
+                shutil.rmtree(self.path)
+            os.replace(tmp, self.path)
+        finally:
+            if tmp.exists():
+                shutil.rmtree(tmp)
+        if logger.isEnabledFor(logging.INFO):
+            meta: Dict[str, Any] = self.meta
+            logger.info(f"wrote concept graph with {meta['n_cuis']} " +
+                        f"concepts and {meta['n_edges']} edges to {self.path}")
+
+    def build_mrrel(self, mrrel_path: Path, sabs: Set[str] = None,
+                    rels: Set[str] = None, suppressed: bool = False):
+        """Replace the graph with the relations of a UMLS ``MRREL.RRF`` file.
+
+        :param mrrel_path: the path to the ``MRREL.RRF`` file
+
+        :param sabs: the source vocabularies (i.e. ``SNOMEDCT_US``) of the
+                     relations to add, or ``None`` for all
+
+        :param rels: the relations (i.e. ``PAR``) to add, or ``None`` for all
+
+        :param suppressed: whether to add suppressed relations
+
+        """
+        cols: Dict[int, str] = self._MRREL_COLUMNS
+        chunks: List[pd.DataFrame] = []
+        chunk: pd.DataFrame
+        for chunk in pd.read_csv(
+                mrrel_path, sep='|', header=None, usecols=tuple(cols.keys()),
+                dtype=str, keep_default_na=False, quoting=csv.QUOTE_NONE,
+                chunksize=self.chunk_size):
+            chunk = chunk.rename(columns=cols)
+            keep: pd.Series = chunk['cui1'] != chunk['cui2']
+            if sabs is not None:
+                keep &= chunk['sab'].isin(sabs)
+            if rels is not None:
+                keep &= chunk['rel'].isin(rels)
+            if not suppressed:
+                keep &= chunk['suppress'] == 'N'
+            chunks.append(chunk.loc[keep, ['cui1', 'cui2', 'rel', 'rela']]
+                          .drop_duplicates())
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f'read {sum(map(len, chunks))} relations')
+        if len(chunks) == 0:
+            raise MedNLPError(f'No relations in {mrrel_path}')
+        self._write(pd.concat(chunks, ignore_index=True))
+
+    def add_relations(self, relations: Iterable[Tuple[str, str, str, str]]) \
+            -> int:
+        """Add relations to the graph, which is rewritten with its existing
+        edges.
+
+        :param relations: tuples of ``(<CUI1>, <CUI2>, <REL>, <RELA>)``
+
+        :return: the number of edges added
+
+        """
+        n_edges: int = self.meta.get('n_edges', 0)
+        new: pd.DataFrame = pd.DataFrame(
+            relations, columns=['cui1', 'cui2', 'rel', 'rela'])
+        if len(new) > 0:
+            new['rela'] = new['rela'].fillna('')
+            self._write(pd.concat((self.edges, new), ignore_index=True))
+        return self.meta.get('n_edges', 0) - n_edges
+
+    def add_uts(self, client: UTSClient, cuis: Iterable[str]) -> int:
+        """Add the relations of concepts from UTS.  The responses are cached
+        by ``client`` when it has a request stash, so adding the relations of
+        concepts previously requested needs no network access.
+
+        :param client: the client used to get the relations
+
+        :param cuis: the concepts with the relations to add
+
+        :return: the number of edges added
+
+        """
+        def map_rel(cui: str, rel_cui: str, rel: Dict[str, Any]) -> \
+                Tuple[str, str, str, str]:
+            return (cui, rel_cui, rel.get('relationLabel') or '',
+                    rel.get('additionalRelationLabel') or '')
+
+        relations: List[Tuple[str, str, str, str]] = []
+        cui: str
+        for cui in cuis:
+            relations.extend(map(
+                lambda r: map_rel(cui, *r),
+                client.get_related_cuis(cui, expect=False)))
+        return self.add_relations(relations)
+
+    def get_codes(self, cuis: Iterable[str]) -> np.ndarray:
+        """Return the codes of concepts, which are -1 for those not in the
+        graph.
+
+        """
+        arr: np.ndarray = np.array(tuple(cuis), dtype=bytes)
+        graph_cuis: np.ndarray = self.arrays['cuis']
+        if len(graph_cuis) == 0 or len(arr) == 0:
+            return np.full(len(arr), -1, dtype=np.int64)
+        codes: np.ndarray = np.searchsorted(graph_cuis, arr)
+        codes = np.minimum(codes, len(graph_cuis) - 1)
+        return np.where(graph_cuis[codes] == arr, codes, -1)
+
+    def _get_label_mask(self, col: str, labels: Optional[Iterable[str]]) -> \
+            Optional[np.ndarray]:
+        """Return whether to follow edges by the codes of a relation column,
+        or ``None`` to follow all.
+
+        """
+        if labels is not None:
+            return np.isin(self.meta[f'{col}s'], tuple(labels))
+
+    def _get_edges(self, codes: np.ndarray, rels: Iterable[str],
+                   relas: Iterable[str]) -> np.ndarray:
+        """Return the indexes of the edges from concepts ``codes`` that have
+        any of the relations ``rels`` and ``relas``.
+
+        """
+        arrs: Dict[str, np.ndarray] = self.arrays
+        indptr: np.ndarray = arrs['indptr']
+        starts: np.ndarray = indptr[codes]
+        lens: np.ndarray = indptr[codes + 1] - starts
+        # the edge ranges of all concepts concatenated
+        offsets: np.ndarray = np.cumsum(lens) - lens
+        edges: np.ndarray = np.repeat(starts - offsets, lens) + \
+            np.arange(lens.sum())
+        col: str
+        labels: Iterable[str]
+        for col, labels in (('rel', rels), ('rela', relas)):
+            mask: np.ndarray = self._get_label_mask(col, labels)
+            if mask is not None:
+                edges = edges[mask[arrs[col][edges]]]
+        return edges
+
+    def get_relations(self, cui: str, rels: Iterable[str] = None,
+                      relas: Iterable[str] = None) -> \
+            Tuple[Tuple[str, str, str], ...]:
+        """Return the relations of a concept.
+
+        :param cui: the concept with the relations
+
+        :param rels: the relations (i.e. ``CHD``) to return or ``None`` for
+                     all
+
+        :param relas: the relation attributes (i.e. ``isa``) to return or
+                      ``None`` for all
+
+        :return: tuples of ``(<related CUI>, <REL>, <RELA>)``
+
+        """
+        codes: np.ndarray = self.get_codes((cui,))
+        if codes[0] < 0:
+            return ()
+        meta: Dict[str, Any] = self.meta
+        arrs: Dict[str, np.ndarray] = self.arrays
+        edges: np.ndarray = self._get_edges(codes, rels, relas)
+        return tuple(zip(
+            arrs['cuis'][arrs['indices'][edges]].astype(str).tolist(),
+            map(lambda c: meta['rels'][c], arrs['rel'][edges].tolist()),
+            map(lambda c: meta['relas'][c], arrs['rela'][edges].tolist())))
+
+    def expand(self, cuis: Iterable[str], hops: Optional[int] = 1,
+               rels: Iterable[str] = None, relas: Iterable[str] = None) -> \
+            Dict[str, int]:
+        """Return the concepts reachable from ``cuis`` with a breadth first
+        search, which follows the edges of all concepts of a hop at once.
+
+        :param cuis: the concepts from which to start
+
+        :param hops: the maximum number of edges to follow from ``cuis``, or
+                     ``None`` for no limit
+
+        :param rels: the relations (i.e. ``CHD``) to follow or ``None`` for
+                     all
+
+        :param relas: the relation attributes (i.e. ``isa``) to follow or
+                      ``None`` for all
+
+        :return: the number of hops from ``cuis`` of each reachable concept
+                 (including those of ``cuis`` in the graph at hop 0)
+
+        """
+        if rels is not None:
+            rels = tuple(rels)
+        if relas is not None:
+            relas = tuple(relas)
+        arrs: Dict[str, np.ndarray] = self.arrays
+        indices: np.ndarray = arrs['indices']
+        codes: np.ndarray = self.get_codes(cuis)
+        frontier: np.ndarray = np.unique(codes[codes >= 0])
+        dists = np.full(len(arrs['cuis']), -1, dtype=np.int32)
+        dists[frontier] = 0
+        hop: int = 0
+        while len(frontier) > 0 and (hops is None or hop < hops):
+            hop += 1
+            nexts: np.ndarray = np.unique(
+                indices[self._get_edges(frontier, rels, relas)])
+            frontier = nexts[dists[nexts] < 0]
+            dists[frontier] = hop
+        reached: np.ndarray = np.flatnonzero(dists >= 0)
+        return dict(zip(arrs['cuis'][reached].astype(str).tolist(),
+                        dists[reached].tolist()))
+
+    def __contains__(self, cui: str) -> bool:
+        return 'n_cuis' in self.meta and self.get_codes((cui,))[0] >= 0
+
+    def __len__(self) -> int:
+        return self.meta.get('n_cuis', 0)
+
+    def close(self):
+        """Unmap the arrays so they are reread on the next access."""
+        self._meta.clear()
+        self._arrays.clear()
+
+    def clear(self):
+        """Remove the graph."""
+        self.close()
+        if self.path.is_dir():
+            shutil.rmtree(self.path)
@@ -0,0 +1,280 @@
+"""An on-disk inverted index of the concepts in parsed medical documents.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Tuple, List, Dict, Set, Iterable, Any, Optional
+from dataclasses import dataclass, field
+import logging
+import ast
+import zlib
+import sqlite3
+from pathlib import Path
+import itertools as it
+import numpy as np
+from zensols.persist import persisted, PersistedWork
+from zensols.nlp import FeatureToken, FeatureDocument, FeatureDocumentParser
+from . import MedNLPError, MedCatResource
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ConceptIndex(object):
+    """An on-disk inverted index from concept CUIs, TUIs and semantic group
+    abbreviations (i.e. ``DISO``) to the documents and token locations where
+    they occur.  Documents are added in batches, and each batch appends a
+    compressed block of postings to each term found in it.  The postings of a
+    term hold the delta encoded integer document IDs, the number of occurrences
+    in each document, and the token index and character span of each
+    occurrence, each array ``zlib`` compressed.  Documents are given integer
+    IDs in the order they are added so the postings of all blocks of a term
+    concatenate in to a sorted array.
+
+    Queries are boolean combinations of terms using ``&`` (and), ``|`` (or),
+    ``-`` (and not) and parenthesis, for example::
+
+        index.query('C0020538 & (DISO | T047) - C0011849')
+
+    """
+    _SCHEMA = (
+        """create table if not exists doc (
+             id integer primary key, name text not null unique)""",
+        """create table if not exists posting (
+             term text not null, block integer not null, n_docs integer,
+             docs blob, counts blob, spans blob,
+             primary key (term, block))""")
+    """The SQL to create the database tables."""
+
+    path: Path = field()
+    """The SQLite database file of the index."""
+
+    medcat_resource: MedCatResource = field(default=None)
+    """The resource used to map TUIs to their semantic groups, or ``None`` to
+    not index groups.
+
+    """
+    batch_size: int = field(default=1000)
+    """The number of documents to parse and index per block in
+    :meth:`add_texts`.
+
+    """
+    def __post_init__(self):
+        self._conn = PersistedWork('_conn', self)
+        self._tui_groups = PersistedWork('_tui_groups', self)
+
+    @property
+    @persisted('_conn')
+    def conn(self) -> sqlite3.Connection:
+        """The connection to the index database."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        for sql in self._SCHEMA:
+            conn.execute(sql)
+        return conn
+
+    @property
+    @persisted('_tui_groups')
+    def tui_groups(self) -> Dict[str, Tuple[str, ...]]:
+        """The semantic group abbreviations of each TUI."""
+        res: MedCatResource = self.medcat_resource
+        return {} if res is None else res.tui_groups
+
+    @staticmethod
+    def _compress(arr: np.ndarray) -> bytes:
+        return zlib.compress(arr.tobytes())
+
+    @staticmethod
+    def _decompress(data: bytes, dtype: type) -> np.ndarray:
+        return np.frombuffer(zlib.decompress(data), dtype=dtype)
+
+    def _get_terms(self, tok: FeatureToken) -> Set[str]:
+        """Return the terms indexed by a concept token."""
+        tui_groups: Dict[str, Tuple[str, ...]] = self.tui_groups
+        terms: Set[str] = {tok.cui_}
+        tui: str
+        for tui in tok.tuis:
+            terms.add(tui)
+            terms.update(tui_groups.get(tui, ()))
+        return terms
+
+    def add(self, docs: Iterable[Tuple[str, FeatureDocument]]) -> int:
+        """Append documents to the index as a new block of postings.
+
+        :param docs: tuples of unique document names and documents parsed
+                     with the medical parser
+
+        :return: the number of documents added
+
+        """
+        conn: sqlite3.Connection = self.conn
+        next_id: int = conn.execute(
+            'select coalesce(max(id) + 1, 0) from doc').fetchone()[0]
+        block: int = conn.execute(
+            'select coalesce(max(block) + 1, 0) from posting').fetchone()[0]
+        # term -> list of (doc id, token index, begin, end)
+        postings: Dict[str, List[Tuple[int, int, int, int]]] = {}
+        names: List[Tuple[int, str]] = []
+        name: str
+        doc: FeatureDocument
+        for name, doc in docs:
+            doc_id: int = next_id + len(names)
+            names.append((doc_id, name))
+            tok: FeatureToken
+            for tok in doc.token_iter():
+                if tok.is_concept:
+                    loc = (doc_id, tok.i, tok.lexspan.begin, tok.lexspan.end)
+                    term: str
+                    for term in self._get_terms(tok):
+                        postings.setdefault(term, []).append(loc)
+        rows: List[Tuple[Any, ...]] = []
+        term: str
+        locs: List[Tuple[int, int, int, int]]
+        for term, locs in postings.items():
+            arr = np.array(locs, dtype=np.int64)
+            doc_ids, counts = np.unique(arr[:, 0], return_counts=True)
+            deltas = np.diff(doc_ids, prepend=0).astype(np.uint32)
+            rows.append((term, block, len(doc_ids),
+                         self._compress(deltas),
+                         self._compress(counts.astype(np.uint32)),
+                         self._compress(arr[:, 1:].astype(np.int32))))
+        try:
+            with conn:
+                conn.executemany('insert into doc (id, name) values (?, ?)',
+                                 names)
+                conn.executemany(
+                    'insert into posting values (?, ?, ?, ?, ?, ?)', rows)
+        except sqlite3.IntegrityError as e:
+            raise MedNLPError(f'Could not add documents: {e}') from e
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'added {len(names)} docs with {len(rows)} terms ' +
+                         f'in block {block}')
+        return len(names)
+
+    def add_texts(self, parser: FeatureDocumentParser,
+                  texts: Iterable[Tuple[str, str]]) -> int:
+        """Parse and index documents in batches of :obj:`batch_size`.
+
+        :param parser: the medical parser used to parse the texts
+
+        :param texts: tuples of unique document names and text
+
+        :return: the number of documents added
+
+        """
+        texts = iter(texts)
+        n_docs: int = 0
+        while True:
+            batch: Tuple[Tuple[str, str], ...] = tuple(
+                it.islice(texts, self.batch_size))
+            if len(batch) == 0:
+                break
+            n_docs += self.add(map(lambda t: (t[0], parser.parse(t[1])),
+                                   batch))
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f'indexed {n_docs} documents')
+        return n_docs
+
+    def _get_blocks(self, term: str, cols: str) -> List[Tuple[Any, ...]]:
+        return self.conn.execute(
+            f'select {cols} from posting where term = ? order by block',
+            (term,)).fetchall()
+
+    def postings(self, term: str) -> np.ndarray:
+        """Return the sorted integer IDs of the documents that have ``term``.
+
+        """
+        blocks: List[np.ndarray] = list(map(
+            lambda r: np.cumsum(self._decompress(r[0], np.uint32),
+                                dtype=np.int64),
+            self._get_blocks(term, 'docs')))
+        if len(blocks) == 0:
+            return np.array((), dtype=np.int64)
+        return np.concatenate(blocks)
+
+    def locations(self, term: str) -> Dict[int, np.ndarray]:
+        """Return where ``term`` occurs in each document.
+
+        :return: the document IDs as keys and arrays of rows ``(<token index>,
+                 <character begin>, <character end>)`` as values
+
+        """
+        locs: Dict[int, np.ndarray] = {}
+        docs: bytes
+        counts: bytes
+        spans: bytes
+        for docs, counts, spans in self._get_blocks(
+                term, 'docs, counts, spans'):
+            doc_ids = np.cumsum(self._decompress(docs, np.uint32))
+            cnts = self._decompress(counts, np.uint32)
+            arr = self._decompress(spans, np.int32).reshape(-1, 3)
+            bounds = np.cumsum(cnts)[:-1]
+            doc_id: int
+            doc_locs: np.ndarray
+            for doc_id, doc_locs in zip(doc_ids, np.split(arr, bounds)):
+                locs[int(doc_id)] = doc_locs
+        return locs
+
+    def _eval(self, node: ast.AST, cache: Dict[str, np.ndarray]) -> \
+            np.ndarray:
+        if isinstance(node, ast.Name):
+            arr: Optional[np.ndarray] = cache.get(node.id)
+            if arr is None:
+                arr = self.postings(node.id)
+                cache[node.id] = arr
+            return arr
+        elif isinstance(node, ast.BinOp):
+            left: np.ndarray = self._eval(node.left, cache)
+            right: np.ndarray = self._eval(node.right, cache)
+            if isinstance(node.op, ast.BitAnd):
+                return np.intersect1d(left, right, assume_unique=True)
+            elif isinstance(node.op, ast.BitOr):
+                return np.union1d(left, right)
+            elif isinstance(node.op, ast.Sub):
+                return np.setdiff1d(left, right, assume_unique=True)
+        raise MedNLPError(f'Unsupported query expression: {ast.dump(node)}')
+
+    def query(self, query: str) -> np.ndarray:
+        """Return the sorted integer IDs of the documents that match a boolean
+        query (see class docs).
+
+        """
+        try:
+            node: ast.AST = ast.parse(query.strip(), mode='eval').body
+        except SyntaxError as e:
+            raise MedNLPError(f'Bad query <{query}>: {e}') from e
+        return self._eval(node, {})
+
+    def count(self, query: str) -> int:
+        """Return the number of documents that match ``query``."""
+        return len(self.query(query))
+
+    def get_names(self, doc_ids: Iterable[int]) -> Tuple[str, ...]:
+        """Return the document names of document IDs."""
+        doc_ids = tuple(map(int, doc_ids))
+        id2name: Dict[int, str] = {}
+        for chunk in range(0, len(doc_ids), 500):
+            ids = doc_ids[chunk:chunk + 500]
+            params: str = ','.join('?' * len(ids))
+            id2name.update(self.conn.execute(
+                f'select id, name from doc where id in ({params})', ids))
+        return tuple(map(lambda i: id2name[i], doc_ids))
+
+    def search(self, query: str) -> Tuple[str, ...]:
+        """Return the document names that match ``query``."""
+        return self.get_names(self.query(query))
+
+    def __len__(self) -> int:
+        return self.conn.execute('select count(*) from doc').fetchone()[0]
+
+    def close(self):
+        """Close the database connection."""
+        if self._conn.is_set():
+            self.conn.close()
+            self._conn.clear()
+
+    def clear(self):
+        """Remove all documents from the index."""
+        self.close()
+        if self.path.exists():
+            self.path.unlink()
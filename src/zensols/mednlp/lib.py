@@ -3,11 +3,24 @@
 """
 from __future__ import annotations
 __author__ = 'Paul Landes'
-from typing import Any, List, Dict, Tuple
+from typing import Any, List, Dict, Tuple, Set, Iterable, Optional, FrozenSet
 import logging
 from dataclasses import dataclass, field
+import re
+import collections
+import itertools as it
+import pandas as pd
+from spacy.tokens import Doc, Span
+from spacy.language import Language
+from medcat.cat import CAT
+from medcat.cdb import CDB
+from medcat.meta_cat import MetaCAT
 from zensols.config import ConfigFactory, Dictable
-from . import MedCatResource, UTSClient
+from zensols.nlp import LexicalSpan
+from . import (
+    MedNLPError, MedCatResource, UTSClient, ConceptCodes, ConceptEntity,
+    TextSegmenter
+)
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +43,9 @@ class MedicalLibrary(Dictable):
     uts_client: UTSClient = field(default=None)
     """Queries UMLS data."""
 
+    concept_graph: 'ConceptGraph' = field(default=None)
+    """The concept relation graph used by :meth:`expand_concepts`."""
+
     def get_entities(self, text: str) -> Dict[str, Any]:
         """Return the all concept entity data.
 
@@ -41,14 +57,206 @@ class MedicalLibrary(Dictable):
             logger.debug(f'entity {text} -> {ent}')
         return ent
 
+    def _get_out_entity(self, ent: Dict[str, Any], offset: int) -> \
+            ConceptEntity:
+        """Return a record from an entity of ``CAT.get_entities``."""
+        status: Dict[str, Any] = ent.get('meta_anns', {}).get('Status', {})
+        return ConceptEntity(
+            begin=ent['start'] + offset,
+            end=ent['end'] + offset,
+            cui=ent['cui'],
+            pref_name=ent['pretty_name'],
+            tuis=tuple(sorted(ent['type_ids'])),
+            similarity=ent['context_similarity']
+            if self.medcat_resource.disambiguate else -1,
+            status=status.get('value'))
+
+    def get_entities_multi(self, texts: Iterable[str], batch_size: int = 100,
+                           n_workers: int = None, max_length: int = None) \
+            -> Iterable[Tuple[ConceptEntity, ...]]:
+        """Like :meth:`get_entities` but link the concepts of many texts using
+        MedCAT's multi-document processing.  Texts are read in windows of
+        ``batch_size * n_workers`` texts so only a window of texts and their
+        results are in memory at a time, and results of each window are
+        generated before the next is read.  Texts longer than ``max_length``
+        are split in to sentence aligned chunks that are processed separately,
+        and the offsets of their concepts are those of the text.
+
+        :param texts: the texts with concepts to link
+
+        :param batch_size: the number of texts processed by a worker at a time
+
+        :param n_workers: the number of processes, or ``None`` to process in
+                          this process
+
+        :param max_length: the maximum length of a chunk of text, which
+                           defaults to the MedCAT ``max_document_length`` so
+                           long texts are not trimmed
+
+        :return: the concepts of each text in the order of ``texts`` sorted by
+                 location
+
+        """
+        cat: CAT = self.medcat_resource.cat
+        if max_length is None:
+            max_length = cat.config.preprocessing['max_document_length']
+        segmenter = TextSegmenter(max_length=max_length)
+        n_process: Optional[int] = None \
+            if n_workers is None or n_workers < 2 else n_workers
+        window: int = batch_size * (1 if n_process is None else n_process)
+        texts = iter(texts)
+        while True:
+            batch: Tuple[str, ...] = tuple(it.islice(texts, window))
+            if len(batch) == 0:
+                break
+            pieces: List[str] = []
+            # the document index and offset of each piece
+            owners: List[Tuple[int, int]] = []
+            i: int
+            text: str
+            for i, text in enumerate(batch):
+                spans: Iterable[LexicalSpan] = (LexicalSpan(0, len(text)),) \
+                    if len(text) <= max_length else segmenter(text)
+                span: LexicalSpan
+                for span in spans:
+                    pieces.append(text[span.begin:span.end])
+                    owners.append((i, span.begin))
+            outs: List[Dict[str, Any]] = cat.get_entities_multi_texts(
+                pieces, addl_info=[], n_process=n_process,
+                batch_size=batch_size)
+            ents: List[List[ConceptEntity]] = list(map(lambda _: [], batch))
+            offset: int
+            out: Dict[str, Any]
+            for (i, offset), out in zip(owners, outs):
+                ents[i].extend(map(lambda e: self._get_out_entity(e, offset),
+                                   (out or {}).get('entities', {}).values()))
+            yield from map(lambda es: tuple(sorted(
+                es, key=lambda e: (e.begin, e.end))), ents)
+
+    def _get_entity_records(self, doc: Doc,
+                            info: Dict[str, Tuple[str, Tuple[str, ...]]],
+                            status: bool) -> Tuple[ConceptEntity, ...]:
+        """Return the records of the concepts of ``doc``.
+
+        :param info: a cache of preferred names and TUIs by CUI
+
+        """
+        res: MedCatResource = self.medcat_resource
+        disambiguate: bool = res.disambiguate
+        ents: List[ConceptEntity] = []
+        ent: Span
+        for ent in doc.ents:
+            cui: str = ent._.cui
+            cui_info: Tuple[str, Tuple[str, ...]] = info.get(cui)
+            if cui_info is None:
+                codes: ConceptCodes = res.concept_codes
+                pref_name: str = res.cat.cdb.cui2preferred_name.get(cui)
+                cui_info = (pref_name or '', codes.get_tuis(
+                    codes.get_tui_bits(codes.get_cui_code(cui))))
+                info[cui] = cui_info
+            stat: Optional[str] = None
+            if status:
+                anns: Dict[str, Dict[str, Any]] = getattr(
+                    ent._, 'meta_anns', None) or {}
+                stat = anns.get('Status', {}).get('value')
+            ents.append(ConceptEntity(
+                begin=ent.start_char,
+                end=ent.end_char,
+                cui=cui,
+                pref_name=cui_info[0],
+                tuis=cui_info[1],
+                similarity=ent._.context_similarity if disambiguate else -1,
+                status=stat))
+        return tuple(ents)
+
+    def extract_entities(self, texts: Iterable[str], batch_size: int = 32,
+                         filter_profile: str = None, status: bool = False) \
+            -> Iterable[Tuple[ConceptEntity, ...]]:
+        """Return the linked concepts of texts without creating feature
+        documents.  The texts are run through the MedCAT spaCy pipeline in
+        batches using only the components needed to link concepts, and the
+        entities of each spaCy document are made in to compact records.  This
+        is much faster than parsing when only the concepts are needed.
+
+        :param texts: the texts with concepts to extract
+
+        :param batch_size: the number of texts run through the pipeline at a
+                           time
+
+        :param filter_profile: the name of a
+                               :obj:`.MedCatResource.filter_profiles` used to
+                               filter the concepts, or ``None`` to keep all
+
+        :param status: whether to add the MetaCAT status, which runs the
+                       MetaCAT models on the kept concepts
+
+        :return: the concepts of each text in the order of ``texts``
+
+        """
+        res: MedCatResource = self.medcat_resource
+        cat: CAT = res.cat
+        nlp: Language = cat.pipe.spacy_nlp
+        max_len: int = cat.config.preprocessing['max_document_length']
+        cuis: Optional[FrozenSet[str]] = None if filter_profile is None \
+            else res.get_profile_cuis(filter_profile)
+        meta_cats: Tuple[Tuple[str, MetaCAT], ...] = tuple(filter(
+            lambda t: isinstance(t[1], MetaCAT), nlp.pipeline))
+        # sentence boundaries are not used to link concepts
+        disable: Set[str] = set(filter(
+            nlp.has_pipe, 'parser senter sentencizer'.split()))
+        disable.update(map(lambda t: t[0], meta_cats))
+        info: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+        texts = iter(texts)
+        while True:
+            batch: Tuple[str, ...] = tuple(map(
+                lambda t: t[:max_len], it.islice(texts, batch_size)))
+            if len(batch) == 0:
+                break
+            docs: List[Doc] = list(nlp.pipe(
+                batch, batch_size=batch_size, disable=disable))
+            if cuis is not None:
+                doc: Doc
+                for doc in docs:
+                    doc.ents = tuple(filter(lambda e: e._.cui in cuis,
+                                            doc.ents))
+            if status:
+                ent_docs = tuple(filter(lambda d: len(d.ents) > 0, docs))
+                meta_cat: MetaCAT
+                for _, meta_cat in meta_cats:
+                    if len(ent_docs) > 0:
+                        collections.deque(
+                            meta_cat.pipe(iter(ent_docs)), maxlen=0)
+            yield from map(lambda d: self._get_entity_records(
+                d, info, status), docs)
+
+    def extract_entity_dataframe(self, texts: Iterable[str],
+                                 *args, **kwargs) -> pd.DataFrame:
+        """Like :meth:`extract_entities` but return a dataframe with a row for
+        each concept and the (zero based) position of its text in the ``doc``
+        column.
+
+        """
+        cols: Tuple[str, ...] = ('doc', 'begin', 'end', 'cui', 'pref_name',
+                                 'tuis', 'similarity', 'status')
+        rows: List[Tuple[Any, ...]] = []
+        docs: Iterable[Tuple[ConceptEntity, ...]] = \
+            self.extract_entities(texts, *args, **kwargs)
+        i: int
+        ents: Tuple[ConceptEntity, ...]
+        for i, ents in enumerate(docs):
+            ent: ConceptEntity
+            for ent in ents:
+                rows.append((i, ent.begin, ent.end, ent.cui, ent.pref_name,
+                             ','.join(ent.tuis), ent.similarity, ent.status))
+        return pd.DataFrame(rows, columns=cols)
+
     def get_linked_entity(self, cui: str) -> 'Entity':
         """Get a scispaCy linked entity.
 
         :param cui: the unique concept ID
 
         """
-        from .entlink import Entity
-        ent: Entity = None
+        ent: 'Entity' = None
         if self.entity_linker_resource is not None:
             ent = self.entity_linker_resource.get_linked_entity(cui)
         if logger.isEnabledFor(logging.DEBUG):
@@ -84,6 +292,32 @@ class MedicalLibrary(Dictable):
             logger.debug(f'relation {cui} -> {rel}')
         return rel
 
+    def expand_concepts(self, cuis: Iterable[str], hops: Optional[int] = 1,
+                        rels: Iterable[str] = None,
+                        relas: Iterable[str] = None) -> Dict[str, int]:
+        """Return the concepts related to ``cuis`` in :obj:`concept_graph`
+        without network access.
+
+        :param cuis: the concepts from which to start
+
+        :param hops: the maximum number of relations to follow from ``cuis``,
+                     or ``None`` for no limit
+
+        :param rels: the relations (i.e. ``CHD``) to follow or ``None`` for
+                     all
+
+        :param relas: the relation attributes (i.e. ``isa``) to follow or
+                      ``None`` for all
+
+        :return: the number of hops from ``cuis`` of each related concept
+
+        :see: :meth:`.ConceptGraph.expand`
+
+        """
+        if self.concept_graph is None:
+            raise MedNLPError('No concept graph configured')
+        return self.concept_graph.expand(cuis, hops, rels, relas)
+
     def get_new_ctakes_parser_stash(self) -> 'CTakesParserStash':
         """Return a new instance of a ctakes parser stash.
 
@@ -97,6 +331,99 @@ class MedicalLibrary(Dictable):
         """
         return self.config_factory('cui2vec_500_embedding')
 
+    def _get_term_cui(self, term: str, embedding: 'Cui2VecEmbedModel') -> \
+            Optional[str]:
+        """Return the concept of a term that is in the cui2vec embedding using
+        the names of the MedCAT CDB, or UTS if the CDB has no such concept.
+        Concepts whose preferred name is the term are preferred, then those
+        most often seen in the CDB training.
+
+        """
+        if self.medcat_resource is not None:
+            cdb: CDB = self.medcat_resource.cat.cdb
+            sep: str = cdb.config.general['separator']
+            lc_term: str = term.lower()
+            # CDB names are lower case spaCy tokens with and without
+            # punctuation
+            names: Tuple[str, ...] = tuple(map(
+                lambda p: sep.join(re.findall(p, lc_term)),
+                (r'\w+|[^\w\s]', r'\w+')))
+            cuis: Set[str] = set(it.chain.from_iterable(
+                map(lambda n: cdb.name2cuis.get(n, ()), names)))
+            cuis = set(filter(lambda c: c in embedding, cuis))
+            if len(cuis) > 0:
+                return max(sorted(cuis), key=lambda c: (
+                    (cdb.cui2preferred_name.get(c) or '').lower() == lc_term,
+                    cdb.cui2count_train.get(c, 0)))
+        if self.uts_client is not None:
+            res: Dict[str, str]
+            for res in self.uts_client.search_term(term):
+                if res['ui'] in embedding:
+                    return res['ui']
+
+    def similarity_by_terms(self, terms: Iterable[str], topn: int = 5) -> \
+            Dict[str, List['EntitySimilarity']]:
+        """Return similaries of many medical terms.  Terms are resolved to
+        concepts with the MedCAT CDB (UTS is used only for terms it does not
+        have), the similar concepts of all terms are found with batched matrix
+        operations over the cui2vec embedding and their entities are linked in
+        one bulk lookup.
+
+        :param terms: the medical terms (i.e. ``heart disease``)
+
+        :param topn: the top N count similarities to return for each term
+
+        :return: the similarities of each term in descending order, which are
+                 empty for terms with no concept in the embedding
+
+        """
+        from .entlink import Entity, EntitySimilarity
+        from .cui2vec import Cui2VecEmbedModel
+        embedding: Cui2VecEmbedModel = self.cui2vec_embedding
+        term_cuis: Dict[str, Optional[str]] = {
+            t: self._get_term_cui(t, embedding) for t in terms}
+        cuis: Tuple[str, ...] = tuple(
+            filter(lambda c: c is not None, set(term_cuis.values())))
+        cui_sims: Dict[str, Tuple[Tuple[str, float], ...]] = dict(
+            zip(cuis, embedding.most_similar(cuis, topn)))
+        ents: Dict[str, Optional[Entity]] = {}
+        if self.entity_linker_resource is not None:
+            ents = self.entity_linker_resource.get_linked_entities(
+                it.chain.from_iterable(map(
+                    lambda s: map(lambda t: t[0], s), cui_sims.values())))
+        cdb: CDB = None
+        if self.medcat_resource is not None:
+            cdb = self.medcat_resource.cat.cdb
+
+        def create_sim(rel_cui: str, sim: float) -> EntitySimilarity:
+            ent: Entity = ents.get(rel_cui)
+            if ent is None:
+                # fall back to the MedCAT names of unlinked concepts
+                ent = Entity(
+                    name=rel_cui if cdb is None else
+                    cdb.cui2preferred_name.get(rel_cui, rel_cui),
+                    cui=rel_cui,
+                    definition=None,
+                    aliases=(),
+                    tuis=() if cdb is None else
+                    tuple(sorted(cdb.cui2type_ids.get(rel_cui, ()))))
+            return EntitySimilarity(
+                name=ent.name,
+                cui=ent.cui,
+                definition=ent.definition,
+                aliases=ent.aliases,
+                tuis=ent.tuis,
+                similiarty=sim)
+
+        sims: Dict[str, List[EntitySimilarity]] = {}
+        term: str
+        cui: Optional[str]
+        for term, cui in term_cuis.items():
+            sims[term] = list(it.starmap(create_sim, cui_sims.get(cui, ())))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'similarities of {len(sims)} terms')
+        return sims
+
     def similarity_by_term(self, term: str, topn: int = 5) -> \
             List['EntitySimilarity']:
         """Return similaries of a medical term.
@@ -105,20 +432,7 @@ class MedicalLibrary(Dictable):
 
         :param topn: the top N count similarities to return
 
+        :see: :meth:`similarity_by_terms`
+
         """
-        from .entlink import Entity, EntitySimilarity
-        from .cui2vec import Cui2VecEmbedModel
-        from gensim.models.keyedvectors import KeyedVectors
-        embedding: Cui2VecEmbedModel = self.cui2vec_embedding
-        kv: KeyedVectors = embedding.keyed_vectors
-        res: List[Dict[str, str]] = self.uts_client.search_term(term)
-        cui: str = res[0]['ui']
-        sims_by_word: List[Tuple[str, float]] = kv.similar_by_word(cui, topn)
-        sims: List[EntitySimilarity] = []
-        for rel_cui, proba in sims_by_word:
-            entity: Entity = self.get_linked_entity(rel_cui)
-            # name: str = entity.canonical_name.lower()
-            # defn: str = entity.definition
-            sim: float = embedding.keyed_vectors.similarity(cui, rel_cui)
-            sims.append(EntitySimilarity(entity.sci_spacy_entity, sim))
-        return sims
+        return self.similarity_by_terms((term,), topn)[term]
@@ -0,0 +1,562 @@
+"""A compiled dictionary concept matcher built from the MedCAT concept
+database.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Tuple, List, Dict, Set, Iterable, Any, Optional
+from dataclasses import dataclass, field
+import logging
+import re
+import json
+import hashlib
+from pathlib import Path
+import numpy as np
+from spacy.tokens import Doc, Span
+from spacy.language import Language
+from medcat.cdb import CDB
+from zensols.persist import persisted, PersistedWork
+from zensols.nlp import LexicalSpan
+from . import MedNLPError, MedCatResource
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ConceptMatch(object):
+    """A match of a concept name in text by :class:`.ConceptMatcher`.
+
+    """
+    lexspan: LexicalSpan = field()
+    """The character offsets of the matched name in the text."""
+
+    cuis: Tuple[str, ...] = field()
+    """The CUIs of the matched name."""
+
+
+class _Automaton(object):
+    """An Aho-Corasick automaton over word codes stored in a double-array trie.
+    The transition from state ``s`` on word ``c`` is to ``base[s] + c`` when
+    ``check[base[s] + c] == s``.  Each state has its failure state, the number
+    of words to the state from the root (``depth``), the next state on the
+    failure chain with output (``link``) and the range of its CUI codes in
+    ``cuis`` given by ``out_start``.
+
+    """
+    _ARRAYS = 'hashes base check fail link depth out_start out_cuis'.split()
+    """The names of the arrays saved in the cache directory."""
+
+    ROOT = 0
+    """The state of the root."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], cuis: np.ndarray):
+        self.__dict__.update(arrays)
+        self.cuis = cuis
+        self._cui_cache: Dict[int, Tuple[str, ...]] = {}
+
+    @classmethod
+    def load(cls, path: Path) -> '_Automaton':
+        arrays: Dict[str, np.ndarray] = {}
+        name: str
+        for name in cls._ARRAYS:
+            # memory map and use as an ndarray for fast scalar access
+            arrays[name] = np.asarray(
+                np.load(path / f'{name}.npy', mmap_mode='r'))
+        return cls(arrays, np.load(path / 'cuis.npy', mmap_mode='r'))
+
+    def save(self, path: Path):
+        name: str
+        for name in self._ARRAYS + ['cuis']:
+            np.save(path / f'{name}.npy', getattr(self, name))
+
+    def get_cuis(self, state: int) -> Tuple[str, ...]:
+        """Return the CUIs of the names that end at ``state``."""
+        cuis: Tuple[str, ...] = self._cui_cache.get(state)
+        if cuis is None:
+            codes: np.ndarray = self.out_cuis[
+                self.out_start[state]:self.out_start[state + 1]]
+            cuis = tuple(map(lambda c: c.decode(),
+                             self.cuis[codes].tolist()))
+            self._cui_cache[state] = cuis
+        return cuis
+
+    def scan(self, codes: Iterable[int]) -> Iterable[Tuple[int, int, int]]:
+        """Scan word codes, where -1 is a word not in any name.
+
+        :return: tuples of ``(<first word index>, <last word index>, <state>)``
+                 for each matched name
+
+        """
+        base: List[int] = self.base
+        check: List[int] = self.check
+        fail: List[int] = self.fail
+        link: List[int] = self.link
+        depth: List[int] = self.depth
+        out_start: List[int] = self.out_start
+        size: int = len(check)
+        root: int = self.ROOT
+        s: int = root
+        j: int
+        c: int
+        for j, c in enumerate(codes):
+            if c < 0:
+                s = root
+                continue
+            while True:
+                t: int = base[s] + c
+                if t < size and check[t] == s:
+                    s = t
+                    break
+                if s == root:
+                    break
+                s = fail[s]
+            u: int = s if out_start[s] < out_start[s + 1] else link[s]
+            while u != root:
+                yield (j - depth[u] + 1, j, u)
+                u = link[u]
+
+
+@dataclass
+class ConceptMatcher(object):
+    """A dictionary concept matcher that finds the concept names of the
+    MedCAT concept database (CDB) in text without parsing or linking.  The
+    normalized names of the CDB, restricted to the concepts of the
+    :obj:`.MedCatResource.filter_tuis` and
+    :obj:`~.MedCatResource.filter_groups` filters, are compiled in to an
+    Aho-Corasick automaton over words.  Text is scanned in time linear in its
+    number of words, and matches include overlapping and nested names.
+
+    The automaton is stored in a double-array trie as arrays that are memory
+    mapped from :obj:`path`, so loading is near instant and the pages are
+    shared across processes.  It is built once from the CDB, and rebuilt when
+    the CDB file or filters change.  Only building the automaton loads the
+    MedCAT models.
+
+    Uses include a pre-filter that keeps texts with candidate concepts before
+    they are parsed (:meth:`filter_texts`) and a spaCy component that adds the
+    matches as spans (:meth:`add_pipe`).
+
+    """
+    _VERSION = 2
+    """The version of the automaton, which is incremented to rebuild caches
+    created by previous versions.
+
+    """
+    _WORD = re.compile(r'[^\W_]+')
+    """The pattern of the words of names and text."""
+
+    _MAX_LIST_CHILDREN = 8
+    """The number of children of a state above which its base is found by a
+    vectorized search (see :meth:`_place_wide`) rather than from the list of
+    free slots.
+
+    """
+    _MAX_PLACE_FAILS = 16
+    """The number of states that do not fit at a free slot of the double array
+    before the slot is no longer tried.
+
+    """
+
+
+    medcat_resource: MedCatResource = field()
+    """The resource that has the concept database."""
+
+    path: Path = field()
+    """The directory of the compiled automaton."""
+
+    min_name_length: int = field(default=3)
+    """The minimum number of characters of a name to match, which is the same
+    as the MedCAT ``ner.min_name_len`` default.
+
+    """
+    span_key: str = field(default='concept_matches')
+    """The key in the spaCy ``Doc.spans`` of the matched spans added by the
+    component, each labeled with the first CUI of its name.
+
+    """
+    def __post_init__(self):
+        self._automaton = PersistedWork('_automaton', self)
+
+    @staticmethod
+    def _hash(word: str) -> int:
+        """Return the stable 64 bit hash of a word."""
+        return int.from_bytes(hashlib.blake2b(
+            word.encode(), digest_size=8).digest(), 'little')
+
+    def _words(self, text: str) -> List[str]:
+        return self._WORD.findall(text.lower())
+
+    def _get_key(self) -> str:
+        """Return the key of the CDB file and filters used to create the
+        automaton.
+
+        """
+        res: MedCatResource = self.medcat_resource
+        cdb_path: Path = res.installer[res.cdb_resource]
+        stat = cdb_path.stat() if cdb_path.exists() else None
+        profiles: Dict[str, Dict[str, Set[str]]] = res.filter_profiles or {}
+        key: Tuple[Any, ...] = (
+            self._VERSION, str(cdb_path),
+            None if stat is None else (stat.st_size, stat.st_mtime_ns),
+            sorted(res.filter_tuis or ()), sorted(res.filter_groups or ()),
+            sorted(map(lambda p: (p[0], sorted(p[1].get('tuis') or ()),
+                                  sorted(p[1].get('groups') or ())),
+                       profiles.items())),
+            self.min_name_length)
+        return hashlib.blake2b(repr(key).encode()).hexdigest()
+
+    def _get_names(self, cdb: CDB) -> Dict[Tuple[str, ...], Set[str]]:
+        """Return the CUIs of each name of the CDB as a tuple of words."""
+        filter_cuis: Set[str] = cdb.config.linking['filters']['cuis']
+        names: Dict[Tuple[str, ...], Set[str]] = {}
+        name: str
+        cuis: Iterable[str]
+        for name, cuis in cdb.name2cuis.items():
+            if len(filter_cuis) > 0:
+                cuis = filter_cuis.intersection(cuis)
+            words: Tuple[str, ...] = tuple(
+                self._words(name.replace('~', ' ')))
+            if len(cuis) > 0 and len(words) > 0 and \
+               sum(map(len, words)) >= self.min_name_length:
+                names.setdefault(words, set()).update(cuis)
+        return names
+
+    @staticmethod
+    def _place_wide(check: np.ndarray, size: int, first: int,
+                    rest: List[int], start: int, window: int = 4096) -> int:
+        """Return the base of a state with many children, which are the labels
+        ``first`` and ``rest``, by a vectorized search of windows of the slots
+        from ``start``.  Searching from the slot of the last such state skips
+        the densely used slots before it, where these states seldom fit.
+
+        """
+        rest_arr = np.array(rest, dtype=np.int64)
+        # check a sample of the children first, which finds most that do not
+        # fit in one pass over the window
+        sample = np.array(rest[::len(rest) // 4], dtype=np.int64)
+        lo: int = max(start, first + 1)
+        while lo < size:
+            hi: int = min(lo + window, size)
+            ps: np.ndarray = lo + np.flatnonzero(check[lo:hi] < 0)
+            ok = np.ones(len(ps), dtype=bool)
+            c: int
+            for c in sample.tolist():
+                ok &= check[ps - first + c] < 0
+            p: int
+            for p in ps[ok].tolist():
+                if not (check[p - first + rest_arr] >= 0).any():
+                    return p - first
+            lo = hi
+        # all slots after the last are free
+        return lo - first
+
+    def _place(self, children: List[Dict[int, int]]) -> \
+            Tuple[List[int], List[int], List[int]]:
+        """Place the states of the trie ``children`` breadth first in a double
+        array.  The free slots are kept in a doubly linked list, and the base
+        of each state is found by trying the free slots in order for its first
+        child label, or after the last slot if none fit.  A free slot is no
+        longer tried after :obj:`_MAX_PLACE_FAILS` states do not fit, so each
+        slot is tried a bounded number of times and the time to place all
+        states is linear in the number of slots.
+
+        :return: the ``base`` and ``check`` arrays indexed by slot, and the
+                 slot of each state
+
+        """
+        # the largest label, so slots up to the last plus the width are always
+        # in the check array and need no bounds check
+        width: int = 1 + max(map(lambda ch: max(ch, default=0), children))
+        check = np.full(2 * width + 1, -1, dtype=np.int64)
+        check[0] = 0
+        base: List[int] = [0]
+        # the doubly linked list of free slots
+        nxt: List[int] = [-1]
+        prv: List[int] = [-1]
+        # the number of times each free slot did not fit a state
+        fails: List[int] = [0]
+        head: int = -1
+        tail: int = -1
+
+        def grow(size: int):
+            nonlocal check, head, tail
+            n: int = len(base)
+            if size <= n:
+                return
+            if size + width > len(check):
+                check = np.concatenate((check, np.full(
+                    size + width, -1, dtype=np.int64)))
+            base.extend([0] * (size - n))
+            fails.extend([0] * (size - n))
+            nxt.extend(range(n + 1, size + 1))
+            nxt[-1] = -1
+            prv.extend(range(n - 1, size - 1))
+            prv[n] = tail
+            if tail < 0:
+                head = n
+            else:
+                nxt[tail] = n
+            tail = size - 1
+
+        def use(i: int):
+            nonlocal head, tail
+            p: int = prv[i]
+            n: int = nxt[i]
+            if p < 0:
+                head = n
+            else:
+                nxt[p] = n
+            if n < 0:
+                tail = p
+            else:
+                prv[n] = p
+
+        max_fails: int = self._MAX_PLACE_FAILS
+        # where to start the search of the states with many children
+        wide_from: int = 0
+        slots: List[int] = [0] * len(children)
+        queue: List[int] = [0]
+        s: int
+        for s in queue:
+            if len(children[s]) == 0:
+                continue
+            labels: List[int] = sorted(children[s].keys())
+            first: int = labels[0]
+            rest: List[int] = labels[1:]
+            b: int = -1
+            if len(rest) > self._MAX_LIST_CHILDREN:
+                b = self._place_wide(check, len(base), first, rest, wide_from)
+                wide_from = b + first
+            else:
+                p: int = head
+                while p >= 0:
+                    b = p - first
+                    if b >= 1 and all(map(lambda c: check[b + c] < 0, rest)):
+                        break
+                    b = -1
+                    q: int = nxt[p]
+                    fails[p] += 1
+                    if fails[p] == max_fails:
+                        # stop trying the slot, which can still be used by
+                        # the other children of a state
+                        use(p)
+                    p = q
+                if b < 0:
+                    # all slots after the last are free
+                    b = max(len(base) - first, 1)
+            grow(b + labels[-1] + 1)
+            slot: int = slots[s]
+            base[slot] = b
+            c: int
+            for c in labels:
+                if fails[b + c] < max_fails:
+                    use(b + c)
+                t: int = children[s][c]
+                slots[t] = b + c
+                queue.append(t)
+            check[b + np.array(labels, dtype=np.int64)] = slot
+        return base, check[:len(base)].tolist(), slots
+
+    def _compile(self, names: Dict[Tuple[str, ...], Set[str]]) -> \
+            _Automaton:
+        """Compile names to their CUIs in to a double-array automaton."""
+        # word codes are ranks of their hashes so text is coded with a search
+        word_hashes: Dict[str, int] = {}
+        for words in names.keys():
+            for word in words:
+                if word not in word_hashes:
+                    word_hashes[word] = self._hash(word)
+        hashes = np.array(sorted(word_hashes.values()), dtype=np.uint64)
+        if len(np.unique(hashes)) != len(hashes):
+            raise MedNLPError('Word hash collision in concept names')
+        word2code: Dict[str, int] = dict(zip(
+            word_hashes.keys(),
+            np.searchsorted(hashes, np.array(
+                tuple(word_hashes.values()), dtype=np.uint64)).tolist()))
+        cuis: Tuple[str, ...] = tuple(sorted(set().union(*names.values())))
+        cui2code: Dict[str, int] = dict(map(reversed, enumerate(cuis)))
+        # build the trie with states as children by word code
+        children: List[Dict[int, int]] = [{}]
+        outs: Dict[int, List[int]] = {}
+        depths: List[int] = [0]
+        for words, name_cuis in names.items():
+            s: int = 0
+            for word in words:
+                c: int = word2code[word]
+                t: Optional[int] = children[s].get(c)
+                if t is None:
+                    t = len(children)
+                    children.append({})
+                    depths.append(depths[s] + 1)
+                    children[s][c] = t
+                s = t
+            outs[s] = sorted(map(cui2code.get, name_cuis))
+        # place states breadth first in the double array
+        base, check, slots = self._place(children)
+        size: int = len(check)
+        # failure and output links in slot space by breadth first order
+        queue: List[int] = sorted(range(len(children)), key=depths.__getitem__)
+        fail: List[int] = [0] * size
+        link: List[int] = [0] * size
+        depth: List[int] = [0] * size
+        out_counts = np.zeros(size + 1, dtype=np.int64)
+        out_slots: Dict[int, List[int]] = {
+            slots[s]: codes for s, codes in outs.items()}
+        for s in queue:
+            slot: int = slots[s]
+            depth[slot] = depths[s]
+            out_counts[slot + 1] = len(out_slots.get(slot, ()))
+            for c, t in children[s].items():
+                fslot: int = 0
+                if s != 0:
+                    # follow failure links to the longest proper suffix
+                    f: int = fail[slot]
+                    while True:
+                        ft: int = base[f] + c
+                        if ft < size and check[ft] == f:
+                            fslot = ft
+                            break
+                        if f == 0:
+                            break
+                        f = fail[f]
+                tslot: int = slots[t]
+                fail[tslot] = fslot
+                link[tslot] = fslot if fslot in out_slots else link[fslot]
+        out_start = np.cumsum(out_counts)
+        out_cuis = np.zeros(out_start[-1], dtype=np.int32)
+        for slot, codes in out_slots.items():
+            out_cuis[out_start[slot]:out_start[slot + 1]] = codes
+        arrs: Dict[str, np.ndarray] = dict(map(
+            lambda t: (t[0], np.array(t[1], dtype=np.int32)),
+            (('base', base), ('check', check), ('fail', fail),
+             ('link', link), ('depth', depth))))
+        return _Automaton(
+            {'hashes': hashes, 'out_start': out_start, 'out_cuis': out_cuis,
+             **arrs},
+            np.array(tuple(map(str.encode, cuis)), dtype=bytes))
+
+    def _build(self) -> _Automaton:
+        """Compile the names of the CDB and save the automaton."""
+        cdb: CDB = self.medcat_resource.cat.cdb
+        names: Dict[Tuple[str, ...], Set[str]] = self._get_names(cdb)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'compiling {len(names)} concept names...')
+        auto: _Automaton = self._compile(names)
+        self.path.mkdir(parents=True, exist_ok=True)
+        auto.save(self.path)
+        with open(self.path / 'meta.json', 'w') as f:
+            json.dump({'key': self._get_key(), 'names': len(names),
+                       'states': len(auto.check)}, f)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'wrote concept matcher to {self.path}')
+        return auto
+
+    @property
+    @persisted('_automaton')
+    def automaton(self) -> _Automaton:
+        """The automaton, which is loaded from :obj:`path`, or built and saved
+        if it does not exist or is out of date.
+
+        """
+        meta_path: Path = self.path / 'meta.json'
+        if meta_path.is_file():
+            with open(meta_path) as f:
+                meta: Dict[str, Any] = json.load(f)
+            if meta['key'] == self._get_key():
+                return _Automaton.load(self.path)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info('concept matcher is out of date, rebuilding')
+        return self._build()
+
+    def _scan(self, text: str) -> Iterable[Tuple[int, int, int]]:
+        """Scan ``text`` for names.
+
+        :return: tuples of ``(<begin>, <end>, <state>)``
+
+        """
+        auto: _Automaton = self.automaton
+        hashes: np.ndarray = auto.hashes
+        matches: List[re.Match] = list(self._WORD.finditer(text.lower()))
+        if len(matches) == 0 or len(hashes) == 0:
+            return
+        word_hashes = np.array(tuple(map(
+            lambda m: self._hash(m.group()), matches)), dtype=np.uint64)
+        codes: np.ndarray = np.minimum(
+            np.searchsorted(hashes, word_hashes), len(hashes) - 1)
+        codes = np.where(hashes[codes] == word_hashes, codes, -1)
+        first: int
+        last: int
+        state: int
+        for first, last, state in auto.scan(codes.tolist()):
+            yield (matches[first].start(), matches[last].end(), state)
+
+    def match(self, text: str) -> Tuple[ConceptMatch, ...]:
+        """Return the concept names found in ``text`` with the CUIs of each,
+        sorted by their location in the text.
+
+        """
+        auto: _Automaton = self.automaton
+        return tuple(sorted(
+            map(lambda m: ConceptMatch(LexicalSpan(m[0], m[1]),
+                                       auto.get_cuis(m[2])),
+                self._scan(text)),
+            key=lambda m: (m.lexspan.begin, -m.lexspan.end)))
+
+    def has_match(self, text: str) -> bool:
+        """Return whether ``text`` has any concept name, which stops scanning
+        at the first name found.
+
+        """
+        return next(iter(self._scan(text)), None) is not None
+
+    def filter_texts(self, texts: Iterable[str]) -> Iterable[str]:
+        """Return the texts that have at least one concept name, which is used
+        to parse only texts that have candidate concepts.
+
+        """
+        return filter(self.has_match, texts)
+
+    def __call__(self, doc: Doc) -> Doc:
+        """Add the matches of a spaCy document as spans labeled by the first
+        CUI of each name to the :obj:`span_key` span group.
+
+        """
+        spans: List[Span] = []
+        m: ConceptMatch
+        for m in self.match(doc.text):
+            span: Optional[Span] = doc.char_span(
+                m.lexspan.begin, m.lexspan.end, label=m.cuis[0],
+                alignment_mode='expand')
+            if span is not None:
+                spans.append(span)
+        doc.spans[self.span_key] = spans
+        return doc
+
+    def add_pipe(self, nlp: Language, name: str = 'concept_matcher',
+                 **kwargs):
+        """Add this instance as a component of a spaCy pipeline.
+
+        :param nlp: the pipeline to which the component is added
+
+        :param name: the name of the component
+
+        :param kwargs: the keyword arguments given to ``Language.add_pipe``
+
+        :see: :meth:`__call__`
+
+        """
+        # spaCy components are registered globally by factory name, so each
+        # instance has its own, which also keeps it from being collected and
+        # its identity reused
+        factory: str = f'mednlp_concept_matcher_{id(self)}'
+        if not Language.has_factory(factory):
+            Language.component(factory, func=self)
+        nlp.add_pipe(factory, name=name, **kwargs)
+
+    def clear(self):
+        """Remove the compiled automaton."""
+        self._automaton.clear()
+        if self.path.is_dir():
+            for path in self.path.iterdir():
+                path.unlink()
+            self.path.rmdir()
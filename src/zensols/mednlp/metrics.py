@@ -0,0 +1,229 @@
+"""Opt-in instrumentation of the medical parsing pipeline.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Dict, Any, Iterator, Optional, ContextManager
+from dataclasses import dataclass, field
+import sys
+import logging
+import time
+import json
+from contextlib import contextmanager, nullcontext
+from io import TextIOBase
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+from zensols.config import Dictable
+
+logger = logging.getLogger(__name__)
+
+
+def get_peak_rss() -> Optional[int]:
+    """Return the peak resident memory of the process in bytes or ``None`` if
+    not available on the platform.
+
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux and bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+@dataclass
+class StageMetric(Dictable):
+    """The wall time of all calls to a stage of the pipeline.
+
+    """
+    calls: int = field(default=0)
+    """The number of times the stage was run."""
+
+    seconds: float = field(default=0.)
+    """The total wall time of the stage in seconds."""
+
+    max_seconds: float = field(default=0.)
+    """The wall time of the slowest call in seconds."""
+
+    @property
+    def mean_seconds(self) -> float:
+        """The average wall time of a call in seconds."""
+        return 0. if self.calls == 0 else self.seconds / self.calls
+
+    def add(self, seconds: float):
+        """Add the wall time of a call."""
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+@dataclass
+class Metrics(Dictable):
+    """An in-process registry of parse stage wall times and counts.  Nothing
+    is recorded unless :obj:`enabled` is ``True`` so the parsers, resources
+    and clients configured with an instance pay (almost) nothing otherwise.
+
+    Stages are dot separated names (i.e. ``medcat.spacy.cat_linker``), and
+    counters are incremented by the instrumented classes (i.e. ``docs``,
+    ``tokens`` and ``entities``).  Caches count hits and misses with
+    :meth:`cache`, which are reported by :meth:`hit_rate`.
+
+    """
+    _DICTABLE_ATTRIBUTES = {'hit_rates', 'peak_rss'}
+
+    enabled: bool = field(default=False)
+    """Whether to record metrics."""
+
+    stages: Dict[str, StageMetric] = field(default_factory=dict)
+    """The wall times keyed by stage name."""
+
+    counters: Dict[str, int] = field(default_factory=dict)
+    """The counts keyed by counter name."""
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """A context manager that adds the wall time of its block to
+        ``stage``.
+
+        """
+        if not self.enabled:
+            yield
+        else:
+            t0: float = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.add_time(stage, time.perf_counter() - t0)
+
+    def add_time(self, stage: str, seconds: float):
+        """Add the wall time of a call to ``stage``."""
+        if self.enabled:
+            metric: StageMetric = self.stages.get(stage)
+            if metric is None:
+                metric = StageMetric()
+                self.stages[stage] = metric
+            metric.add(seconds)
+
+    def increment(self, name: str, n: int = 1):
+        """Add ``n`` to counter ``name``."""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def cache(self, name: str, hit: bool):
+        """Count a hit or miss of the cache ``name``."""
+        self.increment(f'{name}.{"hits" if hit else "misses"}')
+
+    def hit_rate(self, name: str) -> Optional[float]:
+        """Return the hit rate of cache ``name`` or ``None`` if not used."""
+        hits: int = self.counters.get(f'{name}.hits', 0)
+        total: int = hits + self.counters.get(f'{name}.misses', 0)
+        return None if total == 0 else hits / total
+
+    @property
+    def hit_rates(self) -> Dict[str, float]:
+        """The hit rates of all caches keyed by cache name."""
+        names = set(map(lambda n: n[:n.rindex('.')],
+                        filter(lambda n: n.endswith('.hits') or
+                               n.endswith('.misses'), self.counters.keys())))
+        return {n: self.hit_rate(n) for n in sorted(names)}
+
+    @property
+    def peak_rss(self) -> Optional[int]:
+        """The peak resident memory of the process in bytes or ``None`` if
+        not available on the platform.
+
+        """
+        return get_peak_rss()
+
+    @property
+    def dataframe(self) -> pd.DataFrame:
+        """The stage wall times with each stage's share of the longest running
+        stage, which is the outer most stage when all stages are timed by one
+        (i.e. the ``corpus`` stage of :meth:`.Application.profile`).
+
+        """
+        rows = []
+        total: float = max(map(lambda m: m.seconds, self.stages.values()),
+                           default=0)
+        name: str
+        metric: StageMetric
+        for name, metric in self.stages.items():
+            share: float = 0. if total == 0 else metric.seconds / total
+            rows.append((name, metric.calls, metric.seconds,
+                         metric.mean_seconds, metric.max_seconds, share))
+        df = pd.DataFrame(
+            rows, columns='stage calls seconds mean max share'.split())
+        return df.sort_values('stage').reset_index(drop=True)
+
+    def reset(self):
+        """Remove all recorded metrics."""
+        self.stages.clear()
+        self.counters.clear()
+
+    def write(self, depth: int = 0, writer: TextIOBase = sys.stdout):
+        df: pd.DataFrame = self.dataframe
+        self._write_line('stages:', depth, writer)
+        row: pd.Series
+        for _, row in df.iterrows():
+            self._write_line(
+                (f"{row['stage']}: {row['seconds']:.3f}s " +
+                 f"({row['share'] * 100:.1f}%), calls={row['calls']}, " +
+                 f"mean={row['mean'] * 1000:.2f}ms, " +
+                 f"max={row['max'] * 1000:.2f}ms"),
+                depth + 1, writer)
+        self._write_line('counters:', depth, writer)
+        for name, cnt in sorted(self.counters.items()):
+            self._write_line(f'{name}: {cnt}', depth + 1, writer)
+        rates: Dict[str, float] = self.hit_rates
+        if len(rates) > 0:
+            self._write_line('cache hit rates:', depth, writer)
+            for name, rate in rates.items():
+                self._write_line(f'{name}: {rate * 100:.1f}%',
+                                 depth + 1, writer)
+        rss: Optional[int] = self.peak_rss
+        if rss is not None:
+            self._write_line(f'peak RSS: {rss / 1024 ** 2:.1f}MB',
+                             depth, writer)
+
+
+@dataclass
+class MetricsExporter(object):
+    """Exports :class:`.Metrics` as JSON, one line per export, so the
+    results of many runs can be compared.
+
+    """
+    metrics: Metrics = field()
+    """The metrics to export."""
+
+    path: Path = field()
+    """The file to which metrics are appended."""
+
+    def export(self, **context: Any) -> Dict[str, Any]:
+        """Append the current metrics to :obj:`path`.
+
+        :param context: additional data added to the exported record, such as
+                        the name of the corpus
+
+        :return: the exported data
+
+        """
+        data: Dict[str, Any] = dict(context)
+        data['time'] = datetime.now().isoformat()
+        data.update(self.metrics.asdict())
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(data))
+            f.write('\n')
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'exported metrics to {self.path}')
+        return data
+
+
+def stage_timer(metrics: Optional[Metrics], stage: str) -> ContextManager:
+    """Return a context manager that times ``stage`` with ``metrics``, or does
+    nothing when the instrumented instance has no metrics.
+
+    """
+    return nullcontext() if metrics is None else metrics.time(stage)
@@ -3,16 +3,28 @@
 """
 __author__ = 'Paul Landes'
 
-from typing import Type, Iterable, Dict, Set
+from typing import (
+    Type, Iterable, Tuple, List, Dict, Set, FrozenSet, Optional
+)
 from dataclasses import dataclass, field
 import logging
 import collections
+import itertools as it
+from itertools import chain
 import textwrap as tw
 from spacy.tokens.doc import Doc
+from spacy.tokens.span import Span
 from spacy.language import Language
-from zensols.nlp import FeatureToken, FeatureDocumentParser
+from medcat.meta_cat import MetaCAT
+from zensols.nlp import (
+    LexicalSpan, FeatureToken, FeatureSentence, FeatureDocument,
+    FeatureDocumentParser, FeatureDocumentDecorator
+)
 from zensols.nlp.sparser import SpacyFeatureDocumentParser
-from . import MedNLPError, MedCatResource, MedicalFeatureToken
+from . import (
+    MedNLPError, MedCatResource, MedicalFeatureToken, TextSegmenter, Metrics,
+    stage_timer
+)
 from .domain import _MedicalEntity
 
 logger = logging.getLogger(__name__)
@@ -40,17 +52,414 @@ class MedCatFeatureDocumentParser(SpacyFeatureDocumentParser):
     medcat_resource: MedCatResource = field(default=None)
     """The MedCAT factory resource."""
 
+    filter_profile: str = field(default=None)
+    """The name of the filter profile in
+    :obj:`.MedCatResource.filter_profiles` used to remove linked concepts after
+    parsing.  This can be changed between calls to :meth:`parse` to switch
+    filters without reloading the MedCAT model.
+
+    """
+    segmenter: TextSegmenter = field(default=None)
+    """If set, text longer than :obj:`.TextSegmenter.max_length` is split in
+    to sentence aligned segments, which are parsed in batches and then
+    combined in to one document.  This bounds the size of the spaCy documents
+    created for very long notes.
+
+    Token indexes (:obj:`~zensols.nlp.tok.FeatureToken.i`) are contiguous
+    across segments, so the text between segments adds no tokens.  They differ
+    from those of an unsegmented parse when spaCy creates whitespace tokens
+    between the segments (i.e. for more than one space or for newlines).
+    Segmented documents have no spaCy document, so :obj:`document_decorators`
+    must not use it.
+
+    """
+    segment_batch_size: int = field(default=32)
+    """The number of segments given to spaCy at a time when parsing with
+    :obj:`segmenter`.
+
+    """
+    metrics: Metrics = field(default=None)
+    """If set and enabled, records the wall time of each spaCy pipeline
+    component (including MedCAT linking and MetaCAT), feature creation and
+    concept filtering, and the document, token and entity counts.
+
+    """
+    meta_annotate: bool = field(default=True)
+    """Whether to run the MetaCAT models, if loaded, to add the
+    :obj:`.MedicalFeatureToken.status_` feature.  They are run after concepts
+    are filtered by :obj:`filter_profile` and only on the remaining concepts.
+
+    :see: :obj:`.MedCatResource.meta_cats_enabled`
+
+    """
     def __post_init__(self):
         if self.medcat_resource is None:
             raise MedNLPError('No medcat resource set')
         super().__post_init__()
 
     def _create_model_key(self) -> str:
-        return f'name-{self.name}'
+        # parsers of the same name with resources configured for different
+        # MedCAT models (i.e. without MetaCAT or with shared tables) do not
+        # use the same cached pipeline
+        res: MedCatResource = self.medcat_resource
+        opts: Tuple[str, ...] = (
+            f'meta:{res.meta_cats_enabled}',
+            f'disambiguate:{res.disambiguate}',
+            f'shared:{res.shared_tables_path}',
+            'comps:' + ','.join(sorted(res.spacy_enable_components)),
+            'tuis:' + ','.join(sorted(res.filter_tuis or ())),
+            'groups:' + ','.join(sorted(res.filter_groups or ())),
+            f'config:{res.cat_config}')
+        return f'name-{self.name}-' + '-'.join(opts)
 
     def _create_model(self) -> Language:
         return self.medcat_resource.cat.pipe.spacy_nlp
 
+    def _get_model(self) -> Language:
+        # replace the cached pipeline of a cleared (reloaded) or uncached
+        # resource so only the pipeline of the current model is kept
+        mkey: str = self._create_model_key()
+        nlp: Language = self.medcat_resource.cat.pipe.spacy_nlp
+        if self._MODELS.get(mkey, nlp) is not nlp:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'replacing cached model: {mkey}')
+            del self._MODELS[mkey]
+        return super()._get_model()
+
+    def _get_meta_cats(self) -> Tuple[Tuple[str, MetaCAT], ...]:
+        """Return the names and MetaCAT components of the spaCy pipeline."""
+        return tuple(filter(lambda t: isinstance(t[1], MetaCAT),
+                            self.model.pipeline))
+
+    def _get_disabled_components(self) -> Tuple[str, ...]:
+        """Return the spaCy components not run with the pipeline, which
+        includes the MetaCAT components run by :meth:`_annotate_meta` after
+        filtering.
+
+        """
+        disable: Tuple[str, ...] = () if self.disable_component_names is None \
+            else tuple(self.disable_component_names)
+        return disable + tuple(map(lambda t: t[0], self._get_meta_cats()))
+
+    def _annotate_meta(self, docs: Iterable[Doc]):
+        """Add MetaCAT annotations to the concepts of ``docs``, which is
+        batched across the concepts of all documents.
+
+        """
+        if not self.meta_annotate:
+            return
+        disable: Set[str] = set() if self.disable_component_names is None \
+            else set(self.disable_component_names)
+        docs = tuple(filter(lambda d: len(d.ents) > 0, docs))
+        name: str
+        meta_cat: MetaCAT
+        for name, meta_cat in self._get_meta_cats():
+            if len(docs) > 0 and name not in disable:
+                with stage_timer(self.metrics, f'medcat.meta.{name}'):
+                    # annotates the entities of the documents in place
+                    collections.deque(meta_cat.pipe(iter(docs)), maxlen=0)
+
+    def _parse_spacy_doc_stages(self, text: str) -> Doc:
+        """Like :meth:`parse_spacy_doc` but time each component of the spaCy
+        pipeline.
+
+        """
+        metrics: Metrics = self.metrics
+        model: Language = self.model
+        disable: Set[str] = set(self._get_disabled_components())
+        with metrics.time('medcat.spacy.tokenizer'):
+            doc: Doc = model.make_doc(text)
+        name: str
+        for name, proc in model.pipeline:
+            if name not in disable:
+                with metrics.time(f'medcat.spacy.{name}'):
+                    doc = proc(doc)
+        return doc
+
+    def _filter_concepts(self, doc: Doc):
+        """Remove linked concepts not in the CUIs of :obj:`filter_profile`."""
+        res: MedCatResource = self.medcat_resource
+        cuis: Optional[FrozenSet[str]] = \
+            res.get_profile_cuis(self.filter_profile)
+        if cuis is not None:
+            ents: Tuple[Span, ...] = doc.ents
+            keeps: Tuple[Span, ...] = tuple(filter(
+                lambda e: e._.cui in cuis, ents))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'profile {self.filter_profile} kept ' +
+                             f'{len(keeps)} of {len(ents)} concepts')
+            doc.ents = keeps
+
+    def parse_spacy_doc(self, text: str) -> Doc:
+        doc: Doc
+        if self.metrics is not None and self.metrics.enabled:
+            doc = self._parse_spacy_doc_stages(text)
+        else:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'creating document with model: {self.name}')
+            doc = self.model(text, disable=self._get_disabled_components())
+        if self.filter_profile is not None:
+            with stage_timer(self.metrics, 'medcat.filter'):
+                self._filter_concepts(doc)
+        self._annotate_meta((doc,))
+        return doc
+
+    def from_spacy_doc(self, doc: Doc, *args, text: str = None,
+                       **kwargs) -> FeatureDocument:
+        with stage_timer(self.metrics, 'medcat.features'):
+            return super().from_spacy_doc(doc, *args, text=text, **kwargs)
+
+    def _pipe_spacy_docs(self, texts: Iterable[str]) -> Iterable[Doc]:
+        """Like :meth:`parse_spacy_doc` but parse many texts in batches."""
+        docs: List[Doc] = list(self.model.pipe(
+            texts, batch_size=self.segment_batch_size,
+            disable=self._get_disabled_components()))
+        if self.filter_profile is not None:
+            doc: Doc
+            for doc in docs:
+                self._filter_concepts(doc)
+        self._annotate_meta(docs)
+        return docs
+
+    def _shift_sents(self, sents: Iterable[FeatureSentence], i_offset: int,
+                     sent_offset: int, idx_offset: int):
+        """Move the token and entity offsets of sentences parsed from a
+        segment to where the segment starts in the document.
+
+        """
+        sent: FeatureSentence
+        for sent in sents:
+            sent.spacy_span = None
+            sent._ents = list(map(lambda e: (e[0] + idx_offset,
+                                             e[1] + idx_offset), sent._ents))
+            tok: FeatureToken
+            for tok in sent.token_iter():
+                ls: LexicalSpan = tok.lexspan
+                tok.i += i_offset
+                tok.idx += idx_offset
+                tok.lexspan = LexicalSpan(
+                    ls.begin + idx_offset, ls.end + idx_offset)
+                if hasattr(tok, 'sent_i'):
+                    tok.sent_i += sent_offset
+                if hasattr(tok, 'children'):
+                    tok.children = list(map(lambda c: c + i_offset,
+                                            tok.children))
+            sent.clear()
+
+    def _parse_segments(self, text: str, spans: Iterable[LexicalSpan],
+                        i_offset: int = 0, sent_offset: int = 0) -> \
+            Iterable[FeatureSentence]:
+        """Parse each segment of ``text`` and return the sentences with offsets
+        relative to ``text``.
+
+        :param i_offset: the token index of the first token in the first
+                         segment; each segment's tokens follow those of the
+                         previous segment, so the text between them adds no
+                         token indexes
+
+
+        :param sent_offset: the sentence index of the first sentence
+
+        """
+        spans = iter(spans)
+        while True:
+            batch: Tuple[LexicalSpan, ...] = tuple(
+                it.islice(spans, self.segment_batch_size))
+            if len(batch) == 0:
+                break
+            texts: Iterable[str] = map(
+                lambda s: text[s.begin:s.end], batch)
+            span: LexicalSpan
+            doc: Doc
+            for span, doc in zip(batch, self._pipe_spacy_docs(texts)):
+                sents: List[FeatureSentence] = self._create_sents(doc)
+                self._shift_sents(sents, i_offset, sent_offset, span.begin)
+                i_offset += len(doc)
+                sent_offset += len(sents)
+                yield from sents
+
+    def _decorate_doc(self, spacy_doc: Optional[Span],
+                      feature_doc: FeatureDocument):
+        if spacy_doc is not None:
+            super()._decorate_doc(spacy_doc, feature_doc)
+        else:
+            # documents combined from segments or reparsed have no spaCy
+            # document, so report decorators that read it
+            decorator: FeatureDocumentDecorator
+            for decorator in self.document_decorators:
+                try:
+                    decorator.decorate(feature_doc)
+                except AttributeError as e:
+                    raise MedNLPError(
+                        f'Document decorator {type(decorator).__name__} ' +
+                        'failed on a document without a spaCy document ' +
+                        f'(parsed in segments or reparsed): {e}') from e
+
+    def _parse_segmented(self, text: str, *args, **kwargs) -> \
+            FeatureDocument:
+        """Parse ``text`` by segmenting it with :obj:`segmenter`."""
+        self._log_parse(text, logger)
+        spans: Iterable[LexicalSpan] = self.segmenter(text)
+        sents: Tuple[FeatureSentence, ...] = tuple(
+            self._parse_segments(text, spans))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'parsed {len(sents)} sentences from segments')
+        doc: FeatureDocument = self.doc_class(
+            sents, text, None, *args, **kwargs)
+        self._decorate_doc(None, doc)
+        return doc
+
+    def parse(self, text: str, *args, **kwargs) -> FeatureDocument:
+        doc: FeatureDocument
+        with stage_timer(self.metrics, 'medcat.parse'):
+            if self.segmenter is not None and isinstance(text, str) and \
+               len(text) > self.segmenter.max_length:
+                doc = self._parse_segmented(text, *args, **kwargs)
+            else:
+                doc = super().parse(text, *args, **kwargs)
+        metrics: Metrics = self.metrics
+        if metrics is not None and metrics.enabled:
+            metrics.increment('docs')
+            metrics.increment('sentences', len(doc.sents))
+            metrics.increment('tokens', doc.token_len)
+            metrics.increment('entities', len(doc.entities))
+        return doc
+
+    @staticmethod
+    def _common_prefix_len(a: str, b: str) -> int:
+        """Return the length of the longest common prefix of ``a`` and ``b``
+        using a binary search on (native) string comparisons.
+
+        """
+        lo: int = 0
+        hi: int = min(len(a), len(b))
+        while lo < hi:
+            mid: int = (lo + hi + 1) // 2
+            if a[lo:mid] == b[lo:mid]:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    @staticmethod
+    def _get_reusable(spans: Iterable[Optional[Tuple[int, int]]],
+                      common_len: int, text_len: int) -> Tuple[int, int]:
+        """Return the number of leading sentences of a previous parse that can
+        be reused and the offset where the text to parse starts.  Sentences
+        must end before the unchanged ``common_len`` characters of the
+        ``text_len`` long text.
+
+        :param spans: the offsets of each sentence, or ``None`` for sentences
+                      without tokens, which have no offsets; these are
+                      reused only if the gap between the sentences with
+                      tokens around them is unchanged
+
+        """
+        n_reuse: int = 0
+        start: int = 0
+        n_spans: int = 0
+        span: Optional[Tuple[int, int]]
+        for span in spans:
+            n_spans += 1
+            if span is not None:
+                if span[1] >= common_len:
+                    if n_spans - 1 > n_reuse and span[0] <= common_len:
+                        n_reuse, start = n_spans - 1, span[0]
+                    return n_reuse, start
+                n_reuse, start = n_spans, span[1]
+        if n_spans > n_reuse and text_len <= common_len:
+            n_reuse, start = n_spans, text_len
+        return n_reuse, start
+
+    def reparse(self, previous: FeatureDocument, text: str) -> \
+            FeatureDocument:
+        """Parse a new version of a document by reusing the sentences of a
+        previous parse that are not affected by the changes.  Only the text
+        between the unchanged leading and trailing sentences is parsed.  The
+        reused sentences are cloned with their offsets moved to those of
+        ``text``, and ``previous`` is left unmodified.  This makes parsing
+        appended addenda and small corrections proportional to the size of the
+        change.
+
+        Token indexes (:obj:`~zensols.nlp.tok.FeatureToken.i`) are contiguous
+        across the reused and newly parsed sentences, so they might differ from
+        those of a full parse of text with whitespace tokens.
+
+        :param previous: a document parsed by this parser from an older
+                         version of the text
+
+        :param text: the new version of the text
+
+        :return: a new document with the same features as if ``text`` was
+                 parsed
+
+        """
+        def next_i(sents: List[FeatureSentence], default: int) -> int:
+            sent: FeatureSentence
+            for sent in reversed(sents):
+                if sent.token_len > 0:
+                    return sent[-1].i + 1
+            return default
+
+        prev_text: str = previous.text
+        if prev_text == text:
+            return previous.clone()
+        self._log_parse(text, logger)
+        prev_len: int = len(prev_text)
+        delta: int = len(text) - prev_len
+        pre_len: int = self._common_prefix_len(prev_text, text)
+        # the common suffix can not overlap with the common prefix
+        suf_max: int = min(prev_len, len(text)) - pre_len
+        suf_len: int = self._common_prefix_len(
+            prev_text[::-1][:suf_max], text[::-1][:suf_max])
+        sents: Tuple[FeatureSentence, ...] = previous.sents
+        # sentences must end before the change starts, or start after it ends,
+        # so that changes touching a boundary are re-parsed; the trailing
+        # sentences are found the same way with offsets from the end
+        n_heads: int
+        mid_begin: int
+        n_heads, mid_begin = self._get_reusable(
+            map(lambda s: None if s.token_len == 0 else s.lexspan.astuple,
+                sents), pre_len, prev_len)
+        heads: List[FeatureSentence] = list(sents[:n_heads])
+        n_tails: int
+        mid_end: int
+        n_tails, mid_end = self._get_reusable(
+            map(lambda s: None if s.token_len == 0 else
+                (prev_len - s.lexspan.end, prev_len - s.lexspan.begin),
+                reversed(sents[n_heads:])), suf_len, prev_len - mid_begin)
+        tails: List[FeatureSentence] = list(sents[len(sents) - n_tails:])
+        mid_end = prev_len - mid_end + delta
+        while mid_begin < mid_end and text[mid_begin].isspace():
+            mid_begin += 1
+        while mid_end > mid_begin and text[mid_end - 1].isspace():
+            mid_end -= 1
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'reusing {len(heads)} leading and {len(tails)} ' +
+                         f'trailing sentences of {len(sents)}, parsing ' +
+                         f'span ({mid_begin}, {mid_end})')
+        tail_start: int = len(sents) - len(tails)
+        heads = list(map(lambda s: s.clone(), heads))
+        i_offset: int = next_i(heads, 0)
+        mids: List[FeatureSentence] = []
+        if mid_end > mid_begin:
+            mids.extend(self._parse_segments(
+                text, (LexicalSpan(mid_begin, mid_end),),
+                i_offset, len(heads)))
+        if len(tails) > 0:
+            i_offset = next_i(mids, i_offset)
+            tails = list(map(lambda s: s.clone(), tails))
+            # the token index shift is skipped for sentences without tokens
+            first: Optional[FeatureToken] = next(
+                chain.from_iterable(tails), None)
+            i_shift: int = 0 if first is None else i_offset - first.i
+            self._shift_sents(tails, i_shift,
+                              len(heads) + len(mids) - tail_start, delta)
+        doc: FeatureDocument = self.doc_class(
+            tuple(heads + mids + tails), text)
+        self._decorate_doc(None, doc)
+        return doc
+
     def _normalize_tokens(self, doc: Doc) -> Iterable[FeatureToken]:
         if logger.isEnabledFor(logging.INFO):
             logger.info(f'parsing: {tw.shorten(str(doc), 60)}')
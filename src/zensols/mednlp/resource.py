@@ -3,13 +3,18 @@
 """
 __author__ = 'Paul Landes'
 
-from typing import Tuple, Dict, Any, Set
+from typing import (
+    Tuple, List, Dict, Any, Set, FrozenSet, Iterable, Sequence, Optional
+)
 from dataclasses import dataclass, field, InitVar
 import logging
+from importlib.metadata import version
 from pathlib import Path
 import re
 from frozendict import frozendict
+import numpy as np
 import pandas as pd
+from spacy.language import Language
 from medcat.config import Config, MixingConfig
 from medcat.vocab import Vocab
 from medcat.cdb import CDB
@@ -19,6 +24,9 @@ from zensols.util.package import PackageRequirement, PackageManager
 from zensols.config import Dictable
 from zensols.persist import persisted, PersistedWork
 from zensols.install import Resource, Installer
+from . import MedNLPError, Metrics, stage_timer
+from .codes import ConceptCodes, SemanticGroups
+from .shared import SharedConceptTables
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +52,13 @@ class MedCatResource(Dictable):
     mc_status_resource: Resource = field()
     """The the ``mc_status`` directory.
 
+    """
+    meta_cats_enabled: bool = field(default=True)
+    """Whether to load the MetaCAT (``mc_status``) model that annotates the
+    status (i.e. ``Affirmed``) of linked concepts.  When ``False``, the model
+    is not loaded or run, which saves parse time when the
+    :obj:`.MedicalFeatureToken.status_` feature is not used.
+
     """
     umls_tuis: Path = field()
     """The UMLS TUIs (types) mapping resource that maps from TUIs to
@@ -64,6 +79,17 @@ class MedCatResource(Dictable):
     to generate a list of CUIs from those mapped from ``name`` to ``tui` in
     :obj:`groups`.
 
+    """
+    filter_profiles: Dict[str, Dict[str, Set[str]]] = field(default=None)
+    """Named concept filters applied after linking so a single loaded
+    :obj:`cat` can serve many filters.  Each key is the name of the profile and
+    each value has the optional keys ``tuis`` and ``groups``, which are
+    interpreted the same as :obj:`filter_tuis` and :obj:`filter_groups`.  When
+    set, linking is restricted to the union of all profiles and the top level
+    filters.  A profile with neither key does not filter.
+
+    :see: :meth:`get_profile_cuis`
+
     """
     spacy_enable_components: Set[str] = field(
         default_factory=lambda: set('sentencizer parser'.split()))
@@ -73,6 +99,21 @@ class MedCatResource(Dictable):
 
     :see: `MedCAT Config <https://github.com/CogStack/MedCAT/blob/master/medcat/config.py>`_
 
+    """
+    disambiguate: bool = field(default=True)
+    """Whether to disambiguate names of more than one concept using context
+    vector similarity.  When ``False``, only names that link to one concept
+    without disambiguation are linked (dictionary only linking), and
+    :obj:`.MedicalFeatureToken.context_similarity` is not set.
+
+    """
+    shared_tables_path: Path = field(default=None)
+    """If set, the directory of the :class:`.SharedConceptTables` of the CDB,
+    which are exported when the CDB is first loaded (or has changed).  The
+    names, preferred names, types and context vectors of the loaded CDB are
+    then replaced with views of the memory mapped tables so that processes
+    share one copy.
+
     """
     cat_config: Dict[str, Dict[str, Any]] = field(default=None)
     """If provieded, set the CDB configuration.  Keys are ``general``,
@@ -92,9 +133,24 @@ class MedCatResource(Dictable):
     package_manager: PackageManager = field(default_factory=PackageManager)
     """The package manager used to install :obj:`requirements`."""
 
+    metrics: Metrics = field(default=None)
+    """If set and enabled, records the wall time of loading the MedCAT models.
+
+    """
     def __post_init__(self, cache_global: bool):
         self._tuis = PersistedWork('_tuis', self, cache_global=cache_global)
         self._cat = PersistedWork('_cat', self, cache_global=cache_global)
+        self._profile_cuis = PersistedWork('_profile_cuis', self)
+        self._concept_codes = PersistedWork(
+            '_concept_codes', self, cache_global=cache_global)
+        self._semantic_groups = PersistedWork(
+            '_semantic_groups', self, cache_global=cache_global)
+        self._tui_groups = PersistedWork(
+            '_tui_groups', self, cache_global=cache_global)
+        self._cui_group_bits = PersistedWork(
+            '_cui_group_bits', self, cache_global=cache_global)
+        self._shared_tables = PersistedWork(
+            '_shared_tables', self, cache_global=cache_global)
         self._installed = False
 
     @staticmethod
@@ -126,22 +182,42 @@ class MedCatResource(Dictable):
             else:
                 setattr(targ, src_top, src_conf)
 
-    def _add_filters(self, config: Config, cdb: CDB):
+    def _get_filter_tuis(self, tuis: Set[str], groups: Set[str]) -> Set[str]:
+        """Return the TUIs given in ``tuis`` with those in ``groups``."""
         filter_tuis = set()
-        if self.filter_tuis is not None:
-            filter_tuis.update(self.filter_tuis)
-        if self.filter_groups is not None:
-            df: pd.DataFrame = self.groups
-            reg = '.*(' + '|'.join(self.filter_groups) + ')'
-            df = df[df['name'].str.match(reg)]
-            filter_tuis.update(df['tui'].tolist())
+        if tuis is not None:
+            filter_tuis.update(tuis)
+        if groups is not None:
+            sgroups: SemanticGroups = self.semantic_groups
+            filter_tuis.update(sgroups.get_tuis(sgroups.match(groups)))
+        return filter_tuis
+
+    def _get_tui_cuis(self, cdb: CDB, tuis: Set[str]) -> Set[str]:
+        """Return the CUIs that have any of the types in ``tuis``."""
+        type_id2cuis: Dict[str, Set[str]] = cdb.addl_info['type_id2cuis']
+        cuis = set()
+        for tui in tuis:
+            cuis.update(type_id2cuis[tui])
+        return cuis
+
+    def _add_filters(self, config: Config, cdb: CDB):
+        filter_tuis: Set[str] = self._get_filter_tuis(
+            self.filter_tuis, self.filter_groups)
+        if self.filter_profiles is not None:
+            prof: Dict[str, Set[str]]
+            for prof in self.filter_profiles.values():
+                prof_tuis: Set[str] = self._get_filter_tuis(
+                    prof.get('tuis'), prof.get('groups'))
+                if len(prof_tuis) == 0:
+                    # an unrestricted profile needs all concepts linked
+                    filter_tuis.clear()
+                    break
+                filter_tuis.update(prof_tuis)
         if logger.isEnabledFor(logging.INFO):
             logger.info(f'filtering on tuis: {", ".join(filter_tuis)}')
         if len(filter_tuis) > 0:
-            cui_filters = set()
-            for tui in filter_tuis:
-                cui_filters.update(cdb.addl_info['type_id2cuis'][tui])
-            config.linking['filters']['cuis'] = cui_filters
+            config.linking['filters']['cuis'] = \
+                self._get_tui_cuis(cdb, filter_tuis)
 
     @property
     @persisted('_tuis')
@@ -164,14 +240,101 @@ class MedCatResource(Dictable):
         return df
 
     @property
-    @persisted('_cat')
-    def cat(self) -> CAT:
-        """The MedCAT NER tagger instance.
+    @persisted('_semantic_groups')
+    def semantic_groups(self) -> SemanticGroups:
+        """The codes and lookups of the semantic groups of :obj:`groups`."""
+        return SemanticGroups.from_dataframe(self.groups)
 
-        When this property is accessed, all models are downloaded first, then
-        loaded, if not already.
+    @property
+    @persisted('_tui_groups')
+    def tui_groups(self) -> Dict[str, Tuple[str, ...]]:
+        """The semantic group abbreviations (i.e. ``DISO``) of each TUI."""
+        return frozendict(self.semantic_groups.tui_groups)
+
+    @property
+    @persisted('_cui_group_bits')
+    def cui_group_bits(self) -> np.ndarray:
+        """The semantic groups bitset of each concept indexed by its code
+        (see :meth:`.SemanticGroups.get_cui_group_bits`).
+
+        """
+        return self.semantic_groups.get_cui_group_bits(self.concept_codes)
+
+    def has_groups(self, cuis: Sequence[str], groups: Iterable[str]) -> \
+            np.ndarray:
+        """Return whether each concept has a TUI in any of the semantic
+        groups, which is computed once for each unique concept with a
+        vectorized mask of the concepts' group bitsets.  This is useful to
+        filter the concepts of large exports.
+
+        :param cuis: the concepts, such as a column of a dataframe
+
+        :param groups: the group abbreviations (i.e. ``DISO``)
+
+        :return: a boolean array with the length of ``cuis``
 
         """
+        codes: ConceptCodes = self.concept_codes
+        uniq: np.ndarray
+        inv: np.ndarray
+        uniq, inv = np.unique(np.asarray(cuis, dtype=str), return_inverse=True)
+        uniq_codes: np.ndarray = np.fromiter(
+            map(codes.get_cui_code, uniq.tolist()), dtype=np.int64,
+            count=len(uniq))
+        return self.semantic_groups.has_groups(
+            self.cui_group_bits[uniq_codes], groups)[inv]
+
+    @staticmethod
+    def _disable_disambiguation(cat: CAT, medcat_version: str = None):
+        """Link only names of exactly one concept by not linking names that
+        need disambiguation.  MedCAT has no configuration option for this, so
+        the context model of the 1.x linker is replaced.
+
+        :param medcat_version: the MedCAT version, which defaults to the
+                               installed version
+
+        :raises MedNLPError: if the MedCAT version is not 1.x or its linker has
+                             no context model that disambiguates
+
+        """
+        if medcat_version is None:
+            medcat_version = version('medcat')
+        model: Any = getattr(cat.linker, 'context_model', None)
+        if re.match(r'^1\.', medcat_version) is None or \
+           not callable(getattr(model, 'disambiguate', None)):
+            raise MedNLPError(
+                'Disambiguation can not be disabled for MedCAT version ' +
+                f'{medcat_version} (only 1.x is supported)')
+
+        def no_disambiguation(*args, **kwargs) -> Tuple[Optional[str], float]:
+            return None, 0
+
+        cat.linker.context_model.disambiguate = no_disambiguation
+
+    @staticmethod
+    def _add_sentencizer(nlp: Language):
+        """Add a rule based sentencizer when no component sets sentence
+        boundaries (i.e. when the dependency parser is disabled).
+
+        """
+        if not any(map(nlp.has_pipe, 'parser senter sentencizer'.split())):
+            if logger.isEnabledFor(logging.INFO):
+                logger.info('adding rule based sentencizer')
+            nlp.add_pipe('sentencizer', first=True)
+
+    def _share_tables(self, cdb: CDB):
+        """Export the tables of ``cdb`` if not already and attach them."""
+        tables: SharedConceptTables = self.shared_tables
+        cdb_path: Path = self.installer[self.cdb_resource]
+        stat = cdb_path.stat()
+        key: str = f'{cdb_path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}'
+        if not tables.is_current(key):
+            with stage_timer(self.metrics, 'medcat.share.export'):
+                tables.export(cdb, key)
+        with stage_timer(self.metrics, 'medcat.share.attach'):
+            tables.attach(cdb)
+
+    def _create_cat(self) -> CAT:
         # install medcat models if not already
         self._assert_installed()
         # ensure models are installed
@@ -181,20 +344,111 @@ class MedCatResource(Dictable):
         # Load the cdb model you downloaded
         cdb = CDB.load(self.installer[self.cdb_resource])
         # mc status model
-        mc_status = MetaCAT.load(self.installer[self.mc_status_resource])
+        meta_cats: List[MetaCAT] = []
+        if self.meta_cats_enabled:
+            meta_cats.append(
+                MetaCAT.load(self.installer[self.mc_status_resource]))
         # enable sentence boundary annotation
         for name in self.spacy_enable_components:
             cdb.config.general['spacy_disabled_components'].remove(name)
         # override configuration
         if self.cat_config is not None:
             self._override_config(cdb.config, self.cat_config)
+        # dictionary only linking has no context similarity
+        if not self.disambiguate:
+            cdb.config.linking['always_calculate_similarity'] = False
         # add TUI filters (i.e. filter out non-medical terms)
         self._add_filters(cdb.config, cdb)
         # create cat - each cdb comes with a config that was used to train it;
         # you can change that config in any way you want, before or after
         # creating cat
-        return CAT(cdb=cdb, config=cdb.config, vocab=vocab,
-                   meta_cats=[mc_status])
+        cat = CAT(cdb=cdb, config=cdb.config, vocab=vocab,
+                  meta_cats=meta_cats)
+        if 'sentencizer' in self.spacy_enable_components:
+            self._add_sentencizer(cat.pipe.spacy_nlp)
+        if not self.disambiguate:
+            self._disable_disambiguation(cat)
+        if self.shared_tables_path is not None:
+            self._share_tables(cdb)
+        return cat
+
+    @property
+    @persisted('_cat')
+    def cat(self) -> CAT:
+        """The MedCAT NER tagger instance.
+
+        When this property is accessed, all models are downloaded first, then
+        loaded, if not already.
+
+        """
+        with stage_timer(self.metrics, 'medcat.load'):
+            return self._create_cat()
+
+    @property
+    @persisted('_concept_codes')
+    def concept_codes(self) -> ConceptCodes:
+        """The dense integer codes of the CUIs and TUIs of the CDB with the
+        TUIs of each concept as a bitset.
+
+        """
+        with stage_timer(self.metrics, 'medcat.codes'):
+            if self.shared_tables_path is not None:
+                # the tables are exported and attached with the CDB
+                self.cat
+                return self.shared_tables.concept_codes
+            return ConceptCodes.from_cdb(self.cat.cdb)
+
+    @property
+    @persisted('_shared_tables')
+    def shared_tables(self) -> Optional[SharedConceptTables]:
+        """The memory mapped tables of the CDB shared across processes, or
+        ``None`` if :obj:`shared_tables_path` is not set.
+
+        """
+        if self.shared_tables_path is not None:
+            return SharedConceptTables(self.shared_tables_path)
+
+    @property
+    @persisted('_profile_cuis')
+    def profile_cuis(self) -> Dict[str, Optional[FrozenSet[str]]]:
+        """The CUIs of each filter profile keyed by profile name, which are
+        computed once from the CDB type membership.  A value of ``None``
+        indicates a profile that does not filter.
+
+        :see: :obj:`filter_profiles`
+
+        """
+        cdb: CDB = self.cat.cdb
+        profiles: Dict[str, Optional[FrozenSet[str]]] = {}
+        if self.filter_profiles is not None:
+            name: str
+            prof: Dict[str, Set[str]]
+            for name, prof in self.filter_profiles.items():
+                tuis: Set[str] = self._get_filter_tuis(
+                    prof.get('tuis'), prof.get('groups'))
+                cuis: Optional[FrozenSet[str]] = None
+                if len(tuis) > 0:
+                    cuis = frozenset(self._get_tui_cuis(cdb, tuis))
+                if logger.isEnabledFor(logging.DEBUG):
+                    n_cuis: int = -1 if cuis is None else len(cuis)
+                    logger.debug(f'filter profile {name}: {n_cuis} cuis')
+                profiles[name] = cuis
+        return frozendict(profiles)
+
+    def get_profile_cuis(self, name: str) -> Optional[FrozenSet[str]]:
+        """Return the CUIs that are kept by a filter profile.
+
+        :param name: the key of the profile in :obj:`filter_profiles`
+
+        :return: the CUIs of the profile or ``None`` if it does not filter
+
+        :raises MedNLPError: if ``name`` is not a configured profile
+
+        """
+        profiles: Dict[str, Optional[FrozenSet[str]]] = self.profile_cuis
+        if name not in profiles:
+            raise MedNLPError(f'No such filter profile: {name}')
+        return profiles[name]
 
     def _assert_requirements(self):
         spec: str
@@ -205,6 +459,14 @@ class MedCatResource(Dictable):
     def clear(self):
         self._tuis.clear()
         self._cat.clear()
+        self._profile_cuis.clear()
+        self._concept_codes.clear()
+        self._semantic_groups.clear()
+        self._tui_groups.clear()
+        self._cui_group_bits.clear()
+        if self._shared_tables.is_set():
+            self.shared_tables.close()
+            self._shared_tables.clear()
 
 
 MedCatResource._filter_medcat_logger()
@@ -0,0 +1,108 @@
+"""Segment long text in to sentence aligned pieces so they can be parsed
+separately.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Tuple, Iterable, Optional
+from dataclasses import dataclass, field
+import logging
+import re
+from zensols.nlp import LexicalSpan
+from zensols.persist import persisted
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TextSegmenter(object):
+    """Segments text in to spans of contiguous sentences that are no longer
+    than :obj:`max_length` characters.  Sentence boundaries are found with
+    :obj:`boundary_pattern`, which is cheap but less accurate than a parsed
+    segmentation.  Sentences longer than :obj:`max_length` are split on
+    whitespace.
+
+    """
+    max_length: int = field(default=10000)
+    """The maximum number of characters of each segment."""
+
+    boundary_pattern: re.Pattern = field(
+        default=re.compile(r'(?<=[.!?])\s+|\n\s*\n'))
+    """The pattern that matches the (whitespace) text between sentences."""
+
+    def _sentence_spans(self, text: str) -> Iterable[Tuple[int, int]]:
+        """Return the character offsets of the sentences in ``text``."""
+        start: int = 0
+        m: re.Match
+        for m in self.boundary_pattern.finditer(text):
+            if m.start() > start:
+                yield (start, m.start())
+            start = m.end()
+        end: int = len(text.rstrip())
+        if start < end:
+            yield (start, end)
+
+    def _split_long(self, spans: Iterable[Tuple[int, int]], text: str) -> \
+            Iterable[Tuple[int, int]]:
+        """Split sentences longer than :obj:`max_length` on whitespace."""
+        max_len: int = self.max_length
+        begin: int
+        end: int
+        for begin, end in spans:
+            while end - begin > max_len:
+                split: int = text.rfind(' ', begin + 1, begin + max_len)
+                if split == -1:
+                    split = begin + max_len
+                yield (begin, split)
+                begin = split
+                while begin < end and text[begin].isspace():
+                    begin += 1
+            if end > begin:
+                yield (begin, end)
+
+    def __call__(self, text: str) -> Iterable[LexicalSpan]:
+        """Segment ``text`` in to spans of sentences.
+
+        :param text: the text to segment
+
+        :return: the character offsets of each segment in ``text``
+
+        """
+        max_len: int = self.max_length
+        begin: Optional[int] = None
+        end: int = None
+        sb: int
+        se: int
+        for sb, se in self._split_long(self._sentence_spans(text), text):
+            if begin is None:
+                begin, end = sb, se
+            elif se - begin <= max_len:
+                end = se
+            else:
+                yield LexicalSpan(begin, end)
+                begin, end = sb, se
+        if begin is not None:
+            yield LexicalSpan(begin, end)
+
+
+@dataclass
+class PyRuSHTextSegmenter(TextSegmenter):
+    """Uses the `PyRuSH`_ clinical rule based sentence segmenter to find
+    sentence boundaries.  The ``PyRuSH`` package must be installed.
+
+    .. _PyRuSH: https://github.com/medspacy/PyRuSH
+
+    """
+    rules: str = field(default='')
+    """The path to the rules file, or the default rules if empty."""
+
+    @property
+    @persisted('_rush')
+    def rush(self) -> 'RuSH':
+        """The PyRuSH segmenter."""
+        from PyRuSH import RuSH
+        return RuSH(self.rules)
+
+    def _sentence_spans(self, text: str) -> Iterable[Tuple[int, int]]:
+        return map(lambda s: (s.begin, s.end),
+                   self.rush.segToSentenceSpans(text))
@@ -0,0 +1,309 @@
+"""Compact memory mapped tables of a MedCAT concept database shared across
+processes.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Tuple, List, Dict, Set, Iterable, Iterator, Any, Callable
+from dataclasses import dataclass, field
+import logging
+import os
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from collections.abc import Mapping
+import numpy as np
+from medcat.cdb import CDB
+from zensols.persist import persisted, PersistedWork
+from . import MedNLPError, ConceptCodes
+
+logger = logging.getLogger(__name__)
+
+
+class _ConceptMapping(Mapping):
+    """A read-only mapping of CUIs to values decoded from shared tables, which
+    replaces a dictionary of the CDB.
+
+    """
+    def __init__(self, codes: ConceptCodes, get: Callable[[int], Any],
+                 has: np.ndarray):
+        self._codes = codes
+        self._get = get
+        self._has = has
+
+    def __getitem__(self, cui: str) -> Any:
+        code: int = self._codes.get_cui_code(cui)
+        if code < 0 or not self._has[code]:
+            raise KeyError(cui)
+        return self._get(code)
+
+    def __contains__(self, cui: str) -> bool:
+        code: int = self._codes.get_cui_code(cui)
+        return code >= 0 and bool(self._has[code])
+
+    def __iter__(self) -> Iterator[str]:
+        cuis: Tuple[str, ...] = self._codes.cuis
+        return map(lambda i: cuis[i], np.nonzero(self._has)[0].tolist())
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._has))
+
+
+class _TypeMapping(Mapping):
+    """A read-only mapping of TUIs to the CUIs that have them, which are found
+    in the shared TUI bitsets and replaces ``addl_info['type_id2cuis']`` of
+    the CDB.
+
+    """
+    def __init__(self, codes: ConceptCodes):
+        self._codes = codes
+
+    def __getitem__(self, tui: str) -> Set[str]:
+        codes: ConceptCodes = self._codes
+        if codes.get_tui_code(tui) < 0:
+            raise KeyError(tui)
+        has: np.ndarray = codes.has_tuis(np.arange(len(codes)), (tui,))
+        return set(map(codes.cuis.__getitem__, np.nonzero(has)[0].tolist()))
+
+    def __contains__(self, tui: str) -> bool:
+        return self._codes.get_tui_code(tui) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._codes.tuis)
+
+    def __len__(self) -> int:
+        return len(self._codes.tuis)
+
+
+@dataclass
+class SharedConceptTables(object):
+    """The lookup tables of a MedCAT concept database (CDB) stored as compact
+    arrays in files that are memory mapped, so the pages are shared by all
+    processes that use them.  These are the preferred name and names of each
+    concept as string tables (a byte array of the UTF-8 encoded strings with
+    an array of offsets), the TUI bitsets of :class:`.ConceptCodes` and a
+    matrix of the context vectors of each context type.
+
+    Rows of all tables are the codes of :class:`.ConceptCodes`.  The tables are
+    created with :meth:`export` and replace the dictionaries of a loaded CDB
+    with :meth:`attach`.  The tables are read only, so a CDB with attached
+    tables can not be trained.
+
+    """
+    path: Path = field()
+    """The directory of the tables."""
+
+    def __post_init__(self):
+        self._meta = PersistedWork('_meta', self)
+        self._concept_codes = PersistedWork('_concept_codes', self)
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    @property
+    @persisted('_meta')
+    def meta(self) -> Dict[str, Any]:
+        """The metadata of the tables, which is empty when the tables have not
+        been exported.
+
+        """
+        path: Path = self.path / 'meta.json'
+        if not path.is_file():
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def is_current(self, key: str) -> bool:
+        """Whether the tables have been exported from the CDB identified by
+        ``key``.
+
+        """
+        return self.meta.get('key') == key
+
+    def _get_array(self, name: str) -> np.ndarray:
+        arr: np.ndarray = self._arrays.get(name)
+        if arr is None:
+            if 'key' not in self.meta:
+                raise MedNLPError(f'No shared CDB tables in {self.path}')
+            arr = np.asarray(np.load(self.path / f'{name}.npy',
+                                     mmap_mode='r'))
+            self._arrays[name] = arr
+        return arr
+
+    @property
+    @persisted('_concept_codes')
+    def concept_codes(self) -> ConceptCodes:
+        """The concept codes with the TUI bitsets in shared memory."""
+        meta: Dict[str, Any] = self.meta
+        cuis: Tuple[str, ...] = tuple(map(
+            lambda i: self._get_string('cuis', i), range(meta['n_cuis'])))
+        return ConceptCodes(cuis, tuple(meta['tuis']),
+                            self._get_array('tui_bits'))
+
+    @property
+    def context_types(self) -> Tuple[str, ...]:
+        """The context types of the context vectors (i.e. ``long``)."""
+        return tuple(self.meta['context_types'])
+
+    def _get_string(self, name: str, i: int) -> str:
+        offsets: np.ndarray = self._get_array(f'{name}-offsets')
+        data: np.ndarray = self._get_array(name)
+        return data[offsets[i]:offsets[i + 1]].tobytes().decode()
+
+    def get_pref_name(self, code: int) -> str:
+        """Return the preferred name of the concept with ``code``."""
+        return self._get_string('pref_names', code)
+
+    def get_names(self, code: int) -> Set[str]:
+        """Return the names of the concept with ``code``."""
+        ptr: np.ndarray = self._get_array('name-ptr')
+        return set(map(lambda i: self._get_string('names', i),
+                       range(ptr[code], ptr[code + 1])))
+
+    def get_context_vectors(self, context_type: str) -> \
+            Tuple[np.ndarray, np.ndarray]:
+        """Return the context vectors of a context type.
+
+        :return: a tuple of the matrix of vectors by concept code and a boolean
+                 array indicating which concepts have a vector
+
+        """
+        if context_type not in self.context_types:
+            raise MedNLPError(f'No such context type: {context_type}')
+        return (self._get_array(f'ctx-{context_type}'),
+                self._get_array(f'ctx-{context_type}-mask'))
+
+    @staticmethod
+    def _write_strings(path: Path, name: str, strs: Iterable[str]):
+        data: List[bytes] = list(map(str.encode, strs))
+        offsets = np.zeros(len(data) + 1, dtype=np.int64)
+        np.cumsum(tuple(map(len, data)), out=offsets[1:])
+        np.save(path / f'{name}.npy',
+                np.frombuffer(b''.join(data), dtype=np.uint8))
+        np.save(path / f'{name}-offsets.npy', offsets)
+
+    def _write(self, path: Path, cdb: CDB, key: str):
+        codes: ConceptCodes = ConceptCodes.from_cdb(cdb)
+        cuis: Tuple[str, ...] = codes.cuis
+        pref_names: Dict[str, str] = cdb.cui2preferred_name
+        cui2names: Dict[str, Set[str]] = cdb.cui2names
+        self._write_strings(path, 'cuis', cuis)
+        self._write_strings(path, 'pref_names', map(
+            lambda c: pref_names.get(c) or '', cuis))
+        names: List[List[str]] = list(map(
+            lambda c: sorted(cui2names.get(c, ())), cuis))
+        ptr = np.zeros(len(cuis) + 1, dtype=np.int64)
+        np.cumsum(tuple(map(len, names)), out=ptr[1:])
+        np.save(path / 'name-ptr.npy', ptr)
+        self._write_strings(path, 'names', (n for ns in names for n in ns))
+        np.save(path / 'tui_bits.npy', codes.tui_bits)
+        # context vectors by type
+        cui2vecs: Dict[str, Dict[str, np.ndarray]] = cdb.cui2context_vectors
+        ctypes: Set[str] = set()
+        dims: Dict[str, Tuple[int, np.dtype]] = {}
+        vecs: Dict[str, np.ndarray]
+        for vecs in cui2vecs.values():
+            ctype: str
+            vec: np.ndarray
+            for ctype, vec in vecs.items():
+                if ctype not in dims:
+                    dims[ctype] = (len(vec), vec.dtype)
+            ctypes.update(vecs.keys())
+        for ctype in sorted(ctypes):
+            dim, dtype = dims[ctype]
+            mat = np.lib.format.open_memmap(
+                path / f'ctx-{ctype}.npy', mode='w+', dtype=dtype,
+                shape=(len(cuis), dim))
+            mask = np.zeros(len(cuis), dtype=bool)
+            code: int
+            cui: str
+            for code, cui in enumerate(cuis):
+                vec = cui2vecs.get(cui, {}).get(ctype)
+                if vec is not None:
+                    mat[code] = vec
+                    mask[code] = True
+            mat.flush()
+            del mat
+            np.save(path / f'ctx-{ctype}-mask.npy', mask)
+        with open(path / 'meta.json', 'w') as f:
+            json.dump({'key': key, 'n_cuis': len(cuis),
+                       'tuis': codes.tuis,
+                       'context_types': sorted(ctypes)}, f)
+
+    def export(self, cdb: CDB, key: str):
+        """Write the tables of ``cdb``, which are written to a temporary
+        directory that is then moved to :obj:`path` so processes exporting
+        concurrently do not read partial tables.
+
+        :param cdb: the concept database to export
+
+        :param key: identifies the CDB (i.e. its file and modification time)
+
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(prefix='.shared-', dir=self.path.parent))
+        try:
+            self._write(tmp, cdb, key)
+            if self.path.exists():
+                shutil.rmtree(self.path)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            # another process exported the same tables first
+            if logger.isEnabledFor(logging.WARNING):
+                logger.warning(f'could not move shared tables: {e}')
+        finally:
+            if tmp.exists():
+                shutil.rmtree(tmp)
+        self.close()
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'exported shared CDB tables to {self.path}')
+
+    def attach(self, cdb: CDB):
+        """Replace the dictionaries of names, preferred names, types, concepts
+        by type (``addl_info['type_id2cuis']``) and context vectors of ``cdb``
+        with read-only views of these tables, which frees the memory of the
+        dictionaries in each process.  Only the dictionaries whose concepts
+        (or types) all have codes are replaced.  The context vectors of each
+        concept are replaced with rows of the shared matrices.
+
+        """
+        codes: ConceptCodes = self.concept_codes
+        attrs: Dict[str, Tuple[Callable[[int], Any], np.ndarray]] = {
+            'cui2names': (self.get_names,
+                          np.diff(self._get_array('name-ptr')) > 0),
+            'cui2preferred_name': (self.get_pref_name, np.diff(
+                self._get_array('pref_names-offsets')) > 0),
+            'cui2type_ids': (lambda c: set(
+                codes.get_tuis(codes.get_tui_bits(c))),
+                np.ones(len(codes), dtype=bool))}
+        attr: str
+        get: Callable[[int], Any]
+        has: np.ndarray
+        for attr, (get, has) in attrs.items():
+            if all(map(lambda c: codes.get_cui_code(c) >= 0,
+                       getattr(cdb, attr).keys())):
+                setattr(cdb, attr, _ConceptMapping(codes, get, has))
+            elif logger.isEnabledFor(logging.WARNING):
+                logger.warning(f'not sharing {attr}: concepts without codes')
+        addl_info: Dict[str, Any] = cdb.addl_info
+        if set(addl_info.get('type_id2cuis', {}).keys()) <= set(codes.tuis):
+            addl_info['type_id2cuis'] = _TypeMapping(codes)
+        elif logger.isEnabledFor(logging.WARNING):
+            logger.warning('not sharing type_id2cuis: types without codes')
+        cui2vecs: Dict[str, Dict[str, np.ndarray]] = cdb.cui2context_vectors
+        ctype: str
+        for ctype in self.context_types:
+            mat, mask = self.get_context_vectors(ctype)
+            cui: str
+            vecs: Dict[str, np.ndarray]
+            for cui, vecs in cui2vecs.items():
+                code: int = codes.get_cui_code(cui)
+                if ctype in vecs and code >= 0 and mask[code]:
+                    vecs[ctype] = mat[code]
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'attached shared CDB tables from {self.path}')
+
+    def close(self):
+        """Release the memory mapped tables."""
+        self._arrays.clear()
+        self._meta.clear()
+        self._concept_codes.clear()
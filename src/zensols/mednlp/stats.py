@@ -0,0 +1,387 @@
+"""Concept frequency and co-occurrence statistics over parsed corpora.
+
+"""
+__author__ = 'Paul Landes'
+
+from typing import Tuple, List, Dict, Any, Iterable, Optional
+from dataclasses import dataclass, field
+import logging
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from zensols.nlp import FeatureToken, FeatureSentence, FeatureDocument
+from . import MedNLPError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ConceptStatistics(object):
+    """Accumulates CUI and TUI frequencies and CUI co-occurrence within
+    sentences and notes as documents stream by.  Each mention of a concept,
+    which might span more than one token, is counted once.  Counts are kept in
+    sparse matrices indexed by CUIs in the order they are first seen:
+
+      * :obj:`cui_doc`: the mentions of each CUI (rows) in each document
+        (columns)
+
+      * :obj:`sent_cooc`: the number of sentences in which each pair of CUIs
+        occur, which is :math:`S^T S` for the binary sentence by CUI incidence
+        matrix :math:`S`, so the diagonal is the number of sentences with each
+        CUI
+
+      * :obj:`doc_cooc`: like :obj:`sent_cooc` but for documents
+
+    Incidence rows are buffered and added to the matrices every
+    :obj:`flush_size` documents.  Instances created by parallel workers are
+    combined with :meth:`merge`, and are persisted with :meth:`save` and
+    :meth:`load`.
+
+    """
+    _LEVELS = frozenset('sent doc'.split())
+    """The co-occurrence levels."""
+
+    flush_size: int = field(default=1000)
+    """The number of documents buffered before they are added to the sparse
+    matrices.
+
+    """
+    def __post_init__(self):
+        self.cuis: List[str] = []
+        self.doc_names: List[str] = []
+        self.tui_counts: Dict[str, int] = {}
+        self.n_sents: int = 0
+        self._cui2idx: Dict[str, int] = {}
+        self._cui_doc = sp.csr_matrix((0, 0), dtype=np.int64)
+        self._sent_cooc = sp.csr_matrix((0, 0), dtype=np.int64)
+        self._doc_cooc = sp.csr_matrix((0, 0), dtype=np.int64)
+        self._clear_buffers()
+
+    def _clear_buffers(self):
+        # (cui index, document column, mentions) triples
+        self._buf_mentions: List[Tuple[int, int, int]] = []
+        # cui indexes of each buffered sentence and document
+        self._buf_sents: List[np.ndarray] = []
+        self._buf_docs: List[np.ndarray] = []
+
+    @staticmethod
+    def _pad(mat: sp.spmatrix, shape: Tuple[int, int]) -> sp.csr_matrix:
+        """Return ``mat`` grown to ``shape`` with zeros."""
+        if mat.shape == shape:
+            return mat
+        coo: sp.coo_matrix = mat.tocoo()
+        return sp.csr_matrix((coo.data, (coo.row, coo.col)), shape=shape,
+                             dtype=np.int64)
+
+    @staticmethod
+    def _incidence_cooc(rows: List[np.ndarray], n_cuis: int) -> sp.csr_matrix:
+        """Return the co-occurrence counts of the units (sentences or
+        documents) with CUI indexes ``rows``.
+
+        """
+        lens: np.ndarray = np.fromiter(map(len, rows), dtype=np.int64,
+                                       count=len(rows))
+        cols: np.ndarray = np.concatenate(rows) if len(rows) > 0 else \
+            np.zeros(0, dtype=np.int64)
+        inc = sp.csr_matrix(
+            (np.ones(len(cols), dtype=np.int64), cols,
+             np.concatenate(((0,), np.cumsum(lens)))),
+            shape=(len(rows), n_cuis))
+        return (inc.T @ inc).tocsr()
+
+    def flush(self):
+        """Add the buffered documents to the sparse matrices."""
+        n_cuis: int = len(self.cuis)
+        n_docs: int = len(self.doc_names)
+        mentions = np.array(self._buf_mentions, dtype=np.int64).reshape(-1, 3)
+        self._cui_doc = self._pad(self._cui_doc, (n_cuis, n_docs)) + \
+            sp.csr_matrix((mentions[:, 2], (mentions[:, 0], mentions[:, 1])),
+                          shape=(n_cuis, n_docs), dtype=np.int64)
+        self._sent_cooc = self._pad(self._sent_cooc, (n_cuis, n_cuis)) + \
+            self._incidence_cooc(self._buf_sents, n_cuis)
+        self._doc_cooc = self._pad(self._doc_cooc, (n_cuis, n_cuis)) + \
+            self._incidence_cooc(self._buf_docs, n_cuis)
+        self._clear_buffers()
+
+    def _get_mentions(self, sent: FeatureSentence) -> Iterable[FeatureToken]:
+        """Return the first token of each concept mention in ``sent``."""
+        prev: Optional[FeatureToken] = None
+        tok: FeatureToken
+        for tok in sent.token_iter():
+            if tok.is_concept and \
+               (prev is None or prev.cui_ != tok.cui_ or prev.i + 1 != tok.i):
+                yield tok
+            prev = tok if tok.is_concept else None
+
+    def add(self, doc: FeatureDocument, name: str = None):
+        """Add the concepts of a document parsed by the medical parser.
+
+        :param doc: the document to add
+
+        :param name: the name of the document, which defaults to its index
+
+        """
+        cui2idx: Dict[str, int] = self._cui2idx
+        doc_col: int = len(self.doc_names)
+        doc_mentions: Dict[int, int] = {}
+        sent: FeatureSentence
+        for sent in doc.sents:
+            sent_cuis: Dict[int, None] = {}
+            tok: FeatureToken
+            for tok in self._get_mentions(sent):
+                idx: int = cui2idx.get(tok.cui_)
+                if idx is None:
+                    idx = len(self.cuis)
+                    cui2idx[tok.cui_] = idx
+                    self.cuis.append(tok.cui_)
+                sent_cuis[idx] = None
+                doc_mentions[idx] = doc_mentions.get(idx, 0) + 1
+                tui: str
+                for tui in tok.tuis:
+                    self.tui_counts[tui] = self.tui_counts.get(tui, 0) + 1
+            self._buf_sents.append(np.fromiter(sent_cuis.keys(), np.int64))
+        self.n_sents += len(doc.sents)
+        self._buf_docs.append(np.fromiter(doc_mentions.keys(), np.int64))
+        self._buf_mentions.extend(map(lambda t: (t[0], doc_col, t[1]),
+                                      doc_mentions.items()))
+        self.doc_names.append(str(doc_col) if name is None else name)
+        if len(self._buf_docs) >= self.flush_size:
+            self.flush()
+
+    def add_docs(self, docs: Iterable[Tuple[str, FeatureDocument]]) -> int:
+        """Add documents.
+
+        :param docs: tuples of document names and documents, or a stash such
+                     as :class:`~zensols.mednlp.docstore.MedicalDocumentStore`
+
+        :return: the number of documents added
+
+        """
+        n_docs: int = 0
+        name: str
+        doc: FeatureDocument
+        for name, doc in docs:
+            self.add(doc, name)
+            n_docs += 1
+        self.flush()
+        return n_docs
+
+    @property
+    def cui_doc(self) -> sp.csr_matrix:
+        """The mentions of each CUI (rows) in each document (columns)."""
+        self.flush()
+        return self._cui_doc
+
+    @property
+    def sent_cooc(self) -> sp.csr_matrix:
+        """The number of sentences in which each pair of CUIs occurs."""
+        self.flush()
+        return self._sent_cooc
+
+    @property
+    def doc_cooc(self) -> sp.csr_matrix:
+        """The number of documents in which each pair of CUIs occurs."""
+        self.flush()
+        return self._doc_cooc
+
+    @property
+    def n_docs(self) -> int:
+        """The number of documents added."""
+        return len(self.doc_names)
+
+    def merge(self, other: 'ConceptStatistics') -> 'ConceptStatistics':
+        """Add the counts of ``other`` (i.e. from another worker) to this
+        instance, which appends its documents.
+
+        :return: this instance
+
+        """
+        self.flush()
+        cui2idx: Dict[str, int] = self._cui2idx
+        cui: str
+        for cui in other.cuis:
+            if cui not in cui2idx:
+                cui2idx[cui] = len(self.cuis)
+                self.cuis.append(cui)
+        n_cuis: int = len(self.cuis)
+        n_docs: int = self.n_docs
+        remap = np.fromiter(map(lambda c: cui2idx[c], other.cuis),
+                            dtype=np.int64, count=len(other.cuis))
+
+        def map_mat(mat: sp.csr_matrix, n_cols: int, col_map: bool,
+                    col_offset: int = 0) -> sp.csr_matrix:
+            coo: sp.coo_matrix = mat.tocoo()
+            cols: np.ndarray = remap[coo.col] if col_map else \
+                coo.col + col_offset
+            return sp.csr_matrix((coo.data, (remap[coo.row], cols)),
+                                 shape=(n_cuis, n_cols), dtype=np.int64)
+
+        self._cui_doc = self._pad(
+            self._cui_doc, (n_cuis, n_docs + other.n_docs)) + \
+            map_mat(other.cui_doc, n_docs + other.n_docs, False, n_docs)
+        self._sent_cooc = self._pad(self._sent_cooc, (n_cuis, n_cuis)) + \
+            map_mat(other.sent_cooc, n_cuis, True)
+        self._doc_cooc = self._pad(self._doc_cooc, (n_cuis, n_cuis)) + \
+            map_mat(other.doc_cooc, n_cuis, True)
+        self.doc_names.extend(other.doc_names)
+        self.n_sents += other.n_sents
+        tui: str
+        cnt: int
+        for tui, cnt in other.tui_counts.items():
+            self.tui_counts[tui] = self.tui_counts.get(tui, 0) + cnt
+        return self
+
+    def _get_cooc(self, level: str) -> Tuple[sp.csr_matrix, int]:
+        """Return the co-occurrence matrix and number of units of ``level``.
+
+        """
+        if level not in self._LEVELS:
+            raise MedNLPError(f'Unknown co-occurrence level: {level}')
+        if level == 'sent':
+            return self.sent_cooc, self.n_sents
+        return self.doc_cooc, self.n_docs
+
+    def _get_index(self, cui: str) -> int:
+        idx: int = self._cui2idx.get(cui)
+        if idx is None:
+            raise MedNLPError(f'No such concept: {cui}')
+        return idx
+
+    def frequencies(self) -> pd.DataFrame:
+        """The mentions, and the number of sentences and documents with each
+        CUI in descending order of mentions.
+
+        """
+        df = pd.DataFrame({
+            'cui': self.cuis,
+            'count': np.asarray(self.cui_doc.sum(axis=1)).ravel(),
+            'sents': self.sent_cooc.diagonal(),
+            'docs': self.doc_cooc.diagonal()})
+        return df.sort_values(['count', 'cui'], ascending=[False, True]).\
+            reset_index(drop=True)
+
+    def top_cuis(self, k: int = 10) -> pd.DataFrame:
+        """Return the ``k`` most frequently mentioned CUIs."""
+        return self.frequencies().head(k)
+
+    def top_tuis(self, k: int = 10) -> pd.DataFrame:
+        """Return the ``k`` most frequently mentioned TUIs."""
+        df = pd.DataFrame(sorted(self.tui_counts.items(),
+                                 key=lambda t: (-t[1], t[0])),
+                          columns='tui count'.split())
+        return df.head(k)
+
+    def _measures(self, counts: np.ndarray, freq_a: np.ndarray,
+                  freq_b: np.ndarray, n_units: int) -> Dict[str, np.ndarray]:
+        lift: np.ndarray = (counts * n_units) / (freq_a * freq_b)
+        return {'count': counts, 'pmi': np.log(lift), 'lift': lift}
+
+    def lift(self, cui_a: str, cui_b: str, level: str = 'sent') -> float:
+        """Return the lift of two concepts, which is the ratio of their joint
+        probability to the product of their probabilities of occurring in a
+        sentence or document.
+
+        :param level: ``sent`` for sentences or ``doc`` for documents
+
+        """
+        cooc, n_units = self._get_cooc(level)
+        a: int = self._get_index(cui_a)
+        b: int = self._get_index(cui_b)
+        return float(cooc[a, b] * n_units / (cooc[a, a] * cooc[b, b]))
+
+    def pmi(self, cui_a: str, cui_b: str, level: str = 'sent') -> float:
+        """Return the pointwise mutual information of two concepts, which is
+        the log of :meth:`lift` and ``-inf`` if they never co-occur.
+
+        :param level: ``sent`` for sentences or ``doc`` for documents
+
+        """
+        with np.errstate(divide='ignore'):
+            return float(np.log(self.lift(cui_a, cui_b, level)))
+
+    def cooccurrences(self, cui: str, k: int = 10, level: str = 'sent',
+                      measure: str = 'count') -> pd.DataFrame:
+        """Return the ``k`` concepts that co-occur most with ``cui``.
+
+        :param level: ``sent`` for sentences or ``doc`` for documents
+
+        :param measure: the column to sort by: ``count``, ``pmi`` or ``lift``
+
+        """
+        cooc, n_units = self._get_cooc(level)
+        idx: int = self._get_index(cui)
+        row: sp.csr_matrix = cooc.getrow(idx)
+        mask: np.ndarray = row.indices != idx
+        cols: np.ndarray = row.indices[mask]
+        diag: np.ndarray = cooc.diagonal()
+        meas: Dict[str, np.ndarray] = self._measures(
+            row.data[mask], diag[idx], diag[cols], n_units)
+        df = pd.DataFrame({'cui': np.array(self.cuis, dtype=object)[cols],
+                           **meas})
+        return df.sort_values([measure, 'cui'], ascending=[False, True]).\
+            head(k).reset_index(drop=True)
+
+    def top_pairs(self, k: int = 10, level: str = 'sent',
+                  measure: str = 'pmi', min_count: int = 1) -> pd.DataFrame:
+        """Return the ``k`` pairs of concepts with the highest ``measure``.
+
+        :param level: ``sent`` for sentences or ``doc`` for documents
+
+        :param measure: the column to sort by: ``count``, ``pmi`` or ``lift``
+
+        :param min_count: the minimum co-occurrences of pairs to include,
+                          which filters rare pairs with high PMI
+
+        """
+        cooc, n_units = self._get_cooc(level)
+        upper: sp.coo_matrix = sp.triu(cooc, k=1).tocoo()
+        keep: np.ndarray = upper.data >= min_count
+        rows: np.ndarray = upper.row[keep]
+        cols: np.ndarray = upper.col[keep]
+        diag: np.ndarray = cooc.diagonal()
+        meas: Dict[str, np.ndarray] = self._measures(
+            upper.data[keep], diag[rows], diag[cols], n_units)
+        cuis = np.array(self.cuis, dtype=object)
+        df = pd.DataFrame({'cui_a': cuis[rows], 'cui_b': cuis[cols], **meas})
+        return df.sort_values(
+            [measure, 'cui_a', 'cui_b'], ascending=[False, True, True]).\
+            head(k).reset_index(drop=True)
+
+    def save(self, path: Path):
+        """Persist the statistics to directory ``path``."""
+        self.flush()
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / 'stats.json', 'w') as f:
+            json.dump({'cuis': self.cuis,
+                       'doc_names': self.doc_names,
+                       'tui_counts': self.tui_counts,
+                       'n_sents': self.n_sents}, f)
+        for name in 'cui_doc sent_cooc doc_cooc'.split():
+            sp.save_npz(path / f'{name}.npz', getattr(self, f'_{name}'))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'saved statistics of {self.n_docs} docs to {path}')
+
+    @classmethod
+    def load(cls, path: Path, **kwargs: Any) -> 'ConceptStatistics':
+        """Restore statistics persisted with :meth:`save`.
+
+        :param kwargs: the initializer arguments of the new instance
+
+        """
+        stats_file: Path = path / 'stats.json'
+        if not stats_file.is_file():
+            raise MedNLPError(f'No statistics saved in {path}')
+        stats = cls(**kwargs)
+        with open(stats_file) as f:
+            data: Dict[str, Any] = json.load(f)
+        stats.cuis = data['cuis']
+        stats.doc_names = data['doc_names']
+        stats.tui_counts = data['tui_counts']
+        stats.n_sents = data['n_sents']
+        stats._cui2idx = {c: i for i, c in enumerate(stats.cuis)}
+        for name in 'cui_doc sent_cooc doc_cooc'.split():
+            setattr(stats, f'_{name}',
+                    sp.load_npz(path / f'{name}.npz').tocsr())
+        return stats
@@ -3,7 +3,7 @@
 """
 __author__ = 'Paul Landes'
 
-from typing import Dict, Tuple, Optional, Union
+from typing import Dict, Tuple, Any, Optional, Union
 import logging
 from functools import reduce
 from frozendict import frozendict
@@ -11,7 +11,7 @@ from spacy.tokens.token import Token
 from spacy.tokens.span import Span
 from medcat.cdb import CDB
 from zensols.nlp import FeatureToken, SpacyFeatureToken
-from . import MedCatResource
+from . import MedCatResource, ConceptCodes
 from .domain import _MedicalEntity
 
 logger = logging.getLogger(__name__)
@@ -23,16 +23,18 @@ class MedicalFeatureToken(SpacyFeatureToken):
     """
     FEATURE_IDS_BY_TYPE = frozendict({
         'str': frozenset(('cui_ pref_name_ detected_name_ tuis_ ' +
-                          'definition_ tui_descs_').split()),
+                          'definition_ tui_descs_ status_').split()),
         'bool': frozenset('is_concept'.split()),
         'float': frozenset('context_similarity'.split()),
-        'int': frozenset('cui'.split()),
-        'list': frozenset('tuis sub_names'.split())})
+        'int': frozenset('cui cui_code tui_bits group_bits'.split()),
+        'list': frozenset('tuis groups sub_names'.split())})
     FEATURE_IDS = frozenset(
         reduce(lambda res, x: res | x, FEATURE_IDS_BY_TYPE.values()))
     WRITABLE_FEATURE_IDS = tuple(list(FeatureToken.WRITABLE_FEATURE_IDS) +
                                  'cui_'.split())
     _NONE_SET = frozenset()
+    _STATUS = 'Status'
+    """The MetaCAT meta annotation category of :obj:`status_`."""
 
     def __init__(self, spacy_token: Union[Token, Span], norm: str,
                  res: MedCatResource, ix2ent: Dict[int, _MedicalEntity]):
@@ -45,6 +47,12 @@ class MedicalFeatureToken(SpacyFeatureToken):
             med_ent = _MedicalEntity()
         self.med_ent = med_ent
         self.is_ent = med_ent.is_ent
+        self._cui: int = -1
+        self._cui_code: int = -1
+        if self.is_ent:
+            codes: ConceptCodes = res.concept_codes
+            self._cui = med_ent.cui
+            self._cui_code = codes.get_cui_code(med_ent.cui_)
 
     @property
     def ent_(self) -> str:
@@ -71,7 +79,27 @@ class MedicalFeatureToken(SpacyFeatureToken):
     @property
     def cui(self) -> int:
         """Returns the numeric part of the concept ID."""
-        return -1 if not self.is_concept else int(self.cui_[1:])
+        return self._cui
+
+    @property
+    def cui_code(self) -> int:
+        """The dense integer code of the concept in the CDB or -1 if not a
+        concept.
+
+        :see: :class:`.ConceptCodes`
+
+        """
+        return self._cui_code
+
+    @property
+    def tui_bits(self) -> int:
+        """The TUIs of the concept as a bitset of TUI codes, or 0 if not a
+        concept.
+
+        :see: :meth:`.ConceptCodes.get_tui_mask`
+
+        """
+        return self._res.concept_codes.get_tui_bits(self._cui_code)
 
     @property
     def pref_name_(self) -> str:
@@ -99,12 +127,31 @@ class MedicalFeatureToken(SpacyFeatureToken):
 
     @property
     def context_similarity(self) -> float:
-        """The similiarity of the concept."""
-        if self.is_concept:
+        """The similiarity of the concept, which is -1 when not a concept or
+        not disambiguated (see :obj:`.MedCatResource.disambiguate`).
+
+        """
+        if self.is_concept and self._res.disambiguate:
             return self.med_ent.concept_span._.context_similarity
         else:
             return -1
 
+    @property
+    def status_(self) -> str:
+        """The MetaCAT status of the concept (i.e. ``Affirmed`` or ``Other``),
+        which is only available when the MetaCAT model is loaded.
+
+        :see: :obj:`.MedCatResource.meta_cats_enabled`
+
+        """
+        status: str = None
+        if self.is_concept:
+            anns: Dict[str, Dict[str, Any]] = getattr(
+                self.med_ent.concept_span._, 'meta_anns', None)
+            if anns is not None and self._STATUS in anns:
+                status = anns[self._STATUS]['value']
+        return self.NONE if status is None else status
+
     @property
     def definition_(self) -> str:
         """The definition if the concept."""
@@ -118,8 +165,28 @@ class MedicalFeatureToken(SpacyFeatureToken):
     def tuis(self) -> Tuple[str, ...]:
         """The the CUI type of the concept."""
         if self.is_concept:
-            cui: str = self.cui_
-            return tuple(sorted(self._cdb.cui2type_ids.get(cui)))
+            return self._res.concept_codes.get_tuis(self.tui_bits)
+        else:
+            return self._NONE_SET
+
+    @property
+    def group_bits(self) -> int:
+        """The semantic groups of the concept's TUIs as a bitset of group
+        codes, or 0 if not a concept.
+
+        :see: :meth:`.SemanticGroups.get_group_mask`
+
+        """
+        return int(self._res.cui_group_bits[self._cui_code])
+
+    @property
+    def groups(self) -> Tuple[str, ...]:
+        """The semantic group abbreviations (i.e. ``DISO``) of the concept's
+        TUIs.
+
+        """
+        if self.is_concept:
+            return self._res.semantic_groups.get_groups(self.group_bits)
         else:
             return self._NONE_SET
 
@@ -128,7 +195,7 @@ class MedicalFeatureToken(SpacyFeatureToken):
         """All CUI TUIs (types) of the concept sorted as a comma delimited list.
 
         """
-        return ','.join(sorted(self.tuis))
+        return ','.join(self.tuis)
 
     @property
     def tui_descs_(self) -> str:
@@ -139,7 +206,7 @@ class MedicalFeatureToken(SpacyFeatureToken):
                 v = f'? ({k})'
             return v
 
-        return ', '.join(map(map_tui, sorted(self.tuis)))
+        return ', '.join(map(map_tui, self.tuis))
 
     def __str__(self):
         cui_str = f' ({self.cui_})' if self.is_concept else ''
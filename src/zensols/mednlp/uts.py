@@ -16,7 +16,7 @@ import requests
 from lxml.html import fromstring
 from lxml.etree import _Element as Element
 from zensols.persist import Stash
-from . import MedNLPError
+from . import MedNLPError, Metrics, stage_timer
 
 logger = logging.getLogger(__name__)
 
@@ -131,6 +131,11 @@ class UTSClient(object):
 
     request_stash: Stash = field(default=None)
 
+    metrics: Metrics = field(default=None)
+    """If set and enabled, records the wall time of remote requests and the
+    hit rate of :obj:`request_stash`.
+
+    """
     def _get_ticket(self) -> str:
         """Generate a new service ticket for each page if needed."""
         if logger.isEnabledFor(logging.INFO):
@@ -148,8 +153,9 @@ class UTSClient(object):
 
     def _request_remote(self, url: str, query: Dict[str, str],
                         expect: bool) -> Any:
-        query['ticket'] = self._get_ticket()
-        r = requests.get(url, params=query)
+        with stage_timer(self.metrics, 'uts.request'):
+            query['ticket'] = self._get_ticket()
+            r = requests.get(url, params=query)
         r.encoding = 'utf-8'
         items = self._parse_json(r.text)
         if isinstance(items, Exception):
@@ -180,6 +186,8 @@ class UTSClient(object):
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f'key: {key}')
         val = self.request_stash.load(key)
+        if self.metrics is not None:
+            self.metrics.cache('uts.cache', val is not None)
         if val is None:
             val = self._request_remote(url, query, expect)
             if val is None:
@@ -0,0 +1,49 @@
+from typing import Dict, Optional
+import tempfile
+from pathlib import Path
+from zensols.cli import CliHarness
+from zensols.config import ConfigFactory
+from zensols.mednlp import ApplicationFactory
+from zensols.mednlp.entlink import (
+    Entity, EntityLinkerResource, LinkedEntityCache
+)
+from util import TestBase
+
+
+class TestEntityLinking(TestBase):
+    def setUp(self):
+        super().setUp()
+        harness: CliHarness = ApplicationFactory.create_harness()
+        fac: ConfigFactory = harness.get_config_factory(
+            '--config test-resources/config/mednlp-add-linker.conf ' +
+            '--level=err')
+        self.resource: EntityLinkerResource = fac('entity_linker_resource')
+        self.path = Path(tempfile.mkdtemp()) / 'cache.db'
+
+    def test_linked_entities(self):
+        res: EntityLinkerResource = self.resource
+        cache = LinkedEntityCache(max_entries=2, path=self.path)
+        res.cache = cache
+        cuis = ('C0035078', 'C0018799', 'C9999999', 'C0035078', 'C0242379')
+        ents: Dict[str, Optional[Entity]] = res.get_linked_entities(cuis)
+        self.assertEqual(['C0035078', 'C0018799', 'C9999999', 'C0242379'],
+                         list(ents.keys()))
+        self.assertIsNone(ents['C9999999'])
+        kb_ent = res.linker.kb.cui_to_entity['C0035078']
+        self.assertEqual(kb_ent.canonical_name, ents['C0035078'].name)
+        self.assertEqual(kb_ent.types, ents['C0035078'].tuis)
+        # linked and unlinked concepts are all added, and those in memory are
+        # bounded
+        self.assertEqual(2, len(cache))
+        self.assertEqual(4, cache.conn.execute(
+            'select count(*) from entity').fetchone()[0])
+        self.assertEqual({'memory': 0., 'disk': 0.}, cache.hit_rates)
+        # a new cache reads all the entities from disk
+        cache.close()
+        cache = LinkedEntityCache(path=self.path)
+        res.cache = cache
+        self.assertEqual(ents, res.get_linked_entities(cuis))
+        self.assertEqual({'memory': 0., 'disk': 1.}, cache.hit_rates)
+        self.assertEqual(ents['C0018799'], res.get_linked_entity('C0018799'))
+        self.assertEqual(1., cache.hit_rates['disk'])
+        cache.clear()
@@ -0,0 +1,32 @@
+from typing import Dict, Tuple, Any
+from zensols.config import ConfigFactory
+from zensols.cli import CliHarness
+from zensols.mednlp import ApplicationFactory
+from zensols.mednlp.bench import SyntheticCorpus, ParserBenchmark
+from util import TestBase
+
+
+class TestBenchmark(TestBase):
+    def test_corpus(self):
+        corpus = SyntheticCorpus(scale=0.1)
+        notes: Dict[str, Tuple[str, ...]] = corpus()
+        self.assertEqual(notes, corpus())
+        self.assertEqual({'short': 4, 'medium': 2, 'long': 1},
+                         {k: len(v) for k, v in notes.items()})
+        self.assertNotEqual(notes, SyntheticCorpus(seed=1, scale=0.1)())
+        self.assertTrue(len(notes['long'][0]) > len(notes['short'][0]))
+
+    def test_benchmark(self):
+        harness: CliHarness = ApplicationFactory.create_harness()
+        fac: ConfigFactory = harness.get_config_factory(
+            '--config test-resources/config/default.conf --level=err')
+        bench: ParserBenchmark = fac('mednlp_benchmark')
+        bench.corpus.scale = 0.05
+        res: Dict[str, Any] = bench.benchmark(['doc_parser'])
+        stats: Dict[str, Any] = res['parsers']['doc_parser']
+        self.assertEqual({'short', 'medium', 'long', 'peak_rss'},
+                         set(stats.keys()))
+        for size in 'short medium long'.split():
+            self.assertEqual(res['sizes'][size], stats[size]['docs'])
+            self.assertTrue(stats[size]['tokens_per_sec'] > 0)
+            self.assertTrue(stats[size]['p99_ms'] >= stats[size]['p50_ms'])
@@ -0,0 +1,60 @@
+import numpy as np
+from zensols.nlp import FeatureDocument, FeatureDocumentParser
+from zensols.mednlp import (
+    MedNLPError, MedCatResource, ConceptCodes, SemanticGroups
+)
+from util import TestBase
+
+
+class TestConceptCodes(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.parser: FeatureDocumentParser = self._get_doc_parser()
+        res: MedCatResource = self.parser.medcat_resource
+        self.codes: ConceptCodes = res.concept_codes
+
+    def test_token_codes(self):
+        codes: ConceptCodes = self.codes
+        doc: FeatureDocument = self.parser(self.text_1)
+        tok = doc.tokens[4]
+        self.assertEqual('C0035078', tok.cui_)
+        self.assertEqual(35078, tok.cui)
+        self.assertEqual(tok.cui_, codes.cuis[tok.cui_code])
+        self.assertEqual(tok.tuis, codes.get_tuis(tok.tui_bits))
+        self.assertEqual(','.join(tok.tuis), tok.tuis_)
+        self.assertNotEqual(0, tok.tui_bits & codes.get_tui_mask(tok.tuis))
+        self.assertEqual(0, tok.tui_bits & codes.get_tui_mask(('T999',)))
+        tok = doc.tokens[0]
+        self.assertEqual(-1, tok.cui_code)
+        self.assertEqual(0, tok.tui_bits)
+        self.assertEqual((), tuple(tok.tuis))
+
+    def test_has_tuis(self):
+        codes: ConceptCodes = self.codes
+        doc: FeatureDocument = self.parser(self.text_1)
+        cui_codes = np.array(tuple(map(lambda t: t.cui_code,
+                                       doc.token_iter())))
+        tuis = doc.tokens[4].tuis
+        should = tuple(map(lambda t: len(set(t.tuis) & set(tuis)) > 0,
+                           doc.token_iter()))
+        self.assertEqual(should, tuple(codes.has_tuis(cui_codes, tuis)))
+        self.assertFalse(codes.has_tuis(cui_codes, ()).any())
+        with self.assertRaises(MedNLPError):
+            codes.has_tuis(np.array((len(codes),)), tuis)
+
+    def test_groups(self):
+        res: MedCatResource = self.parser.medcat_resource
+        sgroups: SemanticGroups = res.semantic_groups
+        self.assertEqual(('DISO',), sgroups.match(['Disorders']))
+        # TUIs are in the order of the groups file
+        df = res.groups
+        self.assertEqual(tuple(df[df['abbrev'].isin(('ANAT', 'DISO'))]['tui']),
+                         sgroups.get_tuis(('DISO', 'ANAT', 'NONE')))
+        doc: FeatureDocument = self.parser(self.text_1)
+        tok = doc.tokens[4]
+        self.assertTrue('DISO' in tok.groups)
+        self.assertEqual(tok.groups, sgroups.get_groups(tok.group_bits))
+        self.assertEqual(0, doc.tokens[0].group_bits)
+        cuis = tuple(map(lambda t: t.cui_, doc.token_iter()))
+        should = tuple(map(lambda t: 'DISO' in t.groups, doc.token_iter()))
+        self.assertEqual(should, tuple(res.has_groups(cuis, ('DISO',))))
@@ -11,13 +11,14 @@ class TestCombinedParsers(TestBase):
 
     def _compare_sents(self, parser_name: str, idx: int, write: bool,
                        sent: str, attrs: List[str], missing: Set[str],
-                       config: str = 'combined'):
+                       config: str = 'combined', should_name: str = None):
         def map_tok_features(t: FeatureToken) -> Dict[str, Any]:
             # sort keys to make diffing easier
             dct = t.asdict()
             return OrderedDict(sorted(dct.items(), key=lambda t: t[0]))
 
-        actual_file: str = f'test-resources/should/{parser_name}-{idx}.json'
+        should_name = parser_name if should_name is None else should_name
+        actual_file: str = f'test-resources/should/{should_name}-{idx}.json'
         p: FeatureDocumentParser = self._get_doc_parser(config, parser_name)
         doc: FeatureDocument = p(sent)
 
@@ -51,11 +52,13 @@ class TestCombinedParsers(TestBase):
                                      f'expected missing {attr} in {tok}')
 
     def _compare(self, parser_name: str, write: bool = False,
-                 attrs: List[str] = None, missing: Set[str] = None):
+                 attrs: List[str] = None, missing: Set[str] = None,
+                 should_name: str = None):
         attrs = TestCombinedParsers._DEFAULT_ATTRS if attrs is None else attrs
         for i in range(2):
             sent: str = getattr(self, f'text_{i + 1}')
-            self._compare_sents(parser_name, i, write, sent, attrs, missing)
+            self._compare_sents(parser_name, i, write, sent, attrs, missing,
+                                should_name=should_name)
 
     def test_default(self):
         self._compare('doc_parser', missing='cui_'.split())
@@ -78,3 +81,8 @@ class TestCombinedParsers(TestBase):
     def test_medcat_biomded_combined(self):
         self._compare('mednlp_combine_biomed_medcat_doc_parser',
                       attrs=self._DEFAULT_ATTRS + 'cui_ tuis_'.split())
+
+    def test_shared_medcat_biomded_combined(self):
+        self._compare('mednlp_combine_shared_biomed_medcat_doc_parser',
+                      attrs=self._DEFAULT_ATTRS + 'cui_ tuis_'.split(),
+                      should_name='mednlp_combine_biomed_medcat_doc_parser')
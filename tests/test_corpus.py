@@ -0,0 +1,85 @@
+import json
+import tempfile
+from pathlib import Path
+import pandas as pd
+from zensols.nlp import FeatureDocumentParser
+from zensols.mednlp import MedNLPError
+from zensols.mednlp.corpus import CorpusReader, CorpusProcessor
+from util import TestBase
+
+
+class TestCorpus(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.parser: FeatureDocumentParser = self._get_doc_parser()
+        self.dir = Path(tempfile.mkdtemp())
+        notes = (self.text_1, self.text_2, 'He has kidney failure.')
+        with open(self.dir / 'notes.jsonl', 'w') as f:
+            for i, text in enumerate(notes):
+                f.write(json.dumps({'id': f'n{i}', 'text': text}) + '\n')
+        self.reader = CorpusReader(str(self.dir / 'notes.jsonl'))
+
+    def _process(self, out: Path) -> CorpusProcessor:
+        return CorpusProcessor(self.parser, out, batch_size=2)
+
+    def test_resume(self):
+        out: Path = self.dir / 'out'
+        proc: CorpusProcessor = self._process(out)
+        self.assertEqual(3, proc(self.reader))
+        with open(proc.checkpoint_path) as f:
+            self.assertEqual(3, json.load(f)['docs'])
+        # nothing is left to process
+        self.assertEqual(0, proc(self.reader))
+        df = pd.read_csv(out / 'features.csv')
+        self.assertEqual(['n0', 'n1', 'n2'], df['id'].unique().tolist())
+        with open(out / 'entities.jsonl') as f:
+            ents = list(map(json.loads, f))
+        self.assertEqual(3, len(ents))
+        self.assertTrue('C0035078' in map(lambda e: e['cui'],
+                                          ents[2]['entities']))
+        # a killed job with a partial write after the first checkpoint
+        with open(proc.checkpoint_path) as f:
+            ckpt = json.load(f)
+        part: Path = self.dir / 'part'
+        proc = self._process(part)
+        self.assertEqual(2, proc(_Head(self.reader, 2)))
+        with open(part / 'entities.jsonl', 'a') as f:
+            f.write('{"id": "partial')
+        self.assertEqual(1, proc(self.reader))
+        for name in ckpt['offsets'].keys():
+            path: str = CorpusProcessor._FILES[name]
+            self.assertEqual((out / path).read_text(),
+                             (part / path).read_text())
+
+    def test_outputs(self):
+        out: Path = self.dir / 'out'
+        proc: CorpusProcessor = self._process(out)
+        self.assertEqual(3, proc(self.reader))
+        # new outputs would be missing the notes already processed
+        proc.outputs = {'features'}
+        with self.assertRaisesRegex(MedNLPError, r'^Outputs .* differ'):
+            proc(self.reader)
+        proc.outputs = {'entities', 'features'}
+        self.assertEqual(0, proc(self.reader))
+
+    def test_len(self):
+        self.assertEqual(3, len(self.reader))
+        notes: Path = self.dir / 'notes'
+        notes.mkdir()
+        for i in range(4):
+            (notes / f'{i}.txt').write_text(self.text_1)
+        self.assertEqual(4, len(CorpusReader(str(notes))))
+        self.assertEqual(4, len(CorpusReader(str(notes / '*.txt'))))
+        self.assertEqual(4, len(tuple(CorpusReader(str(notes)))))
+
+
+class _Head(object):
+    def __init__(self, reader: CorpusReader, n: int):
+        self.reader = reader
+        self.n = n
+
+    def __iter__(self):
+        return iter(list(self.reader)[:self.n])
+
+    def __len__(self) -> int:
+        return self.n
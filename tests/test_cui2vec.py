@@ -0,0 +1,316 @@
+from typing import Tuple, List, Dict
+import shutil
+import csv
+from pathlib import Path
+import numpy as np
+import torch
+from zensols.cli import CliHarness
+from zensols.config import ConfigFactory
+from zensols.nlp import FeatureDocument, FeatureDocumentParser
+from zensols.deeplearn.vectorize import TensorFeatureContext
+from zensols.deepnlp.vectorize import WordVectorEmbeddingFeatureVectorizer
+from zensols.mednlp import (
+    ApplicationFactory, MedCatResource, ConceptCodes, MedicalLibrary
+)
+from zensols.mednlp.cui2vec import (
+    Cui2VecEmbedModel, Cui2VecSequenceStore, Cui2VecIndexedDocument,
+    ConceptEmbeddingStore
+)
+from util import TestBase
+
+
+class Cui2VecTestBase(TestBase):
+    """Creates a small cui2vec embedding of the concepts of parsed documents.
+    The first concept (by CUI) of the documents is left out of the embedding
+    and a concept with a zero vector is added.
+
+    """
+    DIMENSION = 4
+    ZERO_CUI = 'C9999999'
+
+    def setUp(self):
+        super().setUp()
+        harness: CliHarness = ApplicationFactory.create_harness()
+        self.fac: ConfigFactory = harness.get_config_factory(
+            '--config test-resources/config/cui2vec.conf --level=err')
+        self.parser: FeatureDocumentParser = self.fac(
+            'mednlp_medcat_doc_parser')
+        self.docs: Tuple[FeatureDocument, ...] = tuple(map(
+            self.parser, (self.text_1, self.text_2,
+                          'The patient has heart disease and lung cancer.')))
+        self.embed_model: Cui2VecEmbedModel = self.fac('cui2vec_500_embedding')
+        self.temp_dir: Path = self.embed_model.path.parent
+        if self.temp_dir.exists():
+            shutil.rmtree(self.temp_dir)
+        self.temp_dir.mkdir(parents=True)
+        cuis: List[str] = sorted(set(map(
+            lambda t: t.cui_, filter(lambda t: t.is_concept,
+                                     self._tokens()))))
+        self.assertTrue(len(cuis) > 3)
+        self.missing_cui: str = cuis[0]
+        self.cuis: List[str] = cuis[1:] + [self.ZERO_CUI]
+        rand = np.random.RandomState(0)
+        vecs: np.ndarray = rand.uniform(
+            -1, 1, (len(self.cuis), self.DIMENSION))
+        vecs[-1] = 0
+        with open(self.embed_model.path, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow([''] + list(map(
+                lambda i: f'V{i + 1}', range(self.DIMENSION))))
+            for cui, vec in zip(self.cuis, vecs):
+                writer.writerow([cui] + list(map(repr, vec.tolist())))
+        self.embed_model.vocab_size = len(self.cuis)
+
+    def _tokens(self):
+        for doc in self.docs:
+            yield from doc.token_iter()
+
+    def _doc_rows(self, doc: FeatureDocument) -> np.ndarray:
+        """Return the embedding rows of the embedded concepts of ``doc``."""
+        emodel: Cui2VecEmbedModel = self.embed_model
+        return np.array(tuple(filter(
+            lambda r: r is not None,
+            map(lambda t: emodel.word2idx(t.cui_),
+                filter(lambda t: t.is_concept, doc.token_iter())))),
+            dtype=np.int64)
+
+
+class TestCui2VecIndex(Cui2VecTestBase):
+    def test_code_rows(self):
+        emodel: Cui2VecEmbedModel = self.embed_model
+        res: MedCatResource = self.fac('medcat_resource')
+        codes: ConceptCodes = res.concept_codes
+        rows: np.ndarray = emodel.get_code_rows(codes)
+        self.assertEqual(len(codes) + 1, len(rows))
+        self.assertEqual(emodel.unk_idx, rows[-1])
+        self.assertEqual(emodel.word2idx(self.cuis[0]),
+                         rows[codes.get_cui_code(self.cuis[0])])
+        self.assertEqual(emodel.unk_idx,
+                         rows[codes.get_cui_code(self.missing_cui)])
+
+    def test_encode(self):
+        emodel: Cui2VecEmbedModel = self.embed_model
+        parser: FeatureDocumentParser = self.fac('mednlp_cui2vec_doc_parser')
+        vec = self.fac('cui2vec_500_feature_vectorizer')
+        vec.sequence_store = None
+        token_length: int
+        for token_length in (-1, 3):
+            vec.manager.token_length = token_length
+            text: str
+            for text in (self.text_1, self.text_2):
+                doc: FeatureDocument = parser(text)
+                self.assertEqual(
+                    tuple(map(lambda t: emodel.word2idx_or_unk(t.cui_),
+                              doc.token_iter())),
+                    tuple(map(lambda t: t.cui2vec_idx, doc.token_iter())))
+                should: TensorFeatureContext = \
+                    WordVectorEmbeddingFeatureVectorizer._encode(vec, doc)
+                # with and without the index features of the decorator
+                for doc in (doc, self.parser(text)):
+                    ctx: TensorFeatureContext = vec._encode(doc)
+                    self.assertTrue(torch.equal(should.tensor, ctx.tensor))
+
+
+class TestCui2VecSimilarity(Cui2VecTestBase):
+    def test_most_similar(self):
+        emodel: Cui2VecEmbedModel = self.embed_model
+        topn: int = 3
+        zeros: Tuple[str, ...] = (self.ZERO_CUI, emodel.UNKNOWN)
+        sims: Tuple[Tuple[Tuple[str, float], ...], ...] = \
+            emodel.most_similar(self.cuis, topn, batch_size=2)
+        self.assertEqual(len(self.cuis), len(sims))
+        cui: str
+        cui_sims: Tuple[Tuple[str, float], ...]
+        for cui, cui_sims in zip(self.cuis, sims):
+            if cui == self.ZERO_CUI:
+                self.assertEqual((), cui_sims)
+                continue
+            # zero vectors have no (NaN) similarity in gensim
+            should: List[Tuple[str, float]] = list(filter(
+                lambda t: t[0] not in zeros,
+                emodel.keyed_vectors.similar_by_word(cui, len(emodel.matrix))))
+            self.assertEqual(topn, len(cui_sims))
+            self.assertEqual(tuple(map(lambda t: t[0], should[:topn])),
+                             tuple(map(lambda t: t[0], cui_sims)))
+            self.assertTrue(np.allclose(
+                tuple(map(lambda t: t[1], should[:topn])),
+                tuple(map(lambda t: t[1], cui_sims)), atol=1e-5))
+            self.assertFalse(cui in map(lambda t: t[0], cui_sims))
+        self.assertEqual(((), ()), emodel.most_similar(
+            (self.missing_cui, 'C0000000'), topn))
+
+    def test_similarity_by_terms(self):
+        emodel: Cui2VecEmbedModel = self.embed_model
+        res: MedCatResource = self.fac('medcat_resource')
+        lib = MedicalLibrary(config_factory=self.fac, medcat_resource=res)
+        cui: str = 'C0035078'
+        self.assertTrue(cui in emodel)
+        terms: Tuple[str, ...] = (
+            'kidney failure', 'Kidney Failure', 'kidney-failure', 'qwertyuiop')
+        sims = lib.similarity_by_terms(terms, topn=2)
+        self.assertEqual(terms, tuple(sims.keys()))
+        self.assertEqual([], sims['qwertyuiop'])
+        should: Tuple[Tuple[str, float], ...] = \
+            emodel.most_similar((cui,), 2)[0]
+        term: str
+        for term in terms[:-1]:
+            self.assertEqual(len(should), len(sims[term]))
+            for (rel_cui, sim), ent in zip(should, sims[term]):
+                self.assertEqual(rel_cui, ent.cui)
+                self.assertEqual(sim, ent.similiarty)
+                # concepts are named by the CDB without the linker
+                self.assertEqual(
+                    res.cat.cdb.cui2preferred_name.get(rel_cui, rel_cui),
+                    ent.name)
+        self.assertEqual(should, tuple(map(
+            lambda e: (e.cui, e.similiarty),
+            lib.similarity_by_term('kidney failure', 2))))
+
+
+class TestConceptEmbeddingStore(Cui2VecTestBase):
+    def _store(self, name: str, batch_size: int = 256) -> \
+            ConceptEmbeddingStore:
+        return ConceptEmbeddingStore(self.embed_model, self.temp_dir / name,
+                                     batch_size=batch_size)
+
+    def _named_docs(self) -> Tuple[Tuple[str, FeatureDocument], ...]:
+        return tuple(map(lambda t: (f'doc{t[0]}', t[1]),
+                         enumerate(self.docs)))
+
+    def test_add_get(self):
+        matrix: np.ndarray = self.embed_model.matrix
+        store = self._store('add')
+        self.assertEqual(3, store.add(self._named_docs()))
+        self.assertEqual(3, len(store))
+        self.assertEqual(('doc0', 'doc1', 'doc2'), store.names)
+        self.assertIsNone(store.get('nada'))
+        name: str
+        doc: FeatureDocument
+        for name, doc in self._named_docs():
+            rows: np.ndarray = self._doc_rows(doc)
+            self.assertTrue(len(rows) > 0)
+            self.assertTrue(np.allclose(
+                matrix[rows].mean(axis=0), store.get(name), atol=1e-6))
+            self.assertTrue(np.allclose(
+                matrix[rows].max(axis=0), store.get(name, 'max'), atol=1e-6))
+        # the documents are not pooled again
+        self.assertEqual(0, store.add(self._named_docs()))
+        store.clear()
+        self.assertEqual(0, len(store))
+
+    def test_duplicates(self):
+        store = self._store('dup', batch_size=1)
+        docs = (('a', self.docs[0]), ('b', self.docs[1]), ('a', self.docs[1]))
+        self.assertEqual(2, store.add(docs))
+        self.assertEqual(('a', 'b'), store.names)
+        rows: np.ndarray = self._doc_rows(self.docs[0])
+        self.assertTrue(np.allclose(
+            self.embed_model.matrix[rows].mean(axis=0), store.get('a'),
+            atol=1e-6))
+        self.assertEqual(0, store.add((('b', self.docs[2]),)))
+        self.assertEqual(2, len(store))
+
+    def test_resume(self):
+        docs = self._named_docs()
+        should = self._store('should', batch_size=1)
+        should.add(docs)
+        store = self._store('resume', batch_size=1)
+        self.assertEqual(1, store.add(docs[:1]))
+        # an interrupted batch leaves rows and document frequencies that are
+        # not in the metadata
+        row_bytes: int = self.DIMENSION * np.dtype(np.float32).itemsize
+        for pooling in store.poolings:
+            with open(store.path / f'{pooling}.dat', 'ab') as f:
+                f.write(b'\xff' * row_bytes)
+        np.save(store._get_doc_freqs_path(2),
+                np.full(self.embed_model.matrix.shape[0], 99))
+        store = self._store('resume', batch_size=1)
+        self.assertEqual(1, len(store))
+        self.assertEqual(2, store.add(docs))
+        self.assertEqual(should.names, store.names)
+        pooling: str
+        for pooling in store.poolings:
+            self.assertTrue(np.array_equal(
+                should.matrices[pooling], store.matrices[pooling]))
+        self.assertEqual(['doc-freqs-3.npy'], sorted(map(
+            lambda p: p.name, store.path.glob('doc-freqs-*'))))
+
+    def test_tfidf(self):
+        matrix: np.ndarray = self.embed_model.matrix
+        store = self._store('tfidf')
+        docs = self._named_docs()
+        store.add(docs)
+        doc_rows: Tuple[np.ndarray, ...] = tuple(map(
+            lambda t: self._doc_rows(t[1]), docs))
+        doc_freqs: Dict[int, int] = {}
+        rows: np.ndarray
+        for rows in doc_rows:
+            for row in set(rows.tolist()):
+                doc_freqs[row] = doc_freqs.get(row, 0) + 1
+        n_docs: int = len(docs)
+        for (name, _), rows in zip(docs, doc_rows):
+            weights = np.array(tuple(map(
+                lambda r: np.log((1 + n_docs) / (1 + doc_freqs[r])) + 1,
+                rows.tolist())))
+            should: np.ndarray = (matrix[rows] * weights[:, None]).sum(
+                axis=0) / weights.sum()
+            self.assertTrue(np.allclose(
+                should, store.get(name, 'tfidf'), atol=1e-6))
+
+
+class TestCui2VecSequence(Cui2VecTestBase):
+    def _assert_stored(self, store: Cui2VecSequenceStore,
+                       doc: FeatureDocument):
+        emodel: Cui2VecEmbedModel = self.embed_model
+        idxs, lens = store.get(doc)
+        self.assertEqual(tuple(map(lambda t: emodel.word2idx_or_unk(t.cui_),
+                                   doc.token_iter())),
+                         tuple(idxs.tolist()))
+        self.assertEqual(tuple(map(lambda s: s.token_len, doc.sents)),
+                         tuple(lens.tolist()))
+
+    def test_store(self):
+        store: Cui2VecSequenceStore = self.fac('cui2vec_sequence_store')
+        self.assertEqual(3, store.add(self.docs + self.docs[:1]))
+        self.assertEqual(3, len(store))
+        self.assertEqual(0, store.add(self.docs))
+        doc: FeatureDocument
+        for doc in self.docs:
+            self._assert_stored(store, doc)
+        new_doc: FeatureDocument = self.parser('The patient had a fever.')
+        self.assertIsNone(store.get(new_doc))
+        # an interrupted batch leaves keys and indexes not in the metadata
+        with open(store._get_keys_path('keys'), 'a') as f:
+            f.write('"interrupted"\n')
+        with open(store.path / 'indexes.dat', 'ab') as f:
+            f.write(np.ones(5, dtype=np.int32).tobytes())
+        store = Cui2VecSequenceStore(self.embed_model, store.path)
+        self.assertEqual(3, len(store))
+        self.assertEqual(1, store.add((new_doc,)))
+        for doc in self.docs + (new_doc,):
+            self._assert_stored(store, doc)
+        store.clear()
+        self.assertEqual(0, len(store))
+
+    def test_pad(self):
+        arr: np.ndarray = Cui2VecSequenceStore.pad(
+            np.arange(1, 7), np.array((2, 0, 4)), 3, -1)
+        self.assertEqual(((1, 2, -1), (-1, -1, -1), (3, 4, 5)),
+                         tuple(map(tuple, arr.tolist())))
+
+    def test_vectorizer(self):
+        vec = self.fac('cui2vec_500_feature_vectorizer')
+        store: Cui2VecSequenceStore = vec.sequence_store
+        store.add(self.docs)
+        fold_method: str
+        for fold_method in ('concat_tokens', 'sentence'):
+            vec.fold_method = fold_method
+            vec.sequence_store = store
+            self.assertIsInstance(vec._combine_documents(self.docs),
+                                  Cui2VecIndexedDocument)
+            ctx: TensorFeatureContext = vec.encode(self.docs)
+            # encoded by the super class
+            vec.sequence_store = None
+            should: TensorFeatureContext = vec.encode(self.docs)
+            self.assertEqual(should.tensor.shape, ctx.tensor.shape)
+            self.assertTrue(torch.equal(should.tensor, ctx.tensor))
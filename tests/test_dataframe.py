@@ -0,0 +1,53 @@
+from typing import Set
+import pandas as pd
+from zensols.nlp import FeatureDocument, FeatureDocumentParser
+from zensols.nlp.dataframe import FeatureDataFrameFactory
+from zensols.mednlp import MedCatResource
+from zensols.mednlp.dataframe import MedicalDataFrameFactory
+from util import TestBase
+
+
+class TestMedicalDataFrame(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.parser: FeatureDocumentParser = self._get_doc_parser()
+        res: MedCatResource = self.parser.medcat_resource
+        needs = ('norm', 'cui_', 'is_concept')
+        self.fids: Set[str] = set(self.parser.token_feature_ids) | set(needs)
+        self.should_fac = FeatureDataFrameFactory(self.fids, needs)
+        self.df_fac = MedicalDataFrameFactory(self.fids, needs, resource=res)
+
+    def test_features(self):
+        text: str
+        for text in (self.text_1, self.text_2):
+            doc: FeatureDocument = self.parser(text)
+            should: pd.DataFrame = self.should_fac(doc)
+            df: pd.DataFrame = self.df_fac(doc)
+            self.assertEqual(tuple(should.columns), tuple(df.columns))
+            self.assertTrue(should.astype(str).equals(df.astype(str)))
+            # spans are formatted as dictionaries like the super class
+            self.assertEqual(doc.tokens[0].asdict()['lexspan'],
+                             df.iloc[0]['lexspan'])
+
+    def test_parse_features(self):
+        doc: FeatureDocument = self.parser(self.text_1)
+        should: pd.DataFrame = self.should_fac(doc)
+        self.parser.token_feature_ids = self.df_fac.parse_feature_ids
+        doc = self.parser(self.text_1)
+        self.assertFalse(hasattr(doc.tokens[4], 'pref_name_'))
+        df: pd.DataFrame = self.df_fac(doc)
+        self.assertTrue(should.astype(str).equals(df.astype(str)))
+        self.assertEqual('Kidney Failure', df.iloc[4]['pref_name_'])
+
+    def test_entities(self):
+        doc: FeatureDocument = self.parser(self.text_1)
+        df: pd.DataFrame = self.df_fac.entities(doc)
+        cuis = tuple(map(lambda e: e.tokens[0].cui_, filter(
+            lambda e: e.tokens[0].is_concept, doc.entities)))
+        self.assertEqual(cuis, tuple(df['cui_']))
+        row = df.iloc[0]
+        self.assertEqual('kidney failure', row['text'])
+        self.assertEqual('kidney failure',
+                         self.text_1[row['begin']:row['end']])
+        self.assertEqual('Kidney Failure', row['pref_name_'])
+        self.assertEqual(doc.tokens[4].tuis, row['tuis'])
@@ -0,0 +1,60 @@
+from typing import Tuple, Dict
+import shutil
+import numpy as np
+from zensols.nlp import FeatureToken, FeatureDocument, FeatureDocumentParser
+from zensols.mednlp import MedNLPError
+from zensols.mednlp.docstore import MedicalDocumentStore
+from util import TestBase
+
+
+class TestDocumentStore(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.store: MedicalDocumentStore = self._get_doc_parser(
+            'docstore', 'mednlp_document_store')
+        parser: FeatureDocumentParser = self._get_doc_parser(
+            'docstore', 'mednlp_medcat_doc_parser')
+        self.docs: Dict[str, FeatureDocument] = {
+            't1': parser(self.text_1), 't2': parser(self.text_2)}
+        self.assertEqual(2, self.store.write(self.docs.items()))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.store.path, ignore_errors=True)
+
+    def _features(self, doc: FeatureDocument) -> Tuple[Tuple, ...]:
+        return tuple(map(lambda t: (t.i, t.i_sent, t.norm, t.text, t.cui_,
+                                    t.tuis_, t.lexspan.astuple),
+                         doc.token_iter()))
+
+    def test_round_trip(self):
+        store: MedicalDocumentStore = self.store
+        self.assertEqual(2, len(store))
+        self.assertEqual({'t1', 't2'}, set(store.keys()))
+        self.assertFalse(store.exists('t3'))
+        self.assertEqual(None, store.load('t3'))
+        name: str
+        should: FeatureDocument
+        for name, should in self.docs.items():
+            doc: FeatureDocument = store[name]
+            self.assertEqual(should.text, doc.text)
+            self.assertEqual(len(should.sents), len(doc.sents))
+            self.assertEqual(self._features(should), self._features(doc))
+        # loaded tokens are detached with the stored features, so clones keep
+        # them
+        tok: FeatureToken = store['t1'].tokens[4]
+        self.assertTrue(tok.is_detached)
+        self.assertEqual(set(tok.__dict__.keys()) - {'_detached_feature_ids'},
+                         tok.default_detached_feature_ids)
+        self.assertEqual(tok.cui_, tok.clone().cui_)
+
+    def test_columns(self):
+        cols: Dict[str, np.ndarray] = self.store.columns('t1')
+        doc: FeatureDocument = self.docs['t1']
+        self.assertEqual(doc.token_len, len(cols['cui']))
+        self.assertEqual(35078, cols['cui'][4])
+        self.assertEqual(-1, cols['cui'][0])
+        self.assertEqual(doc.tokens[4].tuis,
+                         self.store.get_tuis(cols['tuis'][4]))
+        with self.assertRaises(MedNLPError):
+            self.store.columns('t3')
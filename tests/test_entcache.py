@@ -0,0 +1,74 @@
+import tempfile
+from pathlib import Path
+from zensols.mednlp.entlink import Entity, LinkedEntityCache
+from util import TestBase
+
+
+class TestLinkedEntityCache(TestBase):
+    def _entity(self, cui: str) -> Entity:
+        return Entity(name=f'name {cui}', cui=cui, definition='a definition',
+                      aliases=('alias',), tuis=('T047',))
+
+    def test_levels(self):
+        path = Path(tempfile.mkdtemp()) / 'cache.db'
+        cache = LinkedEntityCache(max_entries=3, path=path,
+                                  disk_max_entries=5)
+        self.assertIs(LinkedEntityCache.MISSING, cache.get('C0'))
+        for i in range(8):
+            cui: str = f'C{i}'
+            cache.put(cui, None if i == 4 else self._entity(cui))
+        self.assertEqual(3, len(cache))
+        # unlinked CUIs are cached
+        self.assertIsNone(cache.get('C4'))
+        self.assertEqual(self._entity('C3'), cache.get('C3'))
+        # evicted from both levels
+        self.assertIs(LinkedEntityCache.MISSING, cache.get('C0'))
+        self.assertEqual({'memory': 0., 'disk': 0.5}, cache.hit_rates)
+        # the disk level is kept across instances
+        cache.close()
+        cache = LinkedEntityCache(path=path)
+        self.assertEqual(self._entity('C7'), cache.get('C7'))
+        cache.clear()
+        self.assertFalse(path.exists())
+
+    def test_bytes(self):
+        cache = LinkedEntityCache(max_bytes=500)
+        for i in range(10):
+            cache.put(f'C{i}', self._entity(f'C{i}'))
+        self.assertTrue(0 < len(cache) < 10)
+        self.assertEqual(self._entity('C9'), cache.get('C9'))
+
+    def test_overwrite(self):
+        path = Path(tempfile.mkdtemp()) / 'cache.db'
+        cache = LinkedEntityCache(max_bytes=500, path=path,
+                                  disk_max_entries=3)
+        for _ in range(10):
+            cache.put('C0', self._entity('C0'))
+        # the size of a replaced entity is not counted again
+        self.assertEqual(cache._entries['C0'][1], cache._bytes)
+        for i in range(1, 5):
+            cache.put(f'C{i}', self._entity(f'C{i}'))
+        n, size = cache.conn.execute(
+            'select n, size from entity_total').fetchone()
+        self.assertEqual(3, n)
+        self.assertEqual(cache.conn.execute(
+            'select sum(size) from entity').fetchone()[0], size)
+        self.assertEqual(['C2', 'C3', 'C4'], list(map(
+            lambda r: r[0], cache.conn.execute(
+                'select cui from entity order by id'))))
+        cache.clear()
+
+    def test_kb_key(self):
+        path = Path(tempfile.mkdtemp()) / 'cache.db'
+        cache = LinkedEntityCache(path=path, kb_key='kb-1')
+        cache.put('C0', self._entity('C0'))
+        cache.close()
+        cache = LinkedEntityCache(path=path, kb_key='kb-1')
+        self.assertEqual(self._entity('C0'), cache.get('C0'))
+        cache.close()
+        # entities of another knowledge base are not used
+        cache = LinkedEntityCache(path=path, kb_key='kb-2')
+        self.assertIs(LinkedEntityCache.MISSING, cache.get('C0'))
+        self.assertEqual((0, 0), cache.conn.execute(
+            'select n, size from entity_total').fetchone())
+        cache.clear()
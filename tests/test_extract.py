@@ -0,0 +1,57 @@
+from typing import Tuple, Set
+from zensols.nlp import FeatureDocument, FeatureDocumentParser
+from zensols.mednlp import MedicalLibrary, ConceptEntity
+from util import TestBase
+
+
+class TestExtractEntities(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.lib: MedicalLibrary = self._get_doc_parser(
+            section='mednlp_library')
+
+    def test_extract(self):
+        parser: FeatureDocumentParser = self._get_doc_parser()
+        texts = (self.text_1, '', self.text_2)
+        docs: Tuple[Tuple[ConceptEntity, ...], ...] = tuple(
+            self.lib.extract_entities(texts, batch_size=2))
+        self.assertEqual(3, len(docs))
+        self.assertEqual((), docs[1])
+        text: str
+        ents: Tuple[ConceptEntity, ...]
+        for text, ents in zip(texts, docs):
+            doc: FeatureDocument = parser(text)
+            should: Set[str] = set(map(lambda t: t.cui_, filter(
+                lambda t: t.is_concept, doc.token_iter())))
+            self.assertEqual(should, set(map(lambda e: e.cui, ents)))
+        ent: ConceptEntity = docs[0][0]
+        self.assertEqual('kidney failure', self.text_1[ent.begin:ent.end])
+        self.assertEqual('C0035078', ent.cui)
+        self.assertEqual('Kidney Failure', ent.pref_name)
+        self.assertEqual(parser(self.text_1).tokens[4].tuis, ent.tuis)
+        self.assertIsNone(ent.status)
+
+    def test_dataframe(self):
+        df = self.lib.extract_entity_dataframe(
+            (self.text_1, self.text_2), status=True)
+        self.assertEqual({0, 1}, set(df['doc']))
+        row = df.iloc[0]
+        self.assertEqual('C0035078', row['cui'])
+        self.assertEqual('Affirmed', row['status'])
+
+    def _get_entities(self, text: str) -> Tuple[Tuple[int, int, str], ...]:
+        ents = self.lib.get_entities(text)['entities'].values()
+        return tuple(sorted(map(lambda e: (e['start'], e['end'], e['cui']),
+                                ents)))
+
+    def test_entities_multi(self):
+        texts = (self.text_1, self.text_2, ' '.join([self.text_1] * 4))
+        shoulds = tuple(map(self._get_entities, texts))
+        for max_length in (None, 60):
+            docs = tuple(self.lib.get_entities_multi(
+                texts, batch_size=2, max_length=max_length))
+            self.assertEqual(shoulds, tuple(map(
+                lambda ents: tuple(map(lambda e: (e.begin, e.end, e.cui),
+                                       ents)), docs)))
+        ent: ConceptEntity = docs[0][0]
+        self.assertEqual('Kidney Failure', ent.pref_name)
@@ -0,0 +1,59 @@
+from zensols.cli import CliHarness
+from zensols.config import ConfigFactory
+from zensols.nlp import FeatureToken, FeatureDocument, FeatureDocumentParser
+from zensols.nlp.sparser import SpacyFeatureDocumentParser
+from zensols.mednlp import ApplicationFactory, MedCatResource, MedNLPError
+from util import TestBase
+
+
+class TestFastParser(TestBase):
+    def test_fast_parse(self):
+        text: str = f'{self.text_1} {self.text_2}'
+        parser: FeatureDocumentParser = self._get_doc_parser(
+            'default', 'mednlp_fast_medcat_doc_parser')
+        full_parser: FeatureDocumentParser = self._get_doc_parser()
+        doc: FeatureDocument = parser(text)
+        full_doc: FeatureDocument = full_parser(text)
+        # the rule based sentencizer finds the same sentence boundaries
+        self.assertEqual(2, len(doc.sents))
+        self.assertEqual(tuple(map(lambda t: t.norm, full_doc.token_iter())),
+                         tuple(map(lambda t: t.norm, doc.token_iter())))
+        self.assertEqual(full_parser.token_feature_ids,
+                         parser.token_feature_ids)
+        tok: FeatureToken
+        for tok in doc.token_iter():
+            self.assertEqual(-1, tok.context_similarity)
+            self.assertEqual(FeatureToken.NONE, tok.status_)
+            if tok.is_concept:
+                self.assertTrue(len(tok.tuis) > 0)
+
+    def test_fast_resource(self):
+        harness: CliHarness = ApplicationFactory.create_harness()
+        fac: ConfigFactory = harness.get_config_factory(
+            '--config test-resources/config/filter-profile.conf --level=err')
+        res: MedCatResource = fac('medcat_resource')
+        fast_res: MedCatResource = fac('mednlp_fast_medcat_resource')
+        # filters and the MedCAT configuration are those of the full resource
+        attr: str
+        for attr in 'filter_tuis filter_groups filter_profiles cat_config' \
+                .split():
+            self.assertEqual(getattr(res, attr), getattr(fast_res, attr))
+        self.assertFalse(fast_res.disambiguate)
+        self.assertFalse(
+            fast_res.cat.config.linking['always_calculate_similarity'])
+        # the linker's context model is patched only for MedCAT 1.x
+        with self.assertRaisesRegex(MedNLPError, r'^Disambiguation can not'):
+            MedCatResource._disable_disambiguation(fast_res.cat, '2.0.0')
+
+    def test_model_cache(self):
+        models = SpacyFeatureDocumentParser._MODELS
+        parser: FeatureDocumentParser = self._get_doc_parser(
+            'default', 'mednlp_fast_medcat_doc_parser')
+        parser.model
+        n_models: int = len(models)
+        # the uncached resource of a new factory loads a new pipeline, which
+        # replaces the cached pipeline of the same configuration
+        parser = self._get_doc_parser(
+            'default', 'mednlp_fast_medcat_doc_parser')
+        self.assertIs(parser.medcat_resource.cat.pipe.spacy_nlp, parser.model)
+        self.assertEqual(n_models, len(models))
@@ -0,0 +1,31 @@
+from typing import Tuple
+from zensols.nlp import FeatureToken, FeatureDocument, FeatureDocumentParser
+from zensols.mednlp import MedNLPError
+from util import TestBase
+
+
+class TestFilterProfile(TestBase):
+    def _get_cuis(self, parser: FeatureDocumentParser) -> Tuple[str, ...]:
+        doc: FeatureDocument = parser.parse(self.text_1)
+        return tuple(map(lambda t: t.cui_, doc.token_iter()))
+
+    def test_profiles(self):
+        none = FeatureToken.NONE
+        kf = 'C0035078'
+        parser: FeatureDocumentParser = self._get_doc_parser(
+            'filter-profile', 'mednlp_medcat_doc_parser')
+        cuis = self._get_cuis(parser)
+        self.assertEqual(kf, cuis[4])
+        parser.filter_profile = 'all'
+        self.assertEqual(cuis, self._get_cuis(parser))
+        parser.filter_profile = 'disorders'
+        self.assertEqual(kf, self._get_cuis(parser)[4])
+        parser.filter_profile = 'anatomy'
+        self.assertEqual(none, self._get_cuis(parser)[4])
+
+    def test_missing_profile(self):
+        parser: FeatureDocumentParser = self._get_doc_parser(
+            'filter-profile', 'mednlp_medcat_doc_parser')
+        parser.filter_profile = 'nada'
+        with self.assertRaises(MedNLPError):
+            parser.parse(self.text_1)
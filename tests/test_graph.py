@@ -0,0 +1,65 @@
+import tempfile
+from pathlib import Path
+from zensols.mednlp import MedNLPError
+from zensols.mednlp.graph import ConceptGraph
+from util import TestBase
+
+
+class TestConceptGraph(TestBase):
+    _RELS = (('C1', 'CHD', 'C2', 'isa', 'SNOMEDCT_US', 'N'),
+             ('C2', 'CHD', 'C3', 'isa', 'SNOMEDCT_US', 'N'),
+             ('C3', 'CHD', 'C4', '', 'MSH', 'N'),
+             ('C2', 'PAR', 'C1', 'inverse_isa', 'SNOMEDCT_US', 'N'),
+             ('C1', 'RO', 'C9', '', 'MSH', 'N'),
+             ('C1', 'CHD', 'C5', '', 'MSH', 'O'))
+
+    def setUp(self):
+        super().setUp()
+        path = Path(tempfile.mkdtemp())
+        mrrel: Path = path / 'MRREL.RRF'
+        with open(mrrel, 'w') as f:
+            for cui1, rel, cui2, rela, sab, suppress in self._RELS:
+                cols = [''] * 16
+                cols[0], cols[3], cols[4] = cui1, rel, cui2
+                cols[7], cols[10], cols[14] = rela, sab, suppress
+                f.write('|'.join(cols) + '|\n')
+        self.graph = ConceptGraph(path / 'graph', chunk_size=2)
+        self.graph.build_mrrel(mrrel)
+
+    def tearDown(self):
+        self.graph.clear()
+
+    def test_build(self):
+        graph: ConceptGraph = self.graph
+        self.assertEqual(5, len(graph))
+        self.assertTrue('C4' in graph)
+        # suppressed relation
+        self.assertFalse('C5' in graph)
+        self.assertEqual((('C2', 'CHD', 'isa'), ('C9', 'RO', '')),
+                         graph.get_relations('C1'))
+        self.assertEqual((), graph.get_relations('C0'))
+
+    def test_expand(self):
+        graph: ConceptGraph = self.graph
+        self.assertEqual({'C1': 0, 'C2': 1, 'C9': 1}, graph.expand(['C1']))
+        self.assertEqual({'C1': 0, 'C2': 1, 'C3': 2},
+                         graph.expand(['C1', 'C0'], hops=2, rels=['CHD']))
+        self.assertEqual({'C1': 0, 'C2': 1, 'C3': 2, 'C4': 3},
+                         graph.expand(['C1'], hops=None, rels=['CHD']))
+        self.assertEqual({'C1': 0, 'C2': 1, 'C3': 2},
+                         graph.expand(['C1'], hops=None, relas=['isa']))
+
+    def test_add(self):
+        graph: ConceptGraph = self.graph
+        self.assertEqual(1, graph.add_relations([('C4', 'C7', 'CHD', None)]))
+        self.assertEqual(0, graph.add_relations([('C4', 'C7', 'CHD', '')]))
+        graph = ConceptGraph(graph.path)
+        self.assertEqual(3, graph.expand(['C2'], None, ['CHD'])['C7'])
+        self.assertEqual(6, len(graph.edges))
+
+    def test_no_graph(self):
+        graph = ConceptGraph(Path(tempfile.mkdtemp()) / 'graph')
+        self.assertEqual(0, len(graph))
+        self.assertFalse('C1' in graph)
+        with self.assertRaises(MedNLPError):
+            graph.expand(['C1'])
@@ -0,0 +1,46 @@
+from typing import Dict
+import numpy as np
+from zensols.nlp import FeatureDocument, FeatureDocumentParser
+from zensols.mednlp import MedNLPError
+from zensols.mednlp.index import ConceptIndex
+from util import TestBase
+
+
+class TestConceptIndex(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.index: ConceptIndex = self._get_doc_parser(
+            'index', 'mednlp_concept_index')
+        self.index.clear()
+        parser: FeatureDocumentParser = self._get_doc_parser(
+            'index', 'mednlp_medcat_doc_parser')
+        n_docs: int = self.index.add_texts(
+            parser, (('t1', self.text_1), ('t2', self.text_2)))
+        self.assertEqual(2, n_docs)
+
+    def tearDown(self):
+        self.index.clear()
+
+    def test_query(self):
+        index: ConceptIndex = self.index
+        kf = 'C0035078'
+        self.assertEqual(2, len(index))
+        self.assertEqual(('t1',), index.search(kf))
+        self.assertEqual(('t1', 't2'), index.search('DISO'))
+        self.assertEqual(('t2',), index.search(f'DISO - {kf}'))
+        self.assertEqual(1, index.count(f'{kf} & DISO'))
+        self.assertEqual(0, index.count(f'{kf} & C0000000'))
+        self.assertEqual(2, index.count(f'{kf} | DISO'))
+
+    def test_locations(self):
+        locs: Dict[int, np.ndarray] = self.index.locations('C0035078')
+        self.assertEqual({0}, set(locs.keys()))
+        span = locs[0][0]
+        self.assertEqual(4, span[0])
+        self.assertEqual('kidney', self.text_1[span[1]:span[2]])
+
+    def test_errors(self):
+        with self.assertRaises(MedNLPError):
+            self.index.add((('t1', FeatureDocument(())),))
+        with self.assertRaises(MedNLPError):
+            self.index.query('DISO +')
@@ -0,0 +1,55 @@
+import tempfile
+from pathlib import Path
+from zensols.nlp import FeatureDocumentParser
+from zensols.mednlp import MedCatResource
+from zensols.mednlp.match import ConceptMatcher
+from util import TestBase
+
+
+class TestConceptMatcher(TestBase):
+    def setUp(self):
+        super().setUp()
+        parser: FeatureDocumentParser = self._get_doc_parser()
+        self.res: MedCatResource = parser.medcat_resource
+        self.path = Path(tempfile.mkdtemp()) / 'matcher'
+
+    def test_match(self):
+        matcher = ConceptMatcher(self.res, self.path)
+        text = 'He was diagnosed with kidney failure in the United States.'
+        matches = matcher.match(text)
+        spans = {text[m.lexspan.begin:m.lexspan.end]: m.cuis
+                 for m in matches}
+        self.assertTrue('kidney failure' in spans)
+        self.assertTrue('C0035078' in spans['kidney failure'])
+        self.assertTrue(matcher.has_match(text))
+        self.assertFalse(matcher.has_match('zzqx'))
+        self.assertEqual((text,), tuple(matcher.filter_texts(
+            ('zzqx', text))))
+        # load the compiled automaton
+        loaded = ConceptMatcher(self.res, self.path)
+        self.assertEqual(matches, loaded.match(text))
+        matcher.clear()
+        self.assertFalse(self.path.exists())
+
+    def test_component(self):
+        matcher = ConceptMatcher(self.res, self.path)
+        nlp = self.res.cat.pipe.spacy_nlp
+        doc = matcher(nlp.make_doc('Kidney failure causes edema.'))
+        spans = doc.spans[matcher.span_key]
+        self.assertTrue(any(map(lambda s: s.text == 'Kidney failure' and
+                                s.label_ == 'C0035078', spans)))
+        matcher.clear()
+
+    def test_add_pipe(self):
+        import spacy
+        matchers = (ConceptMatcher(self.res, self.path, span_key='first'),
+                    ConceptMatcher(self.res, self.path, span_key='second'))
+        nlps = (spacy.blank('en'), spacy.blank('en'))
+        for matcher, nlp in zip(matchers, nlps):
+            # both components use the default name
+            matcher.add_pipe(nlp)
+            self.assertEqual(['concept_matcher'], nlp.pipe_names)
+        for matcher, nlp in zip(matchers, nlps):
+            doc = nlp('Kidney failure causes edema.')
+            self.assertEqual({matcher.span_key}, set(doc.spans.keys()))
+        matchers[0].clear()
@@ -0,0 +1,37 @@
+from zensols.nlp import FeatureDocument
+from zensols.mednlp import Metrics, MedCatFeatureDocumentParser
+from util import TestBase
+
+
+class TestMetrics(TestBase):
+    def test_disabled(self):
+        parser: MedCatFeatureDocumentParser = self._get_doc_parser(
+            'default', 'mednlp_medcat_doc_parser')
+        metrics: Metrics = parser.metrics
+        self.assertFalse(metrics.enabled)
+        parser.parse(self.text_1)
+        self.assertEqual(0, len(metrics.stages))
+        self.assertEqual(0, len(metrics.counters))
+
+    def test_parse_stages(self):
+        parser: MedCatFeatureDocumentParser = self._get_doc_parser(
+            'default', 'mednlp_medcat_doc_parser')
+        metrics: Metrics = parser.metrics
+        self.assertIs(metrics, parser.medcat_resource.metrics)
+        should: FeatureDocument = parser.parse(self.text_1)
+        metrics.enabled = True
+        try:
+            doc: FeatureDocument = parser.parse(self.text_1)
+        finally:
+            metrics.enabled = False
+        self.assertEqual(tuple(map(lambda t: t.cui_, should.token_iter())),
+                         tuple(map(lambda t: t.cui_, doc.token_iter())))
+        stages = set(metrics.stages.keys())
+        for stage in 'parse spacy.tokenizer features'.split():
+            self.assertTrue(f'medcat.{stage}' in stages, stage)
+        self.assertEqual(1, metrics.stages['medcat.parse'].calls)
+        self.assertEqual(1, metrics.counters['docs'])
+        self.assertEqual(doc.token_len, metrics.counters['tokens'])
+        self.assertEqual(len(doc.entities), metrics.counters['entities'])
+        metrics.reset()
+        self.assertEqual(0, len(metrics.stages))
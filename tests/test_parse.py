@@ -59,6 +59,11 @@ class TestParse(TestBase):
         for s in obj['sentences']:
             for t in s['tokens']:
                 del t['context_similarity']
+                # codes depend on the CDB and are tested in test_codes
+                del t['cui_code']
+                del t['tui_bits']
+                # depends on the MetaCAT model and is tested in test_status
+                del t['status_']
         # enable to re-write `should` test data for API changes; but have to
         # remove all `context_simirity` entries
         if WRITE:
@@ -0,0 +1,57 @@
+from typing import Tuple, Any
+from zensols.nlp import FeatureDocument, FeatureDocumentParser
+from util import TestBase
+
+
+class TestReparse(TestBase):
+    _ATTRS = 'i idx i_sent norm cui_'.split()
+
+    def setUp(self):
+        super().setUp()
+        self.parser: FeatureDocumentParser = self._get_doc_parser(
+            'default', 'mednlp_medcat_doc_parser')
+
+    def _features(self, doc: FeatureDocument) -> Tuple[Tuple[Any, ...], ...]:
+        return tuple(map(lambda t: tuple(map(lambda a: getattr(t, a),
+                                             self._ATTRS)),
+                         doc.token_iter()))
+
+    def _assert_reparse(self, prev_text: str, text: str):
+        prev: FeatureDocument = self.parser.parse(prev_text)
+        prev_feats = self._features(prev)
+        doc: FeatureDocument = self.parser.reparse(prev, text)
+        should: FeatureDocument = self.parser.parse(text)
+        self.assertEqual(text, doc.text)
+        self.assertEqual(len(should.sents), len(doc.sents))
+        self.assertEqual(self._features(should), self._features(doc))
+        self.assertEqual(tuple(map(lambda e: e.text, should.entities)),
+                         tuple(map(lambda e: e.text, doc.entities)))
+        for tok in doc.token_iter():
+            self.assertEqual(tok.text, text[tok.lexspan.begin:tok.lexspan.end])
+        # the previous parse is left as is
+        self.assertEqual(prev_feats, self._features(prev))
+
+    def test_append(self):
+        self._assert_reparse(
+            self.text_1, f'{self.text_1} {self.text_2}')
+
+    def test_prepend(self):
+        self._assert_reparse(
+            self.text_2, f'{self.text_1} {self.text_2}')
+
+    def test_edit(self):
+        prev: str = f'{self.text_1} {self.text_2} {self.text_1}'
+        text: str = prev.replace('kidney failure', 'renal failure', 1)
+        self.assertNotEqual(prev, text)
+        self._assert_reparse(prev, text)
+
+    def test_unchanged(self):
+        self._assert_reparse(self.text_1, self.text_1)
+
+    def test_blank_line(self):
+        # sentences of only whitespace have no tokens and offsets
+        prev: str = f'{self.text_1}\n\n\n{self.text_2}\n\n\n{self.text_1}'
+        self._assert_reparse(prev, prev.replace('He loved', 'She loved'))
+        self._assert_reparse(prev, prev.replace(
+            '\n\n\nHe was', '\n\n\nThen he was'))
+        self._assert_reparse(prev, f'{prev}\n\n\n{self.text_2}')
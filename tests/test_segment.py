@@ -0,0 +1,71 @@
+from typing import Tuple, Any
+from zensols.nlp import (
+    FeatureDocument, FeatureDocumentParser, FeatureDocumentDecorator
+)
+from zensols.mednlp import MedNLPError
+from util import TestBase
+
+
+class _SpacyEntityDecorator(FeatureDocumentDecorator):
+    def decorate(self, doc: FeatureDocument):
+        doc.n_spacy_ents = len(doc.spacy_doc.ents)
+
+
+class TestSegmentedParse(TestBase):
+    _ATTRS = 'i idx i_sent norm cui_'.split()
+
+    def setUp(self):
+        super().setUp()
+        self.parser: FeatureDocumentParser = self._get_doc_parser(
+            'segment', 'mednlp_medcat_doc_parser')
+
+    def _features(self, doc: FeatureDocument, attrs: Tuple[str, ...] = None) \
+            -> Tuple[Tuple[Any, ...], ...]:
+        attrs = self._ATTRS if attrs is None else attrs
+        return tuple(map(lambda t: tuple(map(lambda a: getattr(t, a), attrs)),
+                         doc.token_iter()))
+
+    def _parse(self, text: str) -> Tuple[FeatureDocument, FeatureDocument]:
+        parser: FeatureDocumentParser = self.parser
+        segmenter = parser.segmenter
+        self.assertEqual(100, segmenter.max_length)
+        seg_doc: FeatureDocument = parser.parse(text)
+        parser.segmenter = None
+        try:
+            doc: FeatureDocument = parser.parse(text)
+        finally:
+            parser.segmenter = segmenter
+        self.assertEqual(text, seg_doc.text)
+        self.assertEqual(len(doc.sents), len(seg_doc.sents))
+        self.assertEqual(tuple(map(lambda e: e.text, doc.entities)),
+                         tuple(map(lambda e: e.text, seg_doc.entities)))
+        for tok in seg_doc.token_iter():
+            self.assertEqual(tok.text, text[tok.lexspan.begin:tok.lexspan.end])
+        return doc, seg_doc
+
+    def test_segmented(self):
+        text: str = ' '.join([self.text_1, self.text_2] * 3)
+        doc, seg_doc = self._parse(text)
+        self.assertEqual(self._features(doc), self._features(seg_doc))
+
+    def test_whitespace_boundary(self):
+        text: str = '  '.join([self.text_1, self.text_2] * 3)
+        doc, seg_doc = self._parse(text)
+        attrs: Tuple[str, ...] = tuple(self._ATTRS[1:])
+        self.assertEqual(self._features(doc, attrs),
+                         self._features(seg_doc, attrs))
+        # the whitespace between segments adds no token indexes
+        idxs: Tuple[int, ...] = tuple(map(lambda t: t.i, seg_doc.token_iter()))
+        self.assertEqual(tuple(sorted(set(idxs))), idxs)
+        self.assertTrue(all(map(lambda t: t[0].i >= t[1].i, zip(
+            doc.token_iter(), seg_doc.token_iter()))))
+
+    def test_spacy_decorator(self):
+        text: str = ' '.join([self.text_1, self.text_2] * 3)
+        self.parser.document_decorators = (_SpacyEntityDecorator(),)
+        with self.assertRaisesRegex(MedNLPError, r'^Document decorator'):
+            self.parser.parse(text)
+        # documents parsed in one spaCy document are decorated
+        self.parser.segmenter = None
+        doc: FeatureDocument = self.parser.parse(text)
+        self.assertTrue(doc.n_spacy_ents > 0)
@@ -0,0 +1,40 @@
+from typing import Tuple
+from zensols.nlp import FeatureDocument, FeatureDocumentParser
+from zensols.mednlp import MedCatResource, SharedConceptTables
+from util import TestBase
+
+
+class TestSharedTables(TestBase):
+    _FEATURES = 'cui_ cui_code tuis_ pref_name_ sub_names'.split()
+
+    def _features(self, parser: FeatureDocumentParser) -> Tuple[Tuple, ...]:
+        doc: FeatureDocument = parser.parse(self.text_1)
+        return tuple(map(lambda t: tuple(map(lambda f: getattr(t, f),
+                                             self._FEATURES)),
+                         doc.token_iter()))
+
+    def test_shared(self):
+        parser: FeatureDocumentParser = self._get_doc_parser('shared')
+        res: MedCatResource = parser.medcat_resource
+        tables: SharedConceptTables = res.shared_tables
+        self.assertTrue(tables.path.is_dir())
+        self.assertFalse(isinstance(res.cat.cdb.cui2names, dict))
+        code: int = res.concept_codes.get_cui_code('C0035078')
+        self.assertEqual('Kidney Failure', tables.get_pref_name(code))
+        tuis = res.concept_codes.get_tuis(res.concept_codes.get_tui_bits(code))
+        type_id2cuis = res.cat.cdb.addl_info['type_id2cuis']
+        self.assertFalse(isinstance(type_id2cuis, dict))
+        self.assertTrue('C0035078' in type_id2cuis[tuis[0]])
+        # the pipeline links with the CDB that has the shared tables
+        med_parser: FeatureDocumentParser = self._get_doc_parser(
+            'shared', 'mednlp_medcat_doc_parser')
+        med_res: MedCatResource = med_parser.medcat_resource
+        self.assertFalse(isinstance(med_res.cat.cdb.cui2names, dict))
+        self.assertIs(med_res.cat.pipe.spacy_nlp, med_parser.model)
+        cdbs = tuple(filter(lambda c: c is not None, map(
+            lambda p: getattr(p[1], 'cdb', None), med_parser.model.pipeline)))
+        self.assertTrue(len(cdbs) > 0)
+        for cdb in cdbs:
+            self.assertIs(med_res.cat.cdb, cdb)
+        should = self._features(self._get_doc_parser())
+        self.assertEqual(should, self._features(parser))
@@ -0,0 +1,61 @@
+import tempfile
+from pathlib import Path
+import pandas as pd
+from zensols.nlp import FeatureDocumentParser
+from zensols.mednlp import MedNLPError
+from zensols.mednlp.stats import ConceptStatistics
+from util import TestBase
+
+
+class TestConceptStatistics(TestBase):
+    def setUp(self):
+        super().setUp()
+        self.parser: FeatureDocumentParser = self._get_doc_parser()
+        self.text_3 = 'He has kidney failure. Kidney failure causes edema.'
+
+    def _stats(self, *texts: str) -> ConceptStatistics:
+        stats = ConceptStatistics(flush_size=1)
+        stats.add_docs(map(lambda t: (t, self.parser(t)), texts))
+        return stats
+
+    def test_counts(self):
+        kf = 'C0035078'
+        stats: ConceptStatistics = self._stats(self.text_1, self.text_3)
+        self.assertEqual(2, stats.n_docs)
+        self.assertEqual(3, stats.n_sents)
+        df: pd.DataFrame = stats.frequencies().set_index('cui')
+        # the two tokens of 'kidney failure' are one mention
+        self.assertEqual(3, df.loc[kf, 'count'])
+        self.assertEqual(3, df.loc[kf, 'sents'])
+        self.assertEqual(2, df.loc[kf, 'docs'])
+        self.assertEqual(kf, stats.top_cuis(1)['cui'][0])
+        self.assertEqual(len(stats.cuis), stats.sent_cooc.shape[0])
+        self.assertEqual((len(stats.cuis), 2), stats.cui_doc.shape)
+        self.assertTrue(len(stats.top_tuis()) > 0)
+        co: pd.DataFrame = stats.cooccurrences(kf, level='doc')
+        self.assertTrue(kf not in set(co['cui']))
+        self.assertTrue((co['count'] > 0).all())
+        with self.assertRaises(MedNLPError):
+            stats.cooccurrences(kf, level='para')
+
+    def test_measures(self):
+        stats: ConceptStatistics = self._stats(self.text_1, self.text_3)
+        pairs: pd.DataFrame = stats.top_pairs(level='sent', measure='lift')
+        row = pairs.iloc[0]
+        self.assertAlmostEqual(
+            row['lift'], stats.lift(row['cui_a'], row['cui_b']))
+        self.assertAlmostEqual(
+            row['pmi'], stats.pmi(row['cui_a'], row['cui_b']))
+
+    def test_merge_persist(self):
+        should: ConceptStatistics = self._stats(
+            self.text_1, self.text_2, self.text_3)
+        stats: ConceptStatistics = self._stats(self.text_1)
+        with tempfile.TemporaryDirectory() as tmp:
+            self._stats(self.text_2, self.text_3).save(Path(tmp))
+            stats.merge(ConceptStatistics.load(Path(tmp)))
+        self.assertEqual(should.doc_names, stats.doc_names)
+        self.assertEqual(should.tui_counts, stats.tui_counts)
+        self.assertTrue(should.frequencies().equals(stats.frequencies()))
+        self.assertTrue(should.top_pairs(level='doc').equals(
+            stats.top_pairs(level='doc')))
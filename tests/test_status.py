@@ -0,0 +1,39 @@
+from typing import Tuple
+from zensols.nlp import FeatureToken, FeatureDocument, FeatureDocumentParser
+from util import TestBase
+
+
+class TestStatus(TestBase):
+    def _get_status(self, parser: FeatureDocumentParser) -> Tuple[str, ...]:
+        doc: FeatureDocument = parser.parse(self.text_1)
+        return tuple(map(lambda t: t.status_, doc.token_iter()))
+
+    def test_status(self):
+        none = FeatureToken.NONE
+        parser: FeatureDocumentParser = self._get_doc_parser()
+        status: Tuple[str, ...] = self._get_status(parser)
+        self.assertEqual('Affirmed', status[4])
+        self.assertEqual(none, status[0])
+        parser.meta_annotate = False
+        try:
+            self.assertEqual(none, self._get_status(parser)[4])
+        finally:
+            parser.meta_annotate = True
+
+    def test_filtered_status(self):
+        none = FeatureToken.NONE
+        parser: FeatureDocumentParser = self._get_doc_parser(
+            'filter-profile', 'mednlp_medcat_doc_parser')
+        parser.filter_profile = 'disorders'
+        self.assertEqual('Affirmed', self._get_status(parser)[4])
+        parser.filter_profile = 'anatomy'
+        self.assertEqual(none, self._get_status(parser)[4])
+
+    def test_no_meta_cats(self):
+        parser: FeatureDocumentParser = self._get_doc_parser(
+            'no-meta', 'mednlp_medcat_doc_parser')
+        # the pipeline with MetaCAT of other tests is not used
+        self.assertEqual((), parser._get_meta_cats())
+        doc: FeatureDocument = parser.parse(self.text_1)
+        self.assertEqual('C0035078', doc.tokens[4].cui_)
+        self.assertEqual(FeatureToken.NONE, doc.tokens[4].status_)